@@ -1,11 +1,21 @@
-import base64
-import errno
-from itertools import islice
+import binascii
+import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+import json
 import os
+import re
 import sys
+import threading
+import time
 import uuid
 
-from google.cloud.exceptions import NotFound, Forbidden, BadRequest
+from google.cloud._helpers import UTC, _datetime_to_rfc3339, \
+    _rfc3339_to_datetime
+from google.cloud.exceptions import NotFound, Forbidden, BadRequest, \
+    GoogleCloudError, PreconditionFailed
 from google.cloud.storage import Client as GSClient, Blob
 import nbformat
 from notebook.services.contents.checkpoints import Checkpoints, \
@@ -18,19 +28,44 @@ except ImportError:
 from notebook.services.contents.manager import ContentsManager
 from tornado import web
 from tornado.escape import url_unescape
-from traitlets import Any, Bool, Int, Unicode, default
-
-
-if sys.version_info[0] == 2:
-    import socket
-    BrokenPipeError = socket.error
-    base64.encodebytes = base64.encodestring
-    base64.decodebytes = base64.decodestring
-else:
+from traitlets import Any, Bool, Float, Int, List, Unicode, default, \
+    observe, validate
+from traitlets.utils.importstring import import_item
+
+from jgscm.backend import GCSBackend, StorageObject
+from jgscm.bulk import Progress, run_parallel
+from jgscm.cache import DiskCache, LRUCache
+from jgscm.coalesce import WriteCoalescer
+from jgscm.codec import crc32c_base64, decode_utf8, encode_base64, \
+    iter_base64, md5_base64
+from jgscm.metrics import Metrics, measured, register_prometheus
+from jgscm.retry import RetryPolicy
+from jgscm.tracing import LoggingTracer, traced
+from jgscm.transport import configure_session
+
+
+if sys.version_info[0] == 3:
     unicode = str
 
 
 class GoogleStorageCheckpoints(GenericCheckpointsMixin, Checkpoints):
+    """
+    Keeps the checkpoints next to the files in checkpoint_dir. The ids and
+    the timestamps of each file's checkpoints are recorded in the manifest
+    "<file name>.manifest.json" in the same directory, so that listing the
+    checkpoints does not list the bucket.
+    """
+
+    MANIFEST_SUFFIX = ".manifest.json"
+
+    @property
+    def metrics(self):
+        return self.parent.metrics
+
+    @property
+    def tracer(self):
+        return self.parent.tracer
+
     checkpoint_dir = Unicode(
         ".ipynb_checkpoints",
         config=True,
@@ -45,6 +80,66 @@ class GoogleStorageCheckpoints(GenericCheckpointsMixin, Checkpoints):
         "", config=True, help="The bucket name where to keep file checkpoints."
                               " If empty, the current bucket is used."
     )
+    keep_checkpoints = Int(
+        0, config=True,
+        help="The maximum number of checkpoints to keep for each file. The "
+             "older checkpoints are deleted when a new one is created. 0 "
+             "keeps all.")
+    keep_checkpoints_days = Float(
+        0, config=True,
+        help="The number of days after which the checkpoints are deleted "
+             "when a new one is created. The newest checkpoint is always "
+             "kept. 0 keeps the checkpoints forever.")
+
+    @traced
+    @measured
+    def create_checkpoint(self, contents_mgr, path):
+        """Create a checkpoint as a server-side copy of the file's blob.
+
+        Returns a checkpoint model for the new checkpoint.
+        """
+        if path.startswith("/"):
+            path = path[1:]
+        exists, blob = contents_mgr._fetch(path, fresh=True)
+        if not exists or not isinstance(blob, StorageObject):
+            raise web.HTTPError(404, u"No such file: %s" % path)
+        checkpoint_id = str(uuid.uuid4())
+        cp = self._get_checkpoint_path(checkpoint_id, path)
+        self.log.debug("creating checkpoint %s for %s as %s",
+                       checkpoint_id, path, cp)
+        new_blob = self._copy_to(contents_mgr, blob, cp)
+        model = {
+            "id": checkpoint_id,
+            "last_modified": new_blob.updated,
+        }
+        self._update_manifest(path, add=model)
+        return model
+
+    @traced
+    @measured
+    def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        """Restore a checkpoint with a server-side copy over the file."""
+        if path.startswith("/"):
+            path = path[1:]
+        self.log.info("restoring %s from checkpoint %s", path, checkpoint_id)
+        cp = self._get_checkpoint_path(checkpoint_id, path)
+        exists, blob = contents_mgr._fetch(cp, fresh=True)
+        if not exists:
+            raise web.HTTPError(404, u"No such checkpoint: %s for %s" % (
+                checkpoint_id, path))
+        self._copy_to(contents_mgr, blob, path)
+
+    @staticmethod
+    def _copy_to(contents_mgr, blob, path):
+        """
+        Copies the blob to the path and updates the manager's caches.
+        :return: :class:`jgscm.backend.StorageObject` of the copy.
+        """
+        bucket_name, bucket_path = contents_mgr._parse_path(path)
+        bucket = contents_mgr._get_bucket(bucket_name, throw=True)
+        new_blob = contents_mgr._copy_blob(blob, bucket, bucket_path)
+        contents_mgr._cache_blob(path, new_blob)
+        return new_blob
 
     def create_file_checkpoint(self, content, format, path):
         """Create a checkpoint of the current state of a file
@@ -56,10 +151,12 @@ class GoogleStorageCheckpoints(GenericCheckpointsMixin, Checkpoints):
         self.log.debug("creating checkpoint %s for %s as %s",
                        checkpoint_id, path, cp)
         blob = self.parent._save_file(cp, content, format)
-        return {
+        model = {
             "id": checkpoint_id,
             "last_modified": blob.updated,
         }
+        self._update_manifest(path, add=model)
+        return model
 
     def create_notebook_checkpoint(self, nb, path):
         """Create a checkpoint of the current state of a file
@@ -71,10 +168,12 @@ class GoogleStorageCheckpoints(GenericCheckpointsMixin, Checkpoints):
         self.log.debug("creating checkpoint %s for %s as %s",
                        checkpoint_id, path, cp)
         blob = self.parent._save_notebook(cp, nb)
-        return {
+        model = {
             "id": checkpoint_id,
             "last_modified": blob.updated,
         }
+        self._update_manifest(path, add=model)
+        return model
 
     def get_file_checkpoint(self, checkpoint_id, path):
         """Get the content of a checkpoint for a non-notebook file.
@@ -120,36 +219,286 @@ class GoogleStorageCheckpoints(GenericCheckpointsMixin, Checkpoints):
             "content": nb
         }
 
+    @traced
+    @measured
     def rename_checkpoint(self, checkpoint_id, old_path, new_path):
         """Rename a single checkpoint from old_path to new_path."""
         old_cp = self._get_checkpoint_path(checkpoint_id, old_path)
         new_cp = self._get_checkpoint_path(checkpoint_id, new_path)
+        exists, blob = self.parent._fetch(old_cp, fresh=True)
         self.parent.rename_file(old_cp, new_cp)
-
+        self._update_manifest(old_path, remove={checkpoint_id})
+        if exists:
+            self._update_manifest(new_path, add={
+                "id": checkpoint_id,
+                "last_modified": blob.updated,
+            })
+
+    @traced
+    @measured
+    def rename_all_checkpoints(self, old_path, new_path):
+        """Rename all checkpoints for old_path to new_path."""
+        checkpoints = self.list_checkpoints(old_path)
+        if not checkpoints:
+            return
+        for checkpoint in checkpoints:
+            self.parent.rename_file(
+                self._get_checkpoint_path(checkpoint["id"], old_path),
+                self._get_checkpoint_path(checkpoint["id"], new_path))
+        self._update_manifest(new_path, add=checkpoints)
+        self._update_manifest(old_path,
+                              remove={c["id"] for c in checkpoints})
+
+    @traced
+    @measured
     def delete_checkpoint(self, checkpoint_id, path):
         """delete a checkpoint for a file"""
         cp = self._get_checkpoint_path(checkpoint_id, path)
         self.parent.delete_file(cp)
+        self._update_manifest(path, remove={checkpoint_id})
+
+    @traced
+    @measured
+    def delete_all_checkpoints(self, path):
+        """Delete all checkpoints for the given path."""
+        checkpoints = self.list_checkpoints(path)
+        if not checkpoints:
+            return
+        self._delete_checkpoint_blobs(path, checkpoints)
+        self._update_manifest(path, remove={c["id"] for c in checkpoints})
 
+    def _delete_checkpoint_blobs(self, path, checkpoints):
+        """
+        Deletes the checkpoint blobs in batch requests. The failures are
+        logged.
+        :param path: the file path.
+        :param checkpoints: list of checkpoint models.
+        :return: None
+        """
+        bucket_name, _ = self.parent._parse_path(
+            self._get_checkpoint_path(None, path))
+        bucket = self.parent._get_bucket(bucket_name, throw=True)
+        names = []
+        for checkpoint in checkpoints:
+            cp = self._get_checkpoint_path(checkpoint["id"], path)
+            names.append(self.parent._parse_path(cp)[1])
+            self.parent._invalidate(cp)
+        size = self.parent.delete_batch_size
+        failed = []
+        for i in range(0, len(names), size):
+            failed.extend(self.parent._delete_batch(bucket,
+                                                    names[i:i + size]))
+        if failed:
+            self.log.error("Failed to delete the checkpoints of %s: %s",
+                           path, ", ".join(failed))
+
+    @traced
+    @measured
     def list_checkpoints(self, path):
         """Return a list of checkpoints for a given file"""
+        checkpoints = self._read_manifest(path)
+        if checkpoints is None:
+            # the checkpoints were created before the manifests existed
+            checkpoints = self._list_checkpoint_blobs(path)
+            if checkpoints:
+                try:
+                    self._write_manifest(path, checkpoints, generation=0)
+                except PreconditionFailed:
+                    # created concurrently, it is read the next time
+                    pass
+            else:
+                self.parent._cache_put(
+                    "manifest", self._get_manifest_path(path), [])
+        checkpoints = sorted((dict(c) for c in checkpoints),
+                             key=lambda c: c["last_modified"], reverse=True)
+        self.log.debug("list_checkpoints: %s: %s", path, checkpoints)
+        return checkpoints
+
+    def _list_checkpoint_blobs(self, path):
+        """
+        Lists the checkpoint blobs of the file.
+        :param path: the file path.
+        :return: list of checkpoint models.
+        """
         cp = self._get_checkpoint_path(None, path)
         bucket_name, bucket_path = self.parent._parse_path(cp)
+        _, _, name, ext = self._checkpoint_location(path)
+        pattern = re.compile(
+            "%s-([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"
+            "%s$" % (re.escape(name), re.escape(ext)))
         try:
-            bucket = self.parent._get_bucket(bucket_name)
-            it = bucket.list_blobs(prefix=bucket_path, delimiter="/",
-                                   max_results=self.parent.max_list_size)
-            checkpoints = [{
-                "id": os.path.splitext(file.path)[0][-36:],
-                "last_modified": file.updated,
-            } for file in islice(it, self.parent.max_list_size)]
+            bucket = self.parent._get_bucket(bucket_name, throw=True)
+            checkpoints = []
+            for blobs, _ in self.parent._iter_pages(bucket, bucket_path, "/"):
+                for blob in blobs:
+                    match = pattern.match(self.parent._get_blob_name(blob))
+                    if match is not None:
+                        checkpoints.append({
+                            "id": match.group(1),
+                            "last_modified": blob.updated,
+                        })
         except NotFound:
             return []
-        checkpoints.sort(key=lambda c: c["last_modified"], reverse=True)
-        self.log.debug("list_checkpoints: %s: %s", path, checkpoints)
         return checkpoints
 
-    def _get_checkpoint_path(self, checkpoint_id, path):
+    def _read_manifest(self, path, fresh=False):
+        """
+        Reads the checkpoint manifest of the file.
+        :param path: the file path.
+        :param fresh: ignore the metadata cache.
+        :return: list of checkpoint models or None if the manifest does not
+                 exist.
+        """
+        manifest = self._get_manifest_path(path)
+        if not fresh:
+            try:
+                return self.parent._cache_get("manifest", manifest)
+            except KeyError:
+                pass
+        return self._load_manifest(path)[0]
+
+    def _load_manifest(self, path):
+        """
+        Reads the checkpoint manifest of the file and its generation, which
+        the next write is conditional on.
+        :param path: the file path.
+        :return: tuple(list of checkpoint models or None if the manifest
+                 does not exist or is invalid, the manifest's generation or
+                 0 if it does not exist).
+        """
+        manifest = self._get_manifest_path(path)
+        bucket_name, bucket_path = self.parent._parse_path(manifest)
+        backend = self.parent.backend
+        try:
+            bucket = self.parent._get_bucket(bucket_name, throw=True)
+            obj = backend.stat(bucket, bucket_path)
+            if obj is None:
+                return None, 0
+            # the contents may be newer than the generation, then the write
+            # fails and is repeated
+            data = backend.read(bucket, bucket_path)
+        except NotFound:
+            return None, 0
+        try:
+            checkpoints = [{
+                "id": c["id"],
+                "last_modified": _rfc3339_to_datetime(c["last_modified"]),
+            } for c in json.loads(data.decode("utf-8"))["checkpoints"]]
+        except (ValueError, KeyError, TypeError) as e:
+            self.log.warning("Invalid checkpoint manifest %s: %s",
+                             manifest, e)
+            return None, obj.generation
+        self.parent._cache_put("manifest", manifest, checkpoints)
+        return checkpoints, obj.generation
+
+    def _write_manifest(self, path, checkpoints, generation=None):
+        """
+        Writes the checkpoint manifest of the file. An empty manifest is
+        deleted.
+        :param path: the file path.
+        :param checkpoints: list of checkpoint models.
+        :param generation: the generation which the manifest must have, 0
+                           if it must not exist, None to overwrite it
+                           unconditionally.
+        :return: None
+        :raises PreconditionFailed: the manifest's generation is different.
+        """
+        manifest = self._get_manifest_path(path)
+        bucket_name, bucket_path = self.parent._parse_path(manifest)
+        self.parent._invalidate(manifest)
+        try:
+            bucket = self.parent._get_bucket(bucket_name, throw=True)
+            if checkpoints:
+                self.parent.backend.write(
+                    bucket, bucket_path, json.dumps({"checkpoints": [{
+                        "id": c["id"],
+                        "last_modified": _datetime_to_rfc3339(
+                            c["last_modified"]),
+                    } for c in checkpoints]}).encode("utf-8"),
+                    "application/json", if_generation_match=generation)
+            elif generation != 0:
+                self.parent.backend.delete(bucket, bucket_path,
+                                           if_generation_match=generation)
+        except NotFound:
+            if checkpoints:
+                raise
+        self.parent._cache_put("manifest", manifest, list(checkpoints))
+
+    def _update_manifest(self, path, add=None, remove=()):
+        """
+        Adds and removes checkpoints in the manifest of the file. The
+        manifest is written only if it did not change since it was read,
+        otherwise the update is repeated after the retry policy's delay,
+        so the concurrent updates are not lost.
+        :param path: the file path.
+        :param add: checkpoint model or list of them to add.
+        :param remove: ids of the checkpoints to remove.
+        :return: None
+        :raises web.HTTPError: 409 if the manifest kept changing for as many
+                               attempts or as long as the retry policy
+                               allows.
+        """
+        if isinstance(add, dict):
+            add = [add]
+        add = add or []
+        skip = set(remove) | {c["id"] for c in add}
+        policy = self.parent.retry_policy
+        start = time.monotonic()
+        failures = 0
+        while True:
+            checkpoints, generation = self._load_manifest(path)
+            if checkpoints is None:
+                checkpoints = self._list_checkpoint_blobs(path)
+            checkpoints = [c for c in checkpoints
+                           if c["id"] not in skip] + add
+            expired = self._expire(checkpoints) if add else []
+            if expired:
+                ids = {c["id"] for c in expired}
+                checkpoints = [c for c in checkpoints if c["id"] not in ids]
+            try:
+                self._write_manifest(path, checkpoints, generation)
+                break
+            except PreconditionFailed:
+                failures += 1
+                if failures > policy.attempts or policy.deadline > 0 and \
+                        time.monotonic() - start > policy.deadline:
+                    raise web.HTTPError(
+                        409, u"The checkpoints of %s are being changed "
+                             u"concurrently" % path)
+                self.log.debug("the manifest of %s changed, updating again",
+                               path)
+                policy.wait(failures, "update_manifest")
+        if expired:
+            self.log.debug("pruning %d checkpoints of %s", len(expired), path)
+            self._delete_checkpoint_blobs(path, expired)
+
+    def _expire(self, checkpoints):
+        """
+        Applies keep_checkpoints and keep_checkpoints_days.
+        :param checkpoints: list of checkpoint models.
+        :return: list of the checkpoint models to delete.
+        """
+        # the added checkpoints are the last, prefer them on ties
+        checkpoints = sorted(reversed(checkpoints),
+                             key=lambda c: c["last_modified"], reverse=True)
+        keep = checkpoints
+        if self.keep_checkpoints > 0:
+            keep = keep[:self.keep_checkpoints]
+        if self.keep_checkpoints_days > 0:
+            deadline = datetime.now(UTC) - timedelta(
+                days=self.keep_checkpoints_days)
+            keep = keep[:1] + [c for c in keep[1:]
+                               if c["last_modified"] >= deadline]
+        # the newest checkpoints are kept
+        return checkpoints[len(keep):]
+
+    def _checkpoint_location(self, path):
+        """
+        :param path: the file path.
+        :return: tuple(checkpoint bucket name, checkpoint directory inside
+                 the bucket with the trailing slash, file name without the
+                 extension, extension).
+        """
         if path.startswith("/"):
             path = path[1:]
         bucket_name, bucket_path = self.parent._parse_path(path)
@@ -157,12 +506,20 @@ class GoogleStorageCheckpoints(GenericCheckpointsMixin, Checkpoints):
             bucket_name = self.checkpoint_bucket
         slash = bucket_path.rfind("/") + 1
         name, ext = os.path.splitext(bucket_path[slash:])
+        return (bucket_name, "%s%s/" % (bucket_path[:slash],
+                                        self.checkpoint_dir), name, ext)
+
+    def _get_checkpoint_path(self, checkpoint_id, path):
+        bucket_name, cp_dir, name, ext = self._checkpoint_location(path)
         if checkpoint_id is not None:
-            return "%s/%s%s/%s-%s%s" % (
-                bucket_name, bucket_path[:slash], self.checkpoint_dir, name,
-                checkpoint_id, ext)
-        return "%s/%s%s/%s" % (bucket_name, bucket_path[:slash],
-                               self.checkpoint_dir, name)
+            return "%s/%s%s-%s%s" % (bucket_name, cp_dir, name,
+                                     checkpoint_id, ext)
+        return "%s/%s%s" % (bucket_name, cp_dir, name)
+
+    def _get_manifest_path(self, path):
+        bucket_name, cp_dir, name, ext = self._checkpoint_location(path)
+        return "%s/%s%s%s%s" % (bucket_name, cp_dir, name, ext,
+                                self.MANIFEST_SUFFIX)
 
 
 class GoogleStorageContentManager(ContentsManager):
@@ -178,7 +535,13 @@ class GoogleStorageContentManager(ContentsManager):
              "for authorization. If you do not set this parameter, "
              "google.cloud will be OK if the default project exists."
     )
-    max_list_size = Int(128, config=True, help="list_blobs() limit")
+    max_list_size = Int(128, config=True,
+                        help="Deprecated and ignored, the listings are not "
+                             "truncated any more. See list_page_size.")
+    list_page_size = Int(1000, config=True,
+                         help="The number of blobs requested per list_blobs() "
+                              "call. Larger listings are fetched page by "
+                              "page. GCS returns at most 1000.")
     cache_buckets = Bool(True, config=True,
                          help="Value indicating whether to cache the bucket "
                               "objects for faster operations.")
@@ -191,6 +554,137 @@ class GoogleStorageContentManager(ContentsManager):
         help="The base name used when creating untitled directories.")
     default_path = Unicode(
         "", config=True, help="The default path to open.")
+    metadata_cache_size = Int(
+        1024, config=True,
+        help="The maximum number of blob metadata records and directory "
+             "listings to cache. 0 disables the cache.")
+    metadata_cache_ttl = Float(
+        10, config=True,
+        help="The number of seconds after which the cached blob metadata "
+             "and directory listings expire.")
+    content_cache_size = Int(
+        64 << 20, config=True,
+        help="The maximum total size in bytes of the blob contents cached "
+             "in memory. The contents are reused while the blob generation "
+             "does not change. 0 disables the cache.")
+    disk_cache_dir = Unicode(
+        "", config=True,
+        help="The local directory where the downloaded blob contents are "
+             "cached across restarts, preferably on an SSD. It can be "
+             "shared by several servers on the same host. Empty disables "
+             "the cache.")
+    disk_cache_size = Int(
+        1 << 30, config=True,
+        help="The maximum total size in bytes of the files in "
+             "disk_cache_dir.")
+    parallel_download_threshold = Int(
+        64 << 20, config=True,
+        help="Files larger than this number of bytes are downloaded in "
+             "byte ranges in parallel.")
+    download_chunk_size = Int(
+        16 << 20, config=True,
+        help="The size in bytes of a byte range in parallel downloads.")
+    download_workers = Int(
+        8, config=True,
+        help="The number of byte ranges downloaded concurrently.")
+    resumable_upload_threshold = Int(
+        16 << 20, config=True,
+        help="Files larger than this number of bytes are uploaded in chunks "
+             "through a resumable upload, which retries the failed chunks "
+             "instead of the whole file.")
+    upload_chunk_size = Int(
+        8 << 20, config=True,
+        help="The size in bytes of a resumable upload chunk. It is rounded "
+             "down to a multiple of 256 KiB.")
+    upload_retries = Int(
+        5, config=True,
+        help="The number of times a resumable upload chunk is retried.")
+    chunked_upload_idle = Int(
+        300, config=True,
+        help="The number of seconds after the last chunk during which an "
+             "unfinished chunked upload is considered in progress. Uploading "
+             "the same file again fails with 409 until then.")
+    chunked_upload_ttl = Int(
+        86400, config=True,
+        help="The number of seconds after which the temporary blobs of an "
+             "unfinished chunked upload are considered abandoned. They are "
+             "deleted when another file in the same directory is uploaded "
+             "in chunks.")
+    skip_unchanged_uploads = Bool(
+        True, config=True,
+        help="Do not upload the files and notebooks which contents did not "
+             "change since they were saved, e.g. by autosave. The existing "
+             "checksum is confirmed with a metadata request.")
+    coalesce_saves = Bool(
+        False, config=True,
+        help="Merge the saves of the same file which arrive while its "
+             "upload is in flight: only the latest contents are uploaded "
+             "after it and all the merged saves return the same model.")
+    bulk_workers = Int(
+        8, config=True,
+        help="The number of threads which delete or move the objects of "
+             "a directory in parallel.")
+    delete_batch_size = Int(
+        100, config=True,
+        help="The number of deletions sent in one batch request. GCS "
+             "accepts at most 100.")
+    http_pool_size = Int(
+        32, config=True,
+        help="The maximum number of kept-alive connections to GCS per "
+             "client. It should not be less than the number of threads "
+             "which share the client.")
+    http_keepalive = Bool(
+        True, config=True,
+        help="Value indicating whether to reuse the connections to GCS.")
+    http_timeout = Float(
+        60, config=True,
+        help="The default timeout in seconds of a request to GCS. 0 waits "
+             "forever.")
+    retry_attempts = Int(
+        5, config=True,
+        help="The maximum number of retries of a GCS request which failed "
+             "with a transient error: 408, 429, 5xx or a broken "
+             "connection.")
+    retry_initial_delay = Float(
+        0.5, config=True,
+        help="The delay in seconds before the first retry. It doubles "
+             "with every next retry and is randomized by up to 50%.")
+    retry_max_delay = Float(
+        16, config=True,
+        help="The maximum delay in seconds between the retries.")
+    retry_deadline = Float(
+        60, config=True,
+        help="The number of seconds after which a failing GCS request is "
+             "not retried any more. 0 means no limit.")
+    metrics_enabled = Bool(
+        True, config=True,
+        help="Value indicating whether to count the GCS requests and the "
+             "transferred bytes and to measure the request latencies. The "
+             "metrics are exposed on the /metrics page of the Jupyter "
+             "server if prometheus_client is installed.")
+    metrics_bucket_label = Bool(
+        False, config=True,
+        help="Value indicating whether to attribute the metrics to the "
+             "buckets and to export them with the bucket label. Every "
+             "bucket adds its own time series, so enable it only if the "
+             "number of buckets is small.")
+    tracer = Any(
+        None, config=True,
+        help="jgscm.tracing.Tracer instance, class or import string "
+             "thereof which receives the spans of the contents operations "
+             "and of the GCS requests, e.g. "
+             "'jgscm.tracing.LoggingTracer' or "
+             "'jgscm.tracing.OpenTelemetryTracer'. None disables tracing.")
+    per_thread_clients = Bool(
+        True, config=True,
+        help="Value indicating whether every thread, e.g. a bulk operation "
+             "or an async executor worker, uses its own GCS client with "
+             "its own connection pool. The clients share the credentials.")
+    backend_decorators = List(
+        Any(), config=True,
+        help="jgscm.backend.BackendDecorator classes or import strings "
+             "thereof which wrap the GCS backend, the first is the "
+             "innermost, e.g. ['jgscm.backend.CountingBackend'].")
     post_save_hook = Any(None, config=True,
                          help="""Python callable or importstring thereof
 
@@ -212,21 +706,20 @@ class GoogleStorageContentManager(ContentsManager):
     def __init__(self, *args, **kwargs):
         # Stub for the GSClient instance (set lazily by the client property).
         self._client = None
+        # The clients of the other threads if per_thread_clients is enabled.
+        self._local = threading.local()
+        # Progress of the running and the recently finished bulk operations.
+        self._bulk_progress = deque(maxlen=16)
+        # Checksums of the last uploaded contents by path.
+        self._digests = LRUCache(4096)
+        self._coalescer = WriteCoalescer()
+        # The thread pools of the parallel operations by name.
+        self._executors = {}
+        self._executors_lock = threading.Lock()
         super(GoogleStorageContentManager, self).__init__(*args, **kwargs)
 
-    def debug_args(fn):
-        def wrapped_fn(self, *args, **kwargs):
-            self.log.debug("call %s(%s%s%s)", fn.__name__,
-                           ", ".join(repr(a) for a in args),
-                           ", " if args and kwargs else "",
-                           ", ".join("%s=%r" % p for p in kwargs.items()))
-            result = fn(self, *args, **kwargs)
-            self.log.debug("result %s %s", fn.__name__, result)
-            return result
-
-        return wrapped_fn
-
-    @debug_args
+    @traced
+    @measured
     def is_hidden(self, path):
         if path == "":
             return False
@@ -244,7 +737,8 @@ class GoogleStorageContentManager(ContentsManager):
             return True
         return False
 
-    @debug_args
+    @traced
+    @measured
     def file_exists(self, path=""):
         if path == "" or path.endswith("/"):
             return False
@@ -253,12 +747,19 @@ class GoogleStorageContentManager(ContentsManager):
         bucket_name, bucket_path = self._parse_path(path)
         if not bucket_path:
             return False
+        try:
+            return self._cache_get("blob", path) is not None
+        except KeyError:
+            pass
         bucket = self._get_bucket(bucket_name)
         if bucket is None or bucket_path == "":
             return False
-        return bucket.blob(bucket_path).exists()
+        blob = self.backend.stat(bucket, bucket_path)
+        self._cache_put("blob", path, blob)
+        return blob is not None
 
-    @debug_args
+    @traced
+    @measured
     def dir_exists(self, path):
         if path.startswith("/"):
             path = path[1:]
@@ -269,36 +770,49 @@ class GoogleStorageContentManager(ContentsManager):
         bucket_name, blob_prefix_name = self._parse_path(path)
         # Get the bucket, fail if the bucket cannot be found.
         bucket = self._get_bucket(bucket_name)
-        if not bucket:
+        if bucket is None:
             return False
         # Only check that bucket exists.
         if not blob_prefix_name:
             return True
+        try:
+            return self._cache_get("dir", path)
+        except KeyError:
+            pass
         # Check that some blobs exist with the prefix as a path.
-        if list(bucket.list_blobs(prefix=blob_prefix_name, max_results=1)):
-            return True
-        return False
-
-    @debug_args
+        blobs, _ = next(self._iter_pages(bucket, blob_prefix_name,
+                                         page_size=1))
+        exists = bool(blobs)
+        self._cache_put("dir", path, exists)
+        return exists
+
+    @traced
+    @measured
     def get(self, path, content=True, type=None, format=None):
         if isinstance(path, Blob):
-            obj = path
-            path = self._get_blob_path(obj)
+            path = path.bucket.name + "/" + path.name
+        elif isinstance(path, StorageObject):
+            path = self._get_blob_path(path)
         elif path.startswith("/"):
             path = path[1:]
         if not path:
             path = self.default_path
 
-        type = self._resolve_storagetype(path, type)
+        # The contents are read by the blob generation, so the metadata
+        # must be fresh in that case.
+        type, fetched = self._resolve_storagetype(path, type, fresh=content)
         if type == "directory":
             if path and not path.endswith("/"):
                 path += "/"
-            exists, members = self._fetch(path, content=content)
+            if fetched is not None and not content:
+                exists, members = fetched
+            else:
+                exists, members = self._fetch(path, content=content)
             if not exists:
                 raise web.HTTPError(404, u"No such directory: %s" % path)
             model = self._dir_model(path, members, content=content)
         else:
-            exists, blob = self._fetch(path)
+            exists, blob = fetched or self._fetch(path, fresh=content)
             if not exists:
                 raise web.HTTPError(404, u"No such file: %s" % path)
             if type == "notebook" or (type is None and path.endswith(".ipynb")):
@@ -307,7 +821,8 @@ class GoogleStorageContentManager(ContentsManager):
                 model = self._file_model(blob, content=content, format=format)
         return model
 
-    @debug_args
+    @traced
+    @measured
     def save(self, model, path):
         if path.startswith("/"):
             path = path[1:]
@@ -324,21 +839,34 @@ class GoogleStorageContentManager(ContentsManager):
         if bucket_path != "" and model["type"] == "directory" and \
                 bucket_path[-1] != "/":
             path += "/"
+        chunk = model.get("chunk", None)
+        if chunk is not None and model["type"] != "file":
+            raise web.HTTPError(
+                400, u"File type '%s' is not supported for chunked upload" %
+                     model["type"])
         self.log.debug("Saving %s", path)
 
-        self.run_pre_save_hook(model=model, path=path)
+        if chunk is None or chunk == 1:
+            self.run_pre_save_hook(model=model, path=path)
 
         try:
             if model["type"] == "notebook":
                 nb = nbformat.from_dict(model["content"])
                 self.check_and_sign(nb, path)
-                self._save_notebook(path, nb)
+                blob = self._coalesce(path, self._save_notebook, path, nb)
                 # One checkpoint should always exist for notebooks.
+                # The listing is served from the cached manifest.
                 if not self.checkpoints.list_checkpoints(path):
                     self.create_checkpoint(path)
             elif model["type"] == "file":
                 # Missing format will be handled internally by _save_file.
-                self._save_file(path, model["content"], model.get("format"))
+                if chunk is None:
+                    blob = self._coalesce(
+                        path, self._save_file, path, model["content"],
+                        model.get("format"))
+                else:
+                    blob = self._save_file_chunk(
+                        path, model["content"], model.get("format"), chunk)
             elif model["type"] == "directory":
                 self._save_directory(path, model)
             else:
@@ -352,12 +880,25 @@ class GoogleStorageContentManager(ContentsManager):
             raise web.HTTPError(
                 500, u"Unexpected error while saving file: %s %s" % (path, e))
 
+        if chunk is not None and chunk != -1:
+            # the file appears after the last chunk
+            model = self._file_model(blob, content=False)
+            model["name"] = self._get_blob_name(path)
+            model["path"] = path
+            return model
+
         validation_message = None
         if model["type"] == "notebook":
             self.validate_notebook_model(model)
             validation_message = model.get("message", None)
 
-        model = self.get(path, content=False)
+        if model["type"] == "directory":
+            model = self.get(path, content=False)
+        elif model["type"] == "notebook" or path.endswith(".ipynb"):
+            # the upload response has all the metadata
+            model = self._notebook_model(blob, content=False)
+        else:
+            model = self._file_model(blob, content=False)
         if validation_message:
             model["message"] = validation_message
 
@@ -365,91 +906,205 @@ class GoogleStorageContentManager(ContentsManager):
 
         return model
 
-    @debug_args
+    @traced
+    @measured
     def delete_file(self, path):
         if path.startswith("/"):
             path = path[1:]
         bucket_name, bucket_path = self._parse_path(path)
         bucket = self._get_bucket(bucket_name, throw=True)
-        if bucket_path == "":
-            bucket.delete()
-            del self._bucket_cache[bucket_name]
-            return
-        it = bucket.list_blobs(prefix=bucket_path, delimiter="/",
-                               max_results=self.max_list_size)
-        files = list(islice(it, self.max_list_size))
-        folders = it.prefixes
-        bucket.delete_blobs(files)
-        for folder in folders:
-            self.delete_file(bucket_name + "/" + folder)
-
-    @debug_args
+        try:
+            if bucket_path == "":
+                self.backend.delete_bucket(bucket)
+                del self._bucket_cache[bucket_name]
+                return
+            if not bucket_path.endswith("/"):
+                try:
+                    self.backend.delete(bucket, bucket_path)
+                    return
+                except NotFound:
+                    bucket_path += "/"
+            self._delete_prefix(bucket, bucket_path)
+        finally:
+            self._invalidate(path)
+
+    @traced
+    @measured
     def rename_file(self, old_path, new_path):
         if old_path.startswith("/"):
             old_path = old_path[1:]
         if new_path.startswith("/"):
             new_path = new_path[1:]
-        old_bucket_name, old_bucket_path = self._parse_path(old_path)
-        old_bucket = self._get_bucket(old_bucket_name, throw=True)
-        new_bucket_name, new_bucket_path = self._parse_path(new_path)
-        new_bucket = self._get_bucket(new_bucket_name, throw=True)
-        old_blob = old_bucket.get_blob(old_bucket_path)
-        if old_bucket_name == new_bucket_name:
+        try:
+            old_bucket_name, old_bucket_path = self._parse_path(old_path)
+            old_bucket = self._get_bucket(old_bucket_name, throw=True)
+            new_bucket_name, new_bucket_path = self._parse_path(new_path)
+            new_bucket = self._get_bucket(new_bucket_name, throw=True)
+            if old_bucket_path.endswith("/"):
+                old_blob = None
+            else:
+                old_blob = self.backend.stat(old_bucket, old_bucket_path)
             if old_blob is not None:
-                old_bucket.rename_blob(old_blob, new_bucket_path)
+                self._move_blob(old_blob, new_bucket, new_bucket_path)
                 return
             if not old_bucket_path.endswith("/"):
                 old_bucket_path += "/"
             if not new_bucket_path.endswith("/"):
                 new_bucket_path += "/"
-            it = old_bucket.list_blobs(prefix=old_bucket_path, delimiter="/",
-                                       max_results=self.max_list_size)
-            old_blobs = list(islice(it, self.max_list_size))
-            folders = it.prefixes
-            for ob in old_blobs:
-                old_bucket.rename_blob(
-                    ob, new_bucket_path + self._get_blob_name(ob))
-            for f in folders:
-                self.rename_file(
-                    old_bucket_name + "/" + f,
-                    new_bucket_name + "/" +
-                    f.replace(old_bucket_path, new_bucket_path, 1))
-            return
-        if old_blob is not None:
-            old_bucket.copy_blob(old_blob, new_bucket, new_bucket_path)
-            old_bucket.delete_blob(old_blob)
-            return
-        if not old_bucket_path.endswith("/"):
-            old_bucket_path += "/"
-        if not new_bucket_path.endswith("/"):
-            new_bucket_path += "/"
-        it = old_bucket.list_blobs(prefix=old_bucket_path, delimiter="/",
-                                   max_results=self.max_list_size)
-        old_blobs = list(islice(it, self.max_list_size))
-        folders = it.prefixes
-        for ob in old_blobs:
-            old_bucket.copy_blob(ob, new_bucket, new_bucket_path +
-                                 self._get_blob_name(ob))
-            ob.delete()
-        for f in folders:
-            self.rename_file(
-                old_bucket_name + "/" + f,
-                new_bucket_name + "/" +
-                f.replace(old_bucket_path, new_bucket_path, 1))
+            if old_bucket_name == new_bucket_name and \
+                    new_bucket_path.startswith(old_bucket_path):
+                raise web.HTTPError(
+                    400, u"Cannot move %s into itself" % old_path)
+            self._move_prefix(old_bucket, old_bucket_path,
+                              new_bucket, new_bucket_path)
+        finally:
+            self._invalidate(old_path)
+            self._invalidate(new_path)
 
     @property
     def client(self):
         """
         :return: used instance of :class:`google.cloud.storage.Client`.
+                 Every thread gets its own instance if per_thread_clients
+                 is enabled.
         """
-        if self._client is not None:
+        if self._client is None:
+            if not self.project:
+                client = GSClient()
+            else:
+                client = GSClient.from_service_account_json(
+                    self.keyfile, project=self.project)
+            self._client = self._configure_client(client)
+            self._local.client = self._client
+        if not self.per_thread_clients:
             return self._client
-        if not self.project:
-            self._client = GSClient()
-        else:
-            self._client = GSClient.from_service_account_json(
-                self.keyfile, project=self.project)
-        return self._client
+        try:
+            return self._local.client
+        except AttributeError:
+            pass
+        # avoid reading the keyfile and fetching a token again
+        client = GSClient(project=self._client.project,
+                          credentials=self._client._credentials)
+        self._local.client = self._configure_client(client)
+        return self._local.client
+
+    def _configure_client(self, client):
+        """
+        Applies the HTTP connection settings to the client's session.
+        :param client: :class:`google.cloud.storage.Client` instance.
+        :return: the client.
+        """
+        http = client._http
+        if hasattr(http, "mount"):
+            configure_session(http, self.http_pool_size,
+                              timeout=self.http_timeout or None,
+                              keepalive=self.http_keepalive)
+        return client
+
+    @property
+    def retry_policy(self):
+        """
+        :return: :class:`jgscm.retry.RetryPolicy` which all the GCS requests
+                 go through.
+        """
+        try:
+            return self._retry_policy
+        except AttributeError:
+            self._retry_policy = RetryPolicy(
+                attempts=self.retry_attempts,
+                initial=self.retry_initial_delay,
+                maximum=self.retry_max_delay,
+                deadline=self.retry_deadline, log=self.log,
+                observer=self.metrics, tracer=self.tracer)
+            return self._retry_policy
+
+    @property
+    def backend(self):
+        """
+        :return: :class:`jgscm.backend.StorageBackend` which all the storage
+                 operations go through: :class:`jgscm.backend.GCSBackend`
+                 wrapped in backend_decorators.
+        """
+        try:
+            return self._backend
+        except AttributeError:
+            backend = GCSBackend(self)
+            for decorator in self.backend_decorators:
+                if isinstance(decorator, (str, unicode)):
+                    decorator = import_item(decorator)
+                backend = decorator(backend)
+            self._backend = backend
+            return self._backend
+
+    @validate("tracer")
+    def _validate_tracer(self, proposal):
+        tracer = proposal["value"]
+        if isinstance(tracer, (str, unicode)):
+            tracer = import_item(tracer)
+        if isinstance(tracer, type):
+            tracer = tracer()
+        if isinstance(tracer, LoggingTracer) and tracer.log is None:
+            tracer.log = self.log
+        return tracer
+
+    @observe("tracer")
+    def _tracer_changed(self, change):
+        try:
+            self._retry_policy.tracer = change["new"]
+        except AttributeError:
+            pass
+
+    @property
+    def metrics(self):
+        """
+        :return: :class:`jgscm.metrics.Metrics` of the GCS requests or None
+                 if the metrics are disabled.
+        """
+        try:
+            return self._metrics
+        except AttributeError:
+            if self.metrics_enabled:
+                self._metrics = Metrics(
+                    bucket_label=self.metrics_bucket_label)
+                register_prometheus(self._metrics)
+            else:
+                self._metrics = None
+            return self._metrics
+
+    def _transferred(self, direction, nbytes):
+        """Records the bytes downloaded from or uploaded to GCS."""
+        if self.metrics is not None:
+            self.metrics.transferred(direction, nbytes)
+
+    def _run_parallel(self, fn, items, pool="bulk"):
+        """
+        Calls :func:`jgscm.bulk.run_parallel` in the named thread pool so
+        that the requests sent by the threads are attributed to the current
+        contents operation.
+        """
+        if self.metrics is not None:
+            fn = self.metrics.bind(fn)
+        executor, workers = self._executor(pool)
+        run_parallel(fn, items, workers, executor)
+
+    def _executor(self, name):
+        """
+        :param name: the name of the thread pool: "bulk" or "download".
+        :return: tuple(:class:`concurrent.futures.ThreadPoolExecutor`, the
+                 number of its threads). The pool lives as long as the
+                 manager, so that its threads keep their clients and
+                 kept-alive connections between the calls. It is sized
+                 once from the bulk_workers or download_workers trait and
+                 never replaced because the running calls share it.
+        """
+        with self._executors_lock:
+            try:
+                return self._executors[name]
+            except KeyError:
+                workers = getattr(self, name + "_workers")
+                pool = ThreadPoolExecutor(max_workers=workers)
+                self._executors[name] = pool, workers
+                return pool, workers
 
     def run_post_save_hook(self, model, os_path):
         """Run the post-save hook if defined, and log errors"""
@@ -466,41 +1121,86 @@ class GoogleStorageContentManager(ContentsManager):
     def _checkpoints_class_default(self):
         return GoogleStorageCheckpoints
 
-    def _resolve_storagetype(self, path, storagetype):
-        """Based on the arguments and status of GCS, return a valid type."""
+    def _resolve_storagetype(self, path, storagetype, fresh=False):
+        """Based on the arguments and status of GCS, return a valid type.
+
+        :param fresh: If True, do not use the metadata cache.
+        :return: tuple(type, the result of _fetch(path, content=False) for
+                 directories or _fetch(path) for files if it is already
+                 known, otherwise None).
+        """
         if "/" not in path or path.endswith("/") or path == "":
             if storagetype not in (None, "directory"):
                 raise web.HTTPError(
                     400, u"%s is not a directory" % path, reason="bad type")
-            return "directory"
+            return "directory", None
         if storagetype is None and path.endswith(".ipynb"):
-            return "notebook"
+            return "notebook", None
         if storagetype is not None:
-            return storagetype
+            return storagetype, None
         # If type cannot be inferred from the argument set, use
         # the storage API to see if a blob or a prefix exists.
-        if self.file_exists(path):
-            return "file"
-        if self.dir_exists(path):
-            return "directory"
+        blob, is_dir = self._probe(path, fresh)
+        if blob is not None:
+            return "file", (True, blob)
+        if is_dir:
+            return "directory", (True, None)
         raise web.HTTPError(
             404, u"%s does not exist" % path, reason="bad type")
 
+    def _probe(self, path, fresh=False):
+        """
+        Finds out whether the path is a blob, a directory or both with
+        a single list_blobs() call in most cases.
+        :param path: GCS path string without the trailing slash.
+        :param fresh: If True, do not use the metadata cache.
+        :return: tuple(:class:`jgscm.backend.StorageObject` or None,
+                 directory exists Bool).
+        """
+        try:
+            if fresh:
+                raise KeyError(path)
+            blob = self._cache_get("blob", path)
+            if blob is not None:
+                return blob, False
+            return None, self._cache_get("dir", path + "/")
+        except KeyError:
+            pass
+        bucket_name, bucket_path = self._parse_path(path)
+        bucket = self._get_bucket(bucket_name)
+        if bucket is None:
+            return None, False
+        # The blob itself is always the first one listed while siblings
+        # like "name.txt" are sorted between "name" and "name/", so ask for
+        # a few entries to see the prefix in the same response.
+        page_size = 8
+        blobs, prefixes = next(self._iter_pages(
+            bucket, bucket_path, "/", page_size))
+        blob = blobs[0] if blobs and blobs[0].name == bucket_path else None
+        self._cache_put("blob", path, blob)
+        if bucket_path + "/" in prefixes:
+            is_dir = True
+        elif len(blobs) + len(prefixes) < page_size:
+            is_dir = False
+        else:
+            return blob, self.dir_exists(path)
+        self._cache_put("dir", path + "/", is_dir)
+        return blob, is_dir
+
     def _get_bucket(self, name, throw=False):
         """
-        Get the bucket by it's name. Uses cache by default.
+        Checks that the bucket exists. Uses cache by default.
         :param name: bucket name.
         :param throw: If True raises NotFound exception, otherwise, returns
                       None.
-        :return: instance of :class:`google.cloud.storage.Bucket` or None.
+        :return: the bucket name or None.
         """
         if not self.cache_buckets:
-            try:
-                return self.client.get_bucket(name)
-            except NotFound:
-                if throw:
-                    raise
-                return None
+            if self.backend.bucket_exists(name):
+                return name
+            if throw:
+                raise NotFound("bucket %s" % name)
+            return None
         try:
             cache = self._bucket_cache
         except AttributeError:
@@ -509,18 +1209,17 @@ class GoogleStorageContentManager(ContentsManager):
             return cache[name]
         except KeyError:
             try:
-                bucket = self.client.get_bucket(name)
-            except BrokenPipeError as e:
-                if e.errno in (None, errno.EPIPE):
-                    return self._get_bucket(name, throw)
-                else:
-                    raise
-            except (BadRequest, NotFound):
+                exists = self.backend.bucket_exists(name)
+            except BadRequest:
                 if throw:
                     raise
                 return None
-            cache[name] = bucket
-            return bucket
+            if not exists:
+                if throw:
+                    raise NotFound("bucket %s" % name)
+                return None
+            cache[name] = name
+            return name
 
     @staticmethod
     def _parse_path(path):
@@ -536,19 +1235,20 @@ class GoogleStorageContentManager(ContentsManager):
     def _get_blob_path(blob):
         """
         Gets blob path.
-        :param blob: instance of :class:`google.cloud.storage.Blob`.
+        :param blob: :class:`jgscm.backend.StorageObject` instance.
         :return: path string.
         """
-        return blob.bucket.name + "/" + blob.name
+        return blob.bucket + "/" + blob.name
 
     @staticmethod
     def _get_blob_name(blob):
         """
         Gets blob name (last part of the path).
-        :param blob: instance of :class:`google.cloud.storage.Blob`.
+        :param blob: :class:`jgscm.backend.StorageObject` instance or
+                     path string.
         :return: name string.
         """
-        if isinstance(blob, Blob):
+        if isinstance(blob, StorageObject):
             return os.path.basename(blob.name)
         assert isinstance(blob, (unicode, str))
         if blob.endswith("/"):
@@ -566,24 +1266,23 @@ class GoogleStorageContentManager(ContentsManager):
             path = path[:-1]
         return path.rsplit("/", 1)[-1]
 
-    @debug_args
-    def _fetch(self, path, content=True):
+    def _fetch(self, path, content=True, fresh=False):
         """
         Retrieves the blob by it's path.
         :param path: blob path or directory name.
         :param content: If False, just check if path exists.
-        :return: tuple(exists Bool, :class:`google.cloud.storage.Blob` or
-                 tuple(file [Blob], folders list)).
+        :param fresh: If True, do not use the cached blob metadata.
+        :return: tuple(exists Bool, :class:`jgscm.backend.StorageObject` or
+                 tuple(files list, folders list)).
         """
         if path == "":
             try:
-                buckets = self.client.list_buckets()
-                return True, ([], [b.name + "/" for b in buckets])
-            except BrokenPipeError as e:
-                if e.errno in (None, errno.EPIPE):
-                    return self._fetch(path, content)
-                else:
-                    raise
+                return True, self._cache_get("list", path)
+            except KeyError:
+                pass
+            members = [], [name + "/" for name in self.backend.list_buckets()]
+            self._cache_put("list", path, members)
+            return True, members
         try:
             bucket_name, bucket_path = self._parse_path(path)
         except ValueError:
@@ -597,44 +1296,331 @@ class GoogleStorageContentManager(ContentsManager):
         if bucket_path == "" and not content:
             return True, None
         if bucket_path == "" or bucket_path.endswith("/"):
-            if bucket_path != "":
+            key = bucket_name + "/" + bucket_path
+            try:
+                files, folders = self._cache_get("list", key)
+                return (bool(files or folders or bucket_path == ""),
+                        (files, folders) if content else None)
+            except KeyError:
+                pass
+            if not content:
                 try:
-                    exists = bucket.blob(bucket_path).exists()
-                except BrokenPipeError as e:
-                    if e.errno in (None, errno.EPIPE):
-                        return self._fetch(path, content)
-                    else:
-                        raise
-                if exists and not content:
+                    return self._cache_get("dir", key), None
+                except KeyError:
+                    pass
+            if bucket_path != "" and not content:
+                if self.backend.stat(bucket, bucket_path) is not None:
+                    self._cache_put("dir", key, True)
                     return True, None
             # blob may not exist but at the same time be a part of a path
-            max_list_size = self.max_list_size if content else 1
+            files, folders = [], set()
             try:
-                it = bucket.list_blobs(prefix=bucket_path, delimiter="/",
-                                       max_results=max_list_size)
-                try:
-                    files = list(islice(it, max_list_size))
-                except BrokenPipeError as e:
-                    if e.errno in (None, errno.EPIPE):
-                        return self._fetch(path, content)
-                    else:
-                        raise
+                for blobs, prefixes in self._iter_pages(
+                        bucket, bucket_path, "/",
+                        self.list_page_size if content else 1):
+                    files.extend(blobs)
+                    folders.update(prefixes)
+                    if not content:
+                        break
             except NotFound:
                 del self._bucket_cache[bucket_name]
                 return False, None
-            folders = it.prefixes
-            return (bool(files or folders or bucket_path == ""),
-                    (files, folders) if content else None)
-        if not content:
-            return bucket.blob(bucket_path).exists(), None
-        try:
-            blob = bucket.get_blob(bucket_path)
-        except BrokenPipeError as e:
-            if e.errno in (None, errno.EPIPE):
-                return self._fetch(path, content)
+            exists = bool(files or folders or bucket_path == "")
+            if content:
+                self._cache_put("list", key, (files, folders))
+            self._cache_put("dir", key, exists)
+            return exists, (files, folders) if content else None
+        try:
+            if fresh:
+                raise KeyError(path)
+            blob = self._cache_get("blob", path)
+        except KeyError:
+            blob = self.backend.stat(bucket, bucket_path)
+            self._cache_put("blob", path, blob)
+        return blob is not None, blob if content else None
+
+    @property
+    def metadata_cache(self):
+        """
+        :return: :class:`jgscm.cache.LRUCache` with the blob metadata and
+                 directory listings or None if the cache is disabled.
+        """
+        try:
+            return self._metadata_cache
+        except AttributeError:
+            if self.metadata_cache_size > 0:
+                self._metadata_cache = LRUCache(self.metadata_cache_size,
+                                                self.metadata_cache_ttl)
             else:
-                raise
-        return blob is not None, blob
+                self._metadata_cache = None
+            return self._metadata_cache
+
+    def _cache_get(self, kind, path):
+        """
+        Looks up the metadata cache.
+        :param kind: "blob" (StorageObject or None), "dir" (existence
+                     flag), "list"
+                     (tuple(files, folders)) or "manifest" (list of
+                     checkpoint models).
+        :param path: GCS path string, directories end with a slash.
+        :return: the cached value.
+        :raises KeyError: the value is not cached.
+        """
+        cache = self.metadata_cache
+        if cache is None:
+            raise KeyError(path)
+        return cache.get((kind, path))
+
+    def _cache_put(self, kind, path, value):
+        """Stores the value in the metadata cache, see _cache_get()."""
+        cache = self.metadata_cache
+        if cache is not None:
+            cache.put((kind, path), value)
+
+    def _cache_blob(self, path, blob):
+        """Updates the metadata cache after the blob was written."""
+        self._invalidate(path)
+        self._cache_put("blob", path, blob)
+        self._digests.put(path, (blob.md5_hash, blob.crc32c))
+
+    def _find_unchanged(self, path, data, content_type):
+        """
+        Checks whether the blob already has the contents which are about to
+        be uploaded. The checksums of the previous upload are compared
+        first, so that the changed contents cost no requests.
+        :param path: blob path.
+        :param data: the contents to upload.
+        :param content_type: the content type to upload.
+        :return: the existing :class:`jgscm.backend.StorageObject` or
+                 None.
+        """
+        if not self.skip_unchanged_uploads or not isinstance(data, bytes):
+            return None
+        try:
+            md5, crc32c = self._digests.get(path)
+        except KeyError:
+            return None
+        if md5 is not None:
+            attr, digest = "md5_hash", md5_base64(data)
+            known = md5
+        elif crc32c is not None:
+            # composite objects do not have MD5
+            attr, digest = "crc32c", crc32c_base64(data)
+            known = crc32c
+        else:
+            return None
+        if digest is None or digest != known:
+            return None
+        # another client could have changed the blob
+        exists, blob = self._fetch(path, fresh=True)
+        if not exists or getattr(blob, attr, None) != digest or \
+                blob.content_type != content_type:
+            return None
+        self.log.debug("%s did not change, skipped the upload", path)
+        return blob
+
+    def _invalidate(self, path):
+        """
+        Drops the cached metadata of the path, everything under it and
+        the listings of its parent directories.
+        :param path: GCS path string.
+        """
+        cache = self.metadata_cache
+        if cache is None:
+            return
+        parents = set()
+        parent = path.rstrip("/")
+        if "/" not in parent:
+            # buckets are listed at the root level
+            parents.add("")
+        while "/" in parent:
+            parent = parent.rsplit("/", 1)[0]
+            parents.add(parent + "/")
+        cache.invalidate(
+            lambda key: key[1].startswith(path) or key[1] in parents)
+
+    @property
+    def bulk_progress(self):
+        """
+        :return: list of dicts with the statistics of the running and the
+                 recently finished directory deletions and moves.
+        """
+        return [p.as_dict() for p in list(self._bulk_progress)]
+
+    def _start_progress(self, operation):
+        progress = Progress(operation, self.log)
+        self._bulk_progress.append(progress)
+        return progress
+
+    def _copy_blob(self, blob, bucket, name):
+        """
+        Copies the blob on the server side.
+        :param blob: source :class:`jgscm.backend.StorageObject`.
+        :param bucket: destination bucket name.
+        :param name: destination blob name.
+        :return: the new :class:`jgscm.backend.StorageObject`.
+        """
+        return self.backend.copy(blob.bucket, blob.name, bucket, name)
+
+    def _move_blob(self, blob, bucket, name):
+        """
+        Moves the blob to the new location. The source is deleted only
+        after it is copied.
+        :param blob: :class:`jgscm.backend.StorageObject` to move.
+        :param bucket: destination bucket name.
+        :param name: destination blob name.
+        :return: the new :class:`jgscm.backend.StorageObject`.
+        """
+        new_blob = self._copy_blob(blob, bucket, name)
+        try:
+            self.backend.delete(blob.bucket, blob.name)
+        except NotFound:
+            pass
+        return new_blob
+
+    def _move_prefix(self, old_bucket, old_prefix, new_bucket, new_prefix):
+        """
+        Moves all the blobs which names start with the prefix. The flat
+        listing is streamed and the blobs are copied and deleted from
+        bulk_workers threads. Each source blob is deleted right after it is
+        copied, so an interrupted move continues from where it stopped
+        when it is started again.
+        :param old_bucket: source bucket name.
+        :param old_prefix: source blob name prefix.
+        :param new_bucket: destination bucket name.
+        :param new_prefix: destination blob name prefix.
+        :return: :class:`jgscm.bulk.Progress` with the statistics.
+        :raises web.HTTPError: some of the blobs could not be moved.
+        """
+        progress = self._start_progress("move %s/%s to %s/%s" % (
+            old_bucket, old_prefix, new_bucket, new_prefix))
+
+        def move(blob):
+            try:
+                self._move_blob(blob, new_bucket,
+                                new_prefix + blob.name[len(old_prefix):])
+            except GoogleCloudError as e:
+                self.log.warning("Failed to move %s: %s",
+                                 self._get_blob_path(blob), e)
+                progress.failed([self._get_blob_path(blob)])
+            else:
+                progress.done(1, blob.size or 0)
+
+        def iter_blobs():
+            # 1000 is the largest page size accepted by GCS
+            for blobs, _ in self._iter_pages(old_bucket, old_prefix,
+                                             page_size=1000):
+                for blob in blobs:
+                    yield blob
+
+        try:
+            self._run_parallel(move, iter_blobs())
+        finally:
+            progress.finish()
+        if progress.failures:
+            raise web.HTTPError(
+                500, u"Failed to move %d objects from %s/%s, e.g. %s" % (
+                    len(progress.failures), old_bucket, old_prefix,
+                    progress.failures[0]))
+        return progress
+
+    def _delete_prefix(self, bucket, prefix):
+        """
+        Deletes all the blobs which names start with the prefix. The flat
+        listing is streamed and the deletions are sent in batch requests
+        from bulk_workers threads.
+        :param bucket: bucket name.
+        :param prefix: blob name prefix.
+        :return: :class:`jgscm.bulk.Progress` with the statistics.
+        :raises web.HTTPError: some of the blobs could not be deleted.
+        """
+        progress = self._start_progress(
+            "delete %s/%s" % (bucket, prefix))
+
+        def delete(names):
+            failed = self._delete_batch(bucket, names)
+            progress.failed(bucket + "/" + name for name in failed)
+            progress.done(len(names) - len(failed))
+
+        try:
+            self._run_parallel(delete, self._iter_batches(
+                bucket, prefix, self.delete_batch_size))
+        finally:
+            progress.finish()
+        if progress.failures:
+            raise web.HTTPError(
+                500, u"Failed to delete %d objects under %s/%s, e.g. %s" % (
+                    len(progress.failures), bucket, prefix,
+                    progress.failures[0]))
+        return progress
+
+    def _delete_batch(self, bucket, names):
+        """
+        Deletes the blobs in a single batch request.
+        :param bucket: bucket name.
+        :param names: list of the blob names, at most 100 items.
+        :return: list of the names which could not be deleted.
+        """
+        try:
+            self.backend.batch_delete(bucket, names)
+            return []
+        except GoogleCloudError as e:
+            self.log.debug("batch delete failed: %s", e)
+        # Find out which deletions failed one by one, the blobs which are
+        # already gone do not count.
+        failed = []
+        for name in names:
+            try:
+                self.backend.delete(bucket, name)
+            except NotFound:
+                pass
+            except GoogleCloudError as e:
+                self.log.warning("Failed to delete %s/%s: %s", bucket, name,
+                                 e)
+                failed.append(name)
+        return failed
+
+    def _iter_batches(self, bucket, prefix, size):
+        """
+        Lists all the blobs under the prefix and groups their names.
+        :param bucket: bucket name.
+        :param prefix: blob name prefix.
+        :param size: the maximum number of blobs in a group.
+        :return: generator of lists of blob names.
+        """
+        batch = []
+        # 1000 is the largest page size accepted by GCS
+        for blobs, _ in self._iter_pages(bucket, prefix, page_size=1000):
+            for blob in blobs:
+                batch.append(blob.name)
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def _iter_pages(self, bucket, prefix, delimiter=None, page_size=None):
+        """
+        Lists the blobs lazily page by page, so that at most one page is
+        held in memory.
+        :param bucket: bucket name.
+        :param prefix: blob name prefix.
+        :param delimiter: "/" to list a single level, None to list
+                          everything under the prefix.
+        :param page_size: the number of items per page. list_page_size is
+                          used by default.
+        :return: generator of tuple(list of
+                 :class:`jgscm.backend.StorageObject`, set of prefixes).
+        """
+        if page_size is None:
+            page_size = self.list_page_size
+        token = None
+        while True:
+            blobs, prefixes, token = self.backend.list(
+                bucket, prefix, delimiter, page_size, token)
+            yield blobs, prefixes
+            if token is None:
+                return
 
     def _base_model(self, blob):
         """Builds the common base of a contents model"""
@@ -652,22 +1638,125 @@ class GoogleStorageContentManager(ContentsManager):
         }
         return model
 
+    @property
+    def content_cache(self):
+        """
+        :return: :class:`jgscm.cache.LRUCache` with the blob contents keyed
+                 by (bucket, name, generation) or None if the cache is
+                 disabled.
+        """
+        try:
+            return self._content_cache
+        except AttributeError:
+            if self.content_cache_size > 0:
+                self._content_cache = LRUCache(self.content_cache_size,
+                                               weigh=len)
+            else:
+                self._content_cache = None
+            return self._content_cache
+
+    @property
+    def disk_cache(self):
+        """
+        :return: :class:`jgscm.cache.DiskCache` in disk_cache_dir or None if
+                 the cache is disabled.
+        """
+        try:
+            return self._disk_cache
+        except AttributeError:
+            if self.disk_cache_dir and self.disk_cache_size > 0:
+                self._disk_cache = DiskCache(
+                    os.path.expanduser(self.disk_cache_dir),
+                    self.disk_cache_size)
+            else:
+                self._disk_cache = None
+            return self._disk_cache
+
+    def _download(self, blob):
+        """
+        Downloads the contents of the blob. The contents of the same
+        blob generation are served from the content cache in memory or
+        mapped from the disk cache.
+        :param blob: :class:`jgscm.backend.StorageObject` instance.
+        :return: bytes-like object: bytes, bytearray or
+                 :class:`mmap.mmap`.
+        """
+        key = blob.bucket, blob.name, blob.generation
+        if blob.generation is not None:
+            for cache in (self.content_cache, self.disk_cache):
+                if cache is None:
+                    continue
+                try:
+                    return cache.get(key)
+                except KeyError:
+                    pass
+        if blob.size is not None and \
+                blob.size >= self.parallel_download_threshold:
+            data = self._download_ranges(blob)
+        else:
+            data = self.backend.read(blob.bucket, blob.name,
+                                     generation=blob.generation)
+        self._transferred("download", len(data))
+        self._cache_content(blob, data)
+        return data
+
+    def _download_ranges(self, blob):
+        """
+        Downloads byte ranges of the blob in parallel into a preallocated
+        buffer.
+        :param blob: :class:`jgscm.backend.StorageObject` instance.
+        :return: bytearray.
+        """
+        size = blob.size
+        step = max(self.download_chunk_size, 1)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+
+        def fetch(start):
+            end = min(start + step, size)
+            data = self.backend.read_range(
+                blob.bucket, blob.name, start, end - 1,
+                generation=blob.generation)
+            if len(data) != end - start:
+                raise IOError("%s changed while downloading" %
+                              self._get_blob_path(blob))
+            view[start:end] = data
+
+        self._run_parallel(fetch, range(0, size, step), pool="download")
+        return buffer
+
+    def _cache_content(self, blob, data):
+        """Stores the contents of the blob's generation in the caches."""
+        if blob.generation is None:
+            return
+        key = blob.bucket, blob.name, blob.generation
+        cache = self.content_cache
+        if cache is not None:
+            cache.put(key, data)
+        cache = self.disk_cache
+        if cache is not None:
+            try:
+                cache.put(key, data)
+            except (IOError, OSError) as e:
+                self.log.warning("Failed to write %s to the disk cache: %s",
+                                 self._get_blob_path(blob), e)
+
     def _read_file(self, blob, format):
         """Reads a non-notebook file.
 
-        blob: instance of :class:`google.cloud.storage.Blob`.
+        blob: :class:`jgscm.backend.StorageObject` instance.
         format:
           If "text", the contents will be decoded as UTF-8.
           If "base64", the raw bytes contents will be encoded as base64.
           If not specified, try to decode as UTF-8, and fall back to base64
         """
-        bcontent = blob.download_as_string()
+        bcontent = self._download(blob)
 
         if format is None or format == "text":
             # Try to interpret as unicode if format is unknown or if unicode
             # was explicitly requested.
             try:
-                return bcontent.decode("utf8"), "text"
+                return decode_utf8(bcontent), "text"
             except UnicodeError:
                 if format == "text":
                     raise web.HTTPError(
@@ -675,7 +1764,7 @@ class GoogleStorageContentManager(ContentsManager):
                              self._get_blob_path(blob),
                         reason="bad format",
                     )
-        return base64.encodebytes(bcontent).decode("ascii"), "base64"
+        return encode_base64(bcontent), "base64"
 
     def _file_model(self, blob, content=True, format=None):
         """Builds a model for a file
@@ -709,10 +1798,10 @@ class GoogleStorageContentManager(ContentsManager):
     def _read_notebook(self, blob):
         """
         Reads a notebook file from GCS blob.
-        :param blob: :class:`google.cloud.storage.Blob` instance.
+        :param blob: :class:`jgscm.backend.StorageObject` instance.
         :return: :class:`nbformat.notebooknode.NotebookNode` instance.
         """
-        data = blob.download_as_string().decode("utf-8")
+        data = codecs.decode(self._download(blob), "utf-8")
         nb = nbformat.reads(data, as_version=4)
         self.mark_trusted_cells(nb, self._get_blob_path(blob))
         return nb
@@ -733,11 +1822,15 @@ class GoogleStorageContentManager(ContentsManager):
             self.validate_notebook_model(model)
         return model
 
-    def _dir_model(self, path, members, content=True):
+    def _dir_model(self, path, members, content=True, writable=None):
         """Builds a model for a directory
 
-        if content is requested, will include a listing of the directory
+        if content is requested, will include a listing of the directory.
+        The child models are built from the listing itself, so no further
+        GCS calls are made per entry.
         """
+        if writable is None:
+            writable = members is not None or not self.is_hidden(path)
         model = {
             "type": "directory",
             "name": self._get_dir_name(path),
@@ -747,7 +1840,7 @@ class GoogleStorageContentManager(ContentsManager):
             "content": None,
             "format": None,
             "mimetype": "application/x-directory",
-            "writable": (members is not None or not self.is_hidden(path))
+            "writable": writable
         }
         if content:
             blobs, folders = members
@@ -755,10 +1848,11 @@ class GoogleStorageContentManager(ContentsManager):
             for blob in blobs:
                 if self._get_blob_path(blob) != path and \
                         self.should_list(self._get_blob_name(blob)):
-                    contents.append(self.get(
-                        path=blob,
-                        content=False)
-                    )
+                    if blob.name.endswith(".ipynb"):
+                        contents.append(
+                            self._notebook_model(blob, content=False))
+                    else:
+                        contents.append(self._file_model(blob, content=False))
             if path != "":
                 tmpl = "%s/%%s" % self._parse_path(path)[0]
             else:
@@ -766,26 +1860,45 @@ class GoogleStorageContentManager(ContentsManager):
             _, this = self._parse_path(path)
             for folder in folders:
                 if self.should_list(folder) and folder != this:
-                    contents.append(self.get(
-                        path=tmpl % folder,
-                        content=False)
-                    )
+                    # Listed buckets and prefixes are known to exist, so only
+                    # the name decides whether they are hidden.
+                    hidden = self.hide_dotted_blobs and \
+                        self._get_blob_name(folder).startswith(".")
+                    contents.append(self._dir_model(
+                        tmpl % folder, None, content=False,
+                        writable=not hidden))
             model["format"] = "json"
 
         return model
 
+    def _coalesce(self, path, fn, *args):
+        """
+        Calls fn(*args) which writes the path, merging it with the
+        concurrent writes of the same path if coalesce_saves is enabled.
+        :return: the result of fn.
+        """
+        if not self.coalesce_saves:
+            return fn(*args)
+        return self._coalescer.run(path, partial(fn, *args))
+
     def _save_notebook(self, path, nb):
         """
         Uploads notebook to GCS.
         :param path: blob path.
         :param nb: :class:`nbformat.notebooknode.NotebookNode` instance.
-        :return: created :class:`google.cloud.storage.Blob`.
+        :return: created :class:`jgscm.backend.StorageObject`.
         """
         bucket_name, bucket_path = self._parse_path(path)
         bucket = self._get_bucket(bucket_name, throw=True)
         data = nbformat.writes(nb, version=nbformat.NO_CONVERT)
-        blob = bucket.blob(bucket_path)
-        blob.upload_from_string(data, "application/x-ipynb+json")
+        data = data.encode("utf-8")
+        blob = self._find_unchanged(path, data, "application/x-ipynb+json")
+        if blob is not None:
+            return blob
+        blob = self._upload(bucket, bucket_path, data,
+                            "application/x-ipynb+json")
+        self._cache_blob(path, blob)
+        self._cache_content(blob, data)
         return blob
 
     def _save_file(self, path, content, format):
@@ -794,46 +1907,245 @@ class GoogleStorageContentManager(ContentsManager):
         :param: content file contents string.
         :param: format the description of the input format, can be either
                 "text" or "base64".
-        :return: created :class:`google.cloud.storage.Blob`.
+        :return: created :class:`jgscm.backend.StorageObject`.
         """
         bucket_name, bucket_path = self._parse_path(path)
         bucket = self._get_bucket(bucket_name, throw=True)
+        bcontent = self._decode_content(path, content, format)
+        blob = self._find_unchanged(path, bcontent, "text/plain")
+        if blob is not None:
+            return blob
+        blob = self._upload_content(path, bucket, bucket_path, bcontent)
+        self._cache_blob(path, blob)
+        if isinstance(bcontent, bytes):
+            self._cache_content(blob, bcontent)
+        return blob
 
+    def _save_file_chunk(self, path, content, format, chunk):
+        """
+        Uploads a part of the file which Jupyter sends in chunks. The chunks
+        are appended to a hidden pending blob next to the file with
+        server-side composition, so the file is never buffered as a whole.
+        The last chunk is composed into the file and the temporary blobs are
+        deleted.
+
+        Jupyter identifies an upload by the path only, so the first chunk
+        of a file fails with 409 while another upload of it received a
+        chunk less than chunked_upload_idle seconds ago. The pending blob
+        records the number of the last appended chunk,
+        every chunk is staged in a blob with a unique name and appended
+        only if the pending blob did not change since it was checked, so
+        the chunks of the different uploads are never mixed.
+        :param path: blob path.
+        :param content: the chunk's contents string.
+        :param format: "text" or "base64".
+        :param chunk: the chunk number starting from 1, -1 for the last.
+        :return: the pending blob or the created blob after the last chunk.
+        """
+        bucket_name, bucket_path = self._parse_path(path)
+        bucket = self._get_bucket(bucket_name, throw=True)
+        pending = self._pending_upload(bucket_path)
+        self._invalidate(path)
+        bcontent = self._decode_content(path, content, format)
+        previous = self.backend.stat(bucket, pending)
+        if chunk == 1:
+            return self._start_upload(path, bucket, bucket_path, previous,
+                                      bcontent)
+        if previous is None:
+            raise web.HTTPError(
+                400, u"The previous chunks of %s were not found" % path)
+        metadata = previous.metadata or {}
+        if chunk != -1 and metadata.get("chunk") != str(chunk - 1):
+            raise web.HTTPError(
+                409, u"Chunk %d of %s does not follow chunk %s" % (
+                    chunk, path, metadata.get("chunk")))
+        part = "%s-%s" % (pending, uuid.uuid4().hex)
+        self._upload_content(path, bucket, part, bcontent)
+        try:
+            if chunk == -1:
+                blob = self.backend.compose(
+                    bucket, [pending, part], bucket_path, "text/plain",
+                    source_generations=[previous.generation, None])
+            else:
+                blob = self.backend.compose(
+                    bucket, [pending, part], pending, "text/plain",
+                    metadata=dict(metadata, chunk=str(chunk)),
+                    if_generation_match=previous.generation)
+        except (NotFound, PreconditionFailed):
+            self._delete_batch(bucket, [part])
+            raise web.HTTPError(
+                409, u"The upload of %s changed concurrently, chunk %d is "
+                     u"discarded" % (path, chunk))
+        self._delete_batch(bucket, [part])
+        if chunk == -1:
+            try:
+                self.backend.delete(bucket, pending,
+                                    if_generation_match=previous.generation)
+            except (NotFound, PreconditionFailed):
+                pass
+            self._cache_blob(path, blob)
+        return blob
+
+    @staticmethod
+    def _pending_upload(bucket_path):
+        """
+        :param bucket_path: the blob name of the uploaded file.
+        :return: the name of the hidden pending blob of its chunked upload.
+        """
+        dirname, sep, name = bucket_path.rpartition("/")
+        return "%s%s.%s.upload" % (dirname, sep, name)
+
+    def _start_upload(self, path, bucket, bucket_path, previous, bcontent):
+        """
+        Writes the first chunk of a chunked upload to the pending blob and
+        deletes the abandoned uploads in the directory.
+        :param path: blob path.
+        :param bucket: bucket name.
+        :param bucket_path: the blob name of the uploaded file.
+        :param previous: :class:`jgscm.backend.StorageObject` of the
+                         existing pending blob or None.
+        :param bcontent: the result of _decode_content().
+        :return: the pending blob.
+        """
+        idle = datetime.now(UTC) - timedelta(
+            seconds=self.chunked_upload_idle)
+        if previous is not None and previous.updated > idle:
+            raise web.HTTPError(
+                409, u"%s is already being uploaded" % path)
+        dirname, sep, name = bucket_path.rpartition("/")
+        self._prune_uploads(bucket, dirname + sep, name)
+        try:
+            return self._upload_content(
+                path, bucket, self._pending_upload(bucket_path), bcontent,
+                metadata={"chunk": "1"},
+                if_generation_match=previous.generation
+                if previous is not None else 0)
+        except PreconditionFailed:
+            raise web.HTTPError(
+                409, u"%s is already being uploaded" % path)
+
+    def _prune_uploads(self, bucket, dirname, name):
+        """
+        Deletes the temporary blobs of the abandoned chunked uploads in the
+        directory: the staged chunks of the file which is being uploaded
+        again and the blobs of the other files if they were not updated
+        for chunked_upload_ttl seconds. The pending blob of the file is
+        overwritten instead.
+        :param bucket: bucket name.
+        :param dirname: the directory prefix which ends with "/" or "".
+        :param name: the name of the uploaded file.
+        :return: None
+        """
+        pattern = re.compile(r"\.(.+)\.upload(-[0-9a-f]{32})?$")
+        expired = datetime.now(UTC) - timedelta(
+            seconds=self.chunked_upload_ttl)
+        stale = []
+        for blobs, _ in self._iter_pages(bucket, dirname + ".", "/"):
+            for blob in blobs:
+                match = pattern.match(blob.name[len(dirname):])
+                if match is None:
+                    continue
+                if match.group(1) == name:
+                    if match.group(2):
+                        stale.append(blob.name)
+                elif blob.updated < expired:
+                    stale.append(blob.name)
+        for i in range(0, len(stale), self.delete_batch_size):
+            self._delete_batch(bucket, stale[i:i + self.delete_batch_size])
+
+    def _decode_content(self, path, content, format):
+        """
+        Decodes the contents of a generic file.
+        :param path: the file path to report in errors.
+        :param content: file contents string.
+        :param format: the description of the input format, can be either
+                       "text" or "base64".
+        :return: bytes or, for the large base64 contents, a generator of
+                 bytes which decodes them while they are uploaded.
+        """
         if format not in {"text", "base64"}:
             raise web.HTTPError(
                 400,
                 u"Must specify format of file contents as \"text\" or "
                 u"\"base64\"",
             )
+        # the decoded size does not exceed 3/4 of the base64 length
+        stream = format == "base64" and \
+            len(content) * 3 // 4 >= self.resumable_upload_threshold
         try:
             if format == "text":
                 bcontent = content.encode("utf8")
+            elif not stream:
+                # decodes ASCII str without an encoded copy
+                bcontent = binascii.a2b_base64(content)
             else:
-                b64_bytes = content.encode("ascii")
-                bcontent = base64.decodebytes(b64_bytes)
+                bcontent = iter_base64(content, self.upload_chunk_size)
         except Exception as e:
             raise web.HTTPError(
                 400, u"Encoding error saving %s: %s" % (path, e)
             )
-        blob = bucket.blob(bucket_path)
-        blob.upload_from_string(bcontent)
+        return bcontent
+
+    def _upload_content(self, path, bucket, name, bcontent, metadata=None,
+                        if_generation_match=None):
+        """
+        Uploads the decoded contents of a generic file.
+        :param path: the file path to report in errors.
+        :param bucket: bucket name.
+        :param name: blob name.
+        :param bcontent: the result of _decode_content().
+        :param metadata: dict with the custom blob metadata or None.
+        :param if_generation_match: the required generation of the blob
+                                    before the upload or None.
+        :return: the uploaded :class:`jgscm.backend.StorageObject`.
+        """
+        try:
+            return self._upload(bucket, name, bcontent, "text/plain",
+                                metadata, if_generation_match)
+        except (binascii.Error, UnicodeError) as e:
+            # raised by iter_base64() while streaming
+            raise web.HTTPError(
+                400, u"Encoding error saving %s: %s" % (path, e)
+            )
+
+    def _upload(self, bucket, name, data, content_type, metadata=None,
+                if_generation_match=None):
+        """
+        Uploads the blob contents. The contents which are larger than
+        resumable_upload_threshold are sent in chunks through a resumable
+        upload.
+        :param bucket: bucket name.
+        :param name: blob name.
+        :param data: bytes or an iterable of bytes pieces.
+        :param content_type: the blob's content type.
+        :param metadata: dict with the custom blob metadata or None.
+        :param if_generation_match: the required generation of the blob
+                                    before the upload or None.
+        :return: the uploaded :class:`jgscm.backend.StorageObject`.
+        """
+        blob = self.backend.write(bucket, name, data, content_type,
+                                  metadata=metadata,
+                                  if_generation_match=if_generation_match)
+        self._transferred("upload", len(data) if isinstance(data, bytes)
+                          else blob.size or 0)
         return blob
 
     def _save_directory(self, path, model):
         """Creates a directory in GCS."""
         exists, obj = self._fetch(path)
         if exists:
-            if isinstance(obj, Blob):
+            if isinstance(obj, StorageObject):
                 raise web.HTTPError(400, u"Not a directory: %s" % path)
             else:
                 self.log.debug("Directory %r already exists", path)
                 return
         bucket_name, bucket_path = self._parse_path(path)
-        if bucket_path == "":
-            self.client.create_bucket(bucket_name)
-        else:
-            bucket = self._get_bucket(bucket_name, throw=True)
-            bucket.blob(bucket_path).upload_from_string(
-                b"", content_type="application/x-directory")
-
-    debug_args = staticmethod(debug_args)
+        try:
+            if bucket_path == "":
+                self.backend.create_bucket(bucket_name)
+            else:
+                bucket = self._get_bucket(bucket_name, throw=True)
+                self.backend.write(bucket, bucket_path, b"",
+                                   "application/x-directory")
+        finally:
+            self._invalidate(path)
@@ -0,0 +1,151 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from jupyter_server.services.contents.checkpoints import AsyncCheckpoints
+from jupyter_server.services.contents.manager import AsyncContentsManager
+import nbformat
+from traitlets import Int, default
+
+from jgscm import GoogleStorageContentManager
+
+
+class AsyncGoogleStorageCheckpoints(AsyncCheckpoints):
+    """
+    Checkpoints of :class:`AsyncGoogleStorageContentManager`. Delegates to
+    :class:`jgscm.GoogleStorageCheckpoints` of the synchronous manager
+    and runs it in the thread pool.
+    """
+
+    @property
+    def _sync(self):
+        return self.parent.sync_manager.checkpoints
+
+    async def create_checkpoint(self, contents_mgr, path):
+        return await contents_mgr.run_sync(
+            self._sync.create_checkpoint, contents_mgr.sync_manager, path)
+
+    async def restore_checkpoint(self, contents_mgr, checkpoint_id, path):
+        return await contents_mgr.run_sync(
+            self._sync.restore_checkpoint, contents_mgr.sync_manager,
+            checkpoint_id, path)
+
+    async def rename_checkpoint(self, checkpoint_id, old_path, new_path):
+        return await self.parent.run_sync(
+            self._sync.rename_checkpoint, checkpoint_id, old_path, new_path)
+
+    async def delete_checkpoint(self, checkpoint_id, path):
+        return await self.parent.run_sync(
+            self._sync.delete_checkpoint, checkpoint_id, path)
+
+    async def list_checkpoints(self, path):
+        return await self.parent.run_sync(self._sync.list_checkpoints, path)
+
+    async def rename_all_checkpoints(self, old_path, new_path):
+        return await self.parent.run_sync(
+            self._sync.rename_all_checkpoints, old_path, new_path)
+
+    async def delete_all_checkpoints(self, path):
+        return await self.parent.run_sync(
+            self._sync.delete_all_checkpoints, path)
+
+
+class _SyncContentManager(GoogleStorageContentManager):
+    """
+    The synchronous manager behind :class:`AsyncGoogleStorageContentManager`.
+    Notebook signatures are handled by the asynchronous manager on the event
+    loop thread because the notary's SQLite connection cannot be used from
+    the other threads.
+    """
+
+    def check_and_sign(self, nb, path=""):
+        pass
+
+    def mark_trusted_cells(self, nb, path=""):
+        pass
+
+
+class AsyncGoogleStorageContentManager(AsyncContentsManager):
+    """
+    Asynchronous version of :class:`jgscm.GoogleStorageContentManager` for
+    jupyter_server. The blocking GCS calls run in a bounded thread pool, so
+    that slow transfers do not stall the event loop.
+
+    GCS options are read from the GoogleStorageContentManager and
+    GoogleStorageCheckpoints configuration sections.
+    """
+
+    max_workers = Int(
+        8, config=True,
+        help="The maximum number of GCS operations which run concurrently.")
+
+    @default("checkpoints_class")
+    def _checkpoints_class_default(self):
+        return AsyncGoogleStorageCheckpoints
+
+    @property
+    def sync_manager(self):
+        """
+        :return: :class:`jgscm.GoogleStorageContentManager` which does the
+                 actual work.
+        """
+        try:
+            return self._sync_manager
+        except AttributeError:
+            self._sync_manager = _SyncContentManager(parent=self, log=self.log)
+            return self._sync_manager
+
+    @property
+    def executor(self):
+        """
+        :return: :class:`concurrent.futures.ThreadPoolExecutor` where the
+                 GCS calls run.
+        """
+        try:
+            return self._executor
+        except AttributeError:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="jgscm")
+            return self._executor
+
+    async def run_sync(self, fn, *args, **kwargs):
+        """
+        Calls the blocking function in the thread pool.
+        :return: the function's result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, partial(fn, *args, **kwargs))
+
+    async def is_hidden(self, path):
+        return await self.run_sync(self.sync_manager.is_hidden, path)
+
+    async def file_exists(self, path=""):
+        return await self.run_sync(self.sync_manager.file_exists, path)
+
+    async def dir_exists(self, path):
+        return await self.run_sync(self.sync_manager.dir_exists, path)
+
+    async def get(self, path, content=True, type=None, format=None,
+                  require_hash=False):
+        model = await self.run_sync(
+            self.sync_manager.get, path, content=content, type=type,
+            format=format)
+        if content and model["type"] == "notebook":
+            self.mark_trusted_cells(model["content"], model["path"])
+        return model
+
+    async def save(self, model, path):
+        if model.get("type") == "notebook" and "content" in model:
+            nb = nbformat.from_dict(model["content"])
+            self.check_and_sign(nb, path)
+            model = dict(model, content=nb)
+        return await self.run_sync(self.sync_manager.save, model, path)
+
+    async def delete_file(self, path):
+        return await self.run_sync(self.sync_manager.delete_file, path)
+
+    async def rename_file(self, old_path, new_path):
+        return await self.run_sync(
+            self.sync_manager.rename_file, old_path, new_path)
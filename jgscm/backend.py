@@ -0,0 +1,487 @@
+from abc import ABCMeta, abstractmethod
+import collections
+import threading
+
+from google.cloud.exceptions import NotFound
+
+from jgscm.upload import ResumableUpload
+
+#: The operations of :class:`StorageBackend`.
+OPERATIONS = (
+    "list_buckets", "bucket_exists", "create_bucket", "delete_bucket",
+    "list", "stat", "read", "read_range", "write", "copy", "compose",
+    "delete", "batch_delete",
+)
+
+
+class StorageObject(object):
+    """
+    The metadata of a stored object. The attributes are named after
+    :class:`google.cloud.storage.Blob`'s.
+    """
+
+    __slots__ = ("bucket", "name", "size", "updated", "content_type",
+                 "generation", "md5_hash", "crc32c", "metadata")
+
+    def __init__(self, bucket, name, size=None, updated=None,
+                 content_type=None, generation=None, md5_hash=None,
+                 crc32c=None, metadata=None):
+        """
+        :param bucket: bucket name.
+        :param name: object name inside the bucket.
+        :param size: the contents size in bytes.
+        :param updated: :class:`datetime.datetime` of the last change.
+        :param content_type: the contents MIME type.
+        :param generation: the version of the contents, any value which
+                           changes with every write.
+        :param md5_hash: base64 MD5 digest of the contents or None.
+        :param crc32c: base64 big-endian CRC32C of the contents or None.
+        :param metadata: dict with the custom string metadata or None.
+        """
+        self.bucket = bucket
+        self.name = name
+        self.size = size
+        self.updated = updated
+        self.content_type = content_type
+        self.generation = generation
+        self.md5_hash = md5_hash
+        self.crc32c = crc32c
+        self.metadata = metadata
+
+    def __repr__(self):
+        return "<StorageObject %s/%s #%s>" % (self.bucket, self.name,
+                                              self.generation)
+
+
+class StorageBackend(metaclass=ABCMeta):
+    """
+    The storage operations which the contents manager is built on. The
+    buckets and the objects are addressed by their names, the metadata
+    is returned as :class:`StorageObject`. The errors are
+    google.cloud.exceptions, e.g. NotFound. The generation preconditions
+    are the same as GCS's: 0 matches only a missing object.
+    """
+
+    @abstractmethod
+    def list_buckets(self):
+        """
+        :return: list of the bucket names.
+        """
+
+    @abstractmethod
+    def bucket_exists(self, bucket):
+        """
+        :param bucket: bucket name.
+        :return: Bool.
+        """
+
+    @abstractmethod
+    def create_bucket(self, bucket):
+        """
+        :param bucket: bucket name.
+        :return: None
+        :raises Conflict: the bucket already exists.
+        """
+
+    @abstractmethod
+    def delete_bucket(self, bucket):
+        """
+        :param bucket: bucket name.
+        :return: None
+        :raises Conflict: the bucket is not empty.
+        """
+
+    @abstractmethod
+    def list(self, bucket, prefix, delimiter=None, page_size=None,
+             token=None):
+        """
+        Lists a single page of the objects which names start with the
+        prefix in the lexicographical order.
+        :param bucket: bucket name.
+        :param prefix: object name prefix.
+        :param delimiter: "/" to list a single level, None to list
+                          everything under the prefix.
+        :param page_size: the maximum number of items in the page.
+        :param token: the token of the page returned by the previous call.
+        :return: tuple(list of :class:`StorageObject`, set of prefixes,
+                 the next page token or None after the last page).
+        """
+
+    @abstractmethod
+    def stat(self, bucket, name):
+        """
+        :param bucket: bucket name.
+        :param name: object name.
+        :return: :class:`StorageObject` or None if it does not exist.
+        """
+
+    @abstractmethod
+    def read(self, bucket, name, generation=None):
+        """
+        :param bucket: bucket name.
+        :param name: object name.
+        :param generation: the generation to read or None for the latest.
+        :return: the contents bytes.
+        :raises NotFound: the object or its generation does not exist.
+        """
+
+    @abstractmethod
+    def read_range(self, bucket, name, start, end, generation=None):
+        """
+        :param bucket: bucket name.
+        :param name: object name.
+        :param start: the first byte offset.
+        :param end: the last byte offset, inclusive.
+        :param generation: the generation to read or None for the latest.
+        :return: the contents bytes in the range.
+        :raises NotFound: the object or its generation does not exist.
+        """
+
+    @abstractmethod
+    def write(self, bucket, name, data, content_type, metadata=None,
+              if_generation_match=None):
+        """
+        :param bucket: bucket name.
+        :param name: object name.
+        :param data: bytes or an iterable of bytes pieces.
+        :param content_type: the contents MIME type.
+        :param metadata: dict with the custom string metadata or None.
+        :param if_generation_match: the required generation of the object
+                                    before the request or None.
+        :return: :class:`StorageObject` of the written object.
+        :raises PreconditionFailed: the generation does not match.
+        """
+
+    @abstractmethod
+    def copy(self, bucket, name, new_bucket, new_name):
+        """
+        Copies the object on the server side.
+        :param bucket: source bucket name.
+        :param name: source object name.
+        :param new_bucket: destination bucket name.
+        :param new_name: destination object name.
+        :return: :class:`StorageObject` of the copy.
+        :raises NotFound: the source does not exist.
+        """
+
+    @abstractmethod
+    def compose(self, bucket, sources, name, content_type, metadata=None,
+                if_generation_match=None, source_generations=None):
+        """
+        Concatenates the objects on the server side into the object, which
+        may be one of them.
+        :param bucket: bucket name.
+        :param sources: list of the source object names.
+        :param name: the composed object name.
+        :param content_type: the composed object MIME type.
+        :param metadata: dict with the custom string metadata of the
+                         composed object or None.
+        :param if_generation_match: the required generation of the composed
+                                    object before the request or None.
+        :param source_generations: list of the required generations of the
+                                   sources, None items are not checked, or
+                                   None.
+        :return: :class:`StorageObject` of the composed object.
+        :raises NotFound: one of the sources does not exist.
+        :raises PreconditionFailed: a generation does not match.
+        """
+
+    @abstractmethod
+    def delete(self, bucket, name, if_generation_match=None):
+        """
+        :param bucket: bucket name.
+        :param name: object name.
+        :param if_generation_match: the required generation of the object
+                                    or None.
+        :return: None
+        :raises NotFound: the object does not exist.
+        :raises PreconditionFailed: the generation does not match.
+        """
+
+    @abstractmethod
+    def batch_delete(self, bucket, names):
+        """
+        Deletes the objects in a single request if possible.
+        :param bucket: bucket name.
+        :param names: list of the object names, at most 100 items.
+        :return: None
+        :raises GoogleCloudError: some of the deletions failed, the caller
+                                  finds out which.
+        """
+
+
+class GCSBackend(StorageBackend):
+    """
+    The default backend: Google Cloud Storage through the clients of the
+    contents manager. Every request goes through the manager's retry
+    policy, so it is retried, counted and traced. The requests are sent
+    explicitly with the client of the calling thread, so the threads do
+    not share the connections.
+    """
+
+    def __init__(self, contents_manager):
+        """
+        :param contents_manager: :class:`jgscm.GoogleStorageContentManager`
+                                 which provides the clients, the retry
+                                 policy and the upload settings.
+        """
+        self.parent = contents_manager
+
+    @staticmethod
+    def _object(blob):
+        """
+        :param blob: :class:`google.cloud.storage.Blob` with the metadata.
+        :return: :class:`StorageObject`.
+        """
+        return StorageObject(
+            blob.bucket.name, blob.name, size=blob.size, updated=blob.updated,
+            content_type=blob.content_type, generation=blob.generation,
+            md5_hash=blob.md5_hash, crc32c=blob.crc32c,
+            metadata=blob.metadata)
+
+    @property
+    def _options(self):
+        """
+        :return: the keyword arguments of every google.cloud.storage call.
+                 The library's own retries are disabled because the retry
+                 policy retries the requests within its deadline, and the
+                 timeout applies to every attempt.
+        """
+        return {"retry": None, "timeout": self.parent.http_timeout or None}
+
+    def _call(self, fn, *args, **kwargs):
+        """
+        Sends the idempotent GCS request with retries, e.g.
+        self._call(bucket.get_blob, name).
+        :param fn: :class:`google.cloud.storage` method.
+        :return: the result of fn.
+        """
+        kwargs.update(self._options)
+        return self.parent.retry_policy.call(fn, *args, **kwargs)
+
+    def _blob(self, client, bucket, name, generation=None):
+        """
+        :return: :class:`google.cloud.storage.Blob` handle bound to the
+                 client and pinned to the generation if it is not None.
+                 It is created without requests.
+        """
+        return client.bucket(bucket).blob(name, generation=generation)
+
+    def list_buckets(self):
+        client = self.parent.client
+        options = self._options
+        return [b.name for b in self.parent.retry_policy.run(
+            lambda: list(client.list_buckets(**options)), "list_buckets")]
+
+    def bucket_exists(self, bucket):
+        try:
+            self._call(self.parent.client.get_bucket, bucket)
+        except NotFound:
+            return False
+        return True
+
+    def create_bucket(self, bucket):
+        client = self.parent.client
+        options = self._options
+        self.parent.retry_policy.run(
+            lambda: client.create_bucket(bucket, **options),
+            "create_bucket", idempotent=False)
+
+    def delete_bucket(self, bucket):
+        client = self.parent.client
+        self._call(client.bucket(bucket).delete, client=client)
+
+    def list(self, bucket, prefix, delimiter=None, page_size=None,
+             token=None):
+        client = self.parent.client
+        handle = client.bucket(bucket)
+        options = self._options
+
+        def fetch_page():
+            it = handle.list_blobs(prefix=prefix, delimiter=delimiter,
+                                   max_results=page_size, page_token=token,
+                                   client=client, **options)
+            return list(it), it
+
+        blobs, it = self.parent.retry_policy.run(fetch_page, "list_blobs")
+        return ([self._object(b) for b in blobs], it.prefixes,
+                it.next_page_token or None)
+
+    def stat(self, bucket, name):
+        client = self.parent.client
+        blob = self._call(client.bucket(bucket).get_blob, name,
+                          client=client)
+        return self._object(blob) if blob is not None else None
+
+    def read(self, bucket, name, generation=None):
+        client = self.parent.client
+        blob = self._blob(client, bucket, name, generation)
+        return self._call(blob.download_as_bytes, client=client)
+
+    def read_range(self, bucket, name, start, end, generation=None):
+        client = self.parent.client
+        blob = self._blob(client, bucket, name, generation)
+        return self._call(blob.download_as_bytes, client=client,
+                          start=start, end=end)
+
+    def write(self, bucket, name, data, content_type, metadata=None,
+              if_generation_match=None):
+        parent = self.parent
+        client = parent.client
+        blob = self._blob(client, bucket, name)
+        blob.metadata = metadata
+        if isinstance(data, bytes) and \
+                len(data) < parent.resumable_upload_threshold:
+            self._call(blob.upload_from_string, data, content_type,
+                       client=client, if_generation_match=if_generation_match)
+        else:
+            ResumableUpload(blob, client, parent.upload_chunk_size,
+                            retries=parent.upload_retries,
+                            content_type=content_type,
+                            policy=parent.retry_policy,
+                            timeout=self._options["timeout"],
+                            if_generation_match=if_generation_match
+                            ).upload(data)
+        return self._object(blob)
+
+    def copy(self, bucket, name, new_bucket, new_name):
+        # large objects take several rewrite requests which continue each
+        # other with tokens
+        client = self.parent.client
+        source = self._blob(client, bucket, name)
+        blob = self._blob(client, new_bucket, new_name)
+        token, _, _ = self._call(blob.rewrite, source, client=client)
+        while token is not None:
+            token, done, total = self._call(blob.rewrite, source,
+                                            token=token, client=client)
+            self.parent.log.debug("rewriting %s/%s to %s/%s: %d/%d",
+                                  bucket, name, new_bucket, new_name, done,
+                                  total)
+        return self._object(blob)
+
+    def compose(self, bucket, sources, name, content_type, metadata=None,
+                if_generation_match=None, source_generations=None):
+        client = self.parent.client
+        handle = client.bucket(bucket)
+        blob = handle.blob(name)
+        blob.content_type = content_type
+        blob.metadata = metadata
+        blobs = [handle.blob(s) for s in sources]
+        options = self._options
+        # composing into one of the sources must not be repeated
+        self.parent.retry_policy.run(
+            lambda: blob.compose(blobs, client=client,
+                                 if_generation_match=if_generation_match,
+                                 if_source_generation_match=source_generations,
+                                 **options),
+            "compose", idempotent=name not in sources)
+        return self._object(blob)
+
+    def delete(self, bucket, name, if_generation_match=None):
+        client = self.parent.client
+        self._call(client.bucket(bucket).delete_blob, name, client=client,
+                   if_generation_match=if_generation_match)
+
+    def batch_delete(self, bucket, names):
+        # the batch is bound to the client, the blobs must use the same one
+        client = self.parent.client
+        handle = client.bucket(bucket)
+        options = self._options
+
+        def delete():
+            with client.batch():
+                for name in names:
+                    handle.blob(name).delete(client=client, **options)
+
+        self.parent.retry_policy.run(delete, "batch_delete")
+
+
+class BackendDecorator(StorageBackend):
+    """
+    Wraps another backend, e.g. to cache or to instrument it. Every
+    operation goes through forward(), so a subclass overrides either it
+    or the particular operations.
+    """
+
+    def __init__(self, backend):
+        """
+        :param backend: the wrapped :class:`StorageBackend`.
+        """
+        self.backend = backend
+
+    def forward(self, operation, *args, **kwargs):
+        """
+        Calls the operation of the wrapped backend.
+        :param operation: the method name, see OPERATIONS.
+        :return: the result of the operation.
+        """
+        return getattr(self.backend, operation)(*args, **kwargs)
+
+    def list_buckets(self):
+        return self.forward("list_buckets")
+
+    def bucket_exists(self, bucket):
+        return self.forward("bucket_exists", bucket)
+
+    def create_bucket(self, bucket):
+        return self.forward("create_bucket", bucket)
+
+    def delete_bucket(self, bucket):
+        return self.forward("delete_bucket", bucket)
+
+    def list(self, bucket, prefix, delimiter=None, page_size=None,
+             token=None):
+        return self.forward("list", bucket, prefix, delimiter=delimiter,
+                            page_size=page_size, token=token)
+
+    def stat(self, bucket, name):
+        return self.forward("stat", bucket, name)
+
+    def read(self, bucket, name, generation=None):
+        return self.forward("read", bucket, name, generation=generation)
+
+    def read_range(self, bucket, name, start, end, generation=None):
+        return self.forward("read_range", bucket, name, start, end,
+                            generation=generation)
+
+    def write(self, bucket, name, data, content_type, metadata=None,
+              if_generation_match=None):
+        return self.forward("write", bucket, name, data, content_type,
+                            metadata=metadata,
+                            if_generation_match=if_generation_match)
+
+    def copy(self, bucket, name, new_bucket, new_name):
+        return self.forward("copy", bucket, name, new_bucket, new_name)
+
+    def compose(self, bucket, sources, name, content_type, metadata=None,
+                if_generation_match=None, source_generations=None):
+        return self.forward("compose", bucket, sources, name, content_type,
+                            metadata=metadata,
+                            if_generation_match=if_generation_match,
+                            source_generations=source_generations)
+
+    def delete(self, bucket, name, if_generation_match=None):
+        return self.forward("delete", bucket, name,
+                            if_generation_match=if_generation_match)
+
+    def batch_delete(self, bucket, names):
+        return self.forward("batch_delete", bucket, names)
+
+
+class CountingBackend(BackendDecorator):
+    """
+    Counts the operations of the wrapped backend, including the failed
+    ones, independently of the retries below it.
+    """
+
+    def __init__(self, backend):
+        super(CountingBackend, self).__init__(backend)
+        #: :class:`collections.Counter` of the operation names.
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def forward(self, operation, *args, **kwargs):
+        with self._lock:
+            self.calls[operation] += 1
+        return super(CountingBackend, self).forward(
+            operation, *args, **kwargs)
@@ -0,0 +1,124 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+
+class Progress(object):
+    """
+    Tracks the objects and bytes processed by a bulk operation and logs
+    the progress periodically.
+    """
+
+    def __init__(self, operation, log, interval=5):
+        """
+        :param operation: the name of the operation to log.
+        :param log: :class:`logging.Logger` instance.
+        :param interval: the minimum number of seconds between the progress
+                         reports.
+        """
+        self.operation = operation
+        self.log = log
+        self.interval = interval
+        self.objects = 0
+        self.bytes = 0
+        self.failures = []
+        self.finished = False
+        self.start = time.time()
+        self._reported = self.start
+        self._lock = threading.Lock()
+
+    def done(self, objects=1, nbytes=0):
+        """Records successfully processed objects."""
+        with self._lock:
+            self.objects += objects
+            self.bytes += nbytes
+            now = time.time()
+            if now - self._reported < self.interval:
+                return
+            self._reported = now
+        self.report()
+
+    def failed(self, names):
+        """Records the names of the objects which could not be processed."""
+        with self._lock:
+            self.failures.extend(names)
+
+    def finish(self):
+        """Marks the operation as finished and logs the final report."""
+        self.end = time.time()
+        self.finished = True
+        self.report()
+
+    @property
+    def elapsed(self):
+        if self.finished:
+            return self.end - self.start
+        return time.time() - self.start
+
+    @property
+    def objects_per_second(self):
+        return self.objects / max(self.elapsed, 1e-6)
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / max(self.elapsed, 1e-6)
+
+    def as_dict(self):
+        return {
+            "operation": self.operation,
+            "objects": self.objects,
+            "bytes": self.bytes,
+            "failures": len(self.failures),
+            "finished": self.finished,
+            "elapsed": self.elapsed,
+            "objects_per_second": self.objects_per_second,
+            "bytes_per_second": self.bytes_per_second,
+        }
+
+    def report(self):
+        self.log.info("%s: %s %d objects, %d bytes in %.1fs "
+                      "(%.1f objects/s, %.1f MB/s), %d failed",
+                      self.operation,
+                      "finished" if self.finished else "processed",
+                      self.objects, self.bytes, self.elapsed,
+                      self.objects_per_second, self.bytes_per_second / 1e6,
+                      len(self.failures))
+
+
+def run_parallel(fn, items, workers, executor=None):
+    """
+    Calls fn(item) for every item in a thread pool. At most twice as many
+    items as there are workers are taken from the iterable at once, so
+    it can be a lazy generator of any length.
+    :param fn: callable to execute.
+    :param items: iterable with the arguments.
+    :param workers: the number of threads.
+    :param executor: :class:`concurrent.futures.ThreadPoolExecutor` with
+                     the given number of threads to reuse. A temporary pool
+                     is created if it is None.
+    :return: None. The first exception raised by fn is re-raised after
+             the pending calls finish.
+    """
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return run_parallel(fn, items, workers, pool)
+    pending = set()
+    error = None
+    for item in items:
+        pending.add(executor.submit(fn, item))
+        if len(pending) >= workers * 2:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            error = error or _first_error(finished)
+            if error is not None:
+                break
+    finished, _ = wait(pending)
+    error = error or _first_error(finished)
+    if error is not None:
+        raise error
+
+
+def _first_error(futures):
+    for future in futures:
+        if future.exception() is not None:
+            return future.exception()
+    return None
@@ -0,0 +1,269 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping which evicts the least recently used entries when
+    it grows beyond the size limit and forgets entries older than the
+    time-to-live.
+    """
+
+    def __init__(self, size, ttl=0, clock=_clock, weigh=None):
+        """
+        :param size: maximum number of entries or their total weight.
+        :param ttl: entry time-to-live in seconds. 0 means forever.
+        :param clock: the function which returns the current time.
+        :param weigh: the function which returns the weight of a value,
+                      e.g. len(). Every entry weighs 1 by default.
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.weight = 0
+        self._clock = clock
+        self._weigh = weigh
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """
+        Looks up the key.
+        :param key: cache key.
+        :return: the cached value.
+        :raises KeyError: the key is not cached or has expired.
+        """
+        with self._lock:
+            try:
+                value, deadline, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            if deadline is not None and deadline <= self._clock():
+                self._remove(key)
+                self.misses += 1
+                raise KeyError(key)
+            self._touch(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Inserts or replaces the key, evicting the oldest entries if needed.
+        Values which weigh more than the size limit are not stored.
+        :param key: cache key.
+        :param value: the value to store.
+        """
+        deadline = self._clock() + self.ttl if self.ttl > 0 else None
+        weight = self._weigh(value) if self._weigh is not None else 1
+        with self._lock:
+            self._remove(key)
+            if weight > self.size:
+                return
+            self._data[key] = value, deadline, weight
+            self.weight += weight
+            while self.weight > self.size:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self.weight -= evicted
+
+    def pop(self, key):
+        """Removes the key if it exists."""
+        with self._lock:
+            self._remove(key)
+
+    def invalidate(self, predicate):
+        """
+        Removes all the keys for which predicate(key) is True.
+        :param predicate: callable which accepts the key.
+        :return: the number of removed keys.
+        """
+        with self._lock:
+            stale = [k for k in self._data if predicate(k)]
+            for k in stale:
+                self._remove(k)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def _remove(self, key):
+        try:
+            _, _, weight = self._data.pop(key)
+        except KeyError:
+            return
+        self.weight -= weight
+
+    def _touch(self, key):
+        self._data.move_to_end(key)
+
+
+class DiskCache(object):
+    """
+    Directory with cached blob contents which survives restarts and can be
+    shared by several processes on the same host. The files are written
+    atomically, read through memory mapping and evicted in the least
+    recently used order when their total size exceeds the limit.
+    """
+
+    LOCK_FILE = ".lock"
+    TEMP_PREFIX = ".tmp-"
+
+    def __init__(self, path, size):
+        """
+        :param path: the cache directory. It is created if it does not exist.
+        :param size: maximum total size of the cached files in bytes.
+        """
+        self.path = path
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        self._total = self._scan()[1]
+
+    @staticmethod
+    def file_name(key):
+        """
+        :param key: tuple of strings or numbers.
+        :return: the name of the file which stores the key.
+        """
+        return hashlib.sha1(
+            u"\0".join(u"%s" % k for k in key).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Maps the cached file into memory.
+        :param key: tuple(bucket name, blob name, generation).
+        :return: :class:`mmap.mmap` or empty bytes.
+        :raises KeyError: the key is not cached.
+        """
+        path = os.path.join(self.path, self.file_name(key))
+        try:
+            with open(path, "rb") as fobj:
+                # mark as recently used
+                os.utime(path, None)
+                try:
+                    data = mmap.mmap(fobj.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                except ValueError:
+                    # empty files cannot be mapped
+                    data = b""
+        except (IOError, OSError):
+            with self._lock:
+                self.misses += 1
+            raise KeyError(key)
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        Writes the file atomically, evicting the oldest files if needed.
+        :param key: tuple(bucket name, blob name, generation).
+        :param data: bytes-like object.
+        """
+        if len(data) > self.size:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=self.TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as fobj:
+                fobj.write(data)
+            getattr(os, "replace", os.rename)(
+                tmp, os.path.join(self.path, self.file_name(key)))
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._total += len(data)
+            if self._total <= self.size:
+                return
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used files until their total size is
+        below 90% of the limit. Other processes may add files at the same
+        time, so the directory is scanned every time.
+        """
+        with self._lock, self._file_lock():
+            entries, total = self._scan()
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.size * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self._total = total
+
+    def _scan(self):
+        """
+        :return: tuple(list of tuple(mtime, size, path), total size).
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith(self.TEMP_PREFIX):
+                # leftovers of the crashed writers
+                if now - stat.st_mtime > 3600:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                continue
+            if name.startswith("."):
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        return entries, total
+
+    @contextmanager
+    def _file_lock(self):
+        """Serializes the evictions between processes."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.path, self.LOCK_FILE), "a") as fobj:
+            fcntl.flock(fobj, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fobj, fcntl.LOCK_UN)
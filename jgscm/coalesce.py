@@ -0,0 +1,84 @@
+import threading
+
+
+class _KeyState(object):
+    __slots__ = ("tickets", "pending", "running", "resolved", "outcome",
+                 "waiters")
+
+    def __init__(self):
+        self.tickets = 0
+        self.pending = None
+        self.running = False
+        self.resolved = 0
+        self.outcome = None
+        self.waiters = 0
+
+
+class WriteCoalescer(object):
+    """
+    Runs at most one write per key at a time. The writes which arrive while
+    another write of the same key is in flight are merged: only the latest
+    of them is executed when the running one finishes, and all the merged
+    callers receive its result.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._states = {}
+        self.executed = 0
+        self.merged = 0
+
+    def run(self, key, fn):
+        """
+        Executes the write or waits for a newer one to cover it.
+        :param key: the written object, e.g. the path.
+        :param fn: callable without arguments which performs the write.
+        :return: the result of fn or of a newer write of the same key.
+        :raises: the exception raised by the write which covered this call.
+        """
+        with self._cond:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _KeyState()
+            state.tickets += 1
+            ticket = state.tickets
+            if state.pending is not None:
+                # the older write was not started and will never be
+                self.merged += 1
+            state.pending = ticket, fn
+            state.waiters += 1
+            try:
+                while state.resolved < ticket:
+                    if not state.running:
+                        self._execute(state)
+                    else:
+                        self._cond.wait()
+            finally:
+                state.waiters -= 1
+                if state.waiters == 0:
+                    del self._states[key]
+            result, error = state.outcome
+        if error is not None:
+            raise error
+        return result
+
+    def _execute(self, state):
+        """
+        Runs the pending write outside of the lock. Must be called with the
+        lock held.
+        """
+        ticket, fn = state.pending
+        state.pending = None
+        state.running = True
+        self.executed += 1
+        self._cond.release()
+        try:
+            outcome = fn(), None
+        except Exception as e:
+            outcome = None, e
+        finally:
+            self._cond.acquire()
+            state.running = False
+            self._cond.notify_all()
+        state.resolved = ticket
+        state.outcome = outcome
@@ -0,0 +1,90 @@
+import base64
+import binascii
+import codecs
+import hashlib
+import struct
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
+#: base64.encodebytes() splits the lines after this number of bytes.
+LINE_BYTES = 57
+
+
+def decode_utf8(data, sniff=1 << 16):
+    """
+    Decodes UTF-8 bytes. The beginning is validated first, so that binary
+    data fails before a text copy of the whole contents is allocated.
+    :param data: bytes-like object.
+    :param sniff: the number of bytes to validate first.
+    :return: the decoded string.
+    :raises UnicodeDecodeError: the data is not valid UTF-8.
+    """
+    view = memoryview(data)
+    head = codecs.getincrementaldecoder("utf-8")().decode(
+        view[:sniff], final=len(view) <= sniff)
+    if len(view) <= sniff:
+        return head
+    del head
+    return codecs.decode(view, "utf-8")
+
+
+def encode_base64(data, size=LINE_BYTES << 14):
+    """
+    Encodes bytes to base64 text in the same format as
+    base64.encodebytes(). The data is encoded in slices without copying
+    it, which avoids the per-line temporary objects of encodebytes().
+    :param data: bytes-like object.
+    :param size: the number of bytes to encode at once, rounded down to a
+                 multiple of the line length.
+    :return: base64 string with a newline after every 76 characters.
+    """
+    view = memoryview(data)
+    step = max(size // LINE_BYTES, 1) * LINE_BYTES
+    return u"".join(
+        base64.encodebytes(view[start:start + step]).decode("ascii")
+        for start in range(0, len(view), step))
+
+
+def md5_base64(data):
+    """
+    :param data: bytes-like object.
+    :return: base64 MD5 digest in the format of Blob.md5_hash.
+    """
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+def crc32c_base64(data):
+    """
+    :param data: bytes-like object.
+    :return: base64 CRC32C checksum in the format of Blob.crc32c or None \
+             if google-crc32c is not installed.
+    """
+    if google_crc32c is None:
+        return None
+    return base64.b64encode(
+        struct.pack(">I", google_crc32c.value(bytes(data)))).decode("ascii")
+
+
+def iter_base64(text, size=3 << 20):
+    """
+    Decodes base64 text piece by piece. Whitespace is ignored, as in
+    base64.decodebytes().
+    :param text: base64 encoded string.
+    :param size: the approximate number of bytes to yield at once.
+    :return: generator of bytes.
+    :raises binascii.Error: the text is not valid base64.
+    :raises UnicodeEncodeError: the text contains non-ASCII characters.
+    """
+    step = max(size // 3, 1) * 4
+    rest = b""
+    for start in range(0, len(text), step):
+        piece = text[start:start + step].encode("ascii")
+        piece = rest + b"".join(piece.split())
+        cut = len(piece) - len(piece) % 4
+        rest = piece[cut:]
+        yield binascii.a2b_base64(piece[:cut])
+    if rest:
+        raise binascii.Error("Incorrect padding")
@@ -0,0 +1,339 @@
+from contextlib import contextmanager
+from functools import wraps
+import inspect
+import threading
+import weakref
+
+try:
+    from prometheus_client.core import REGISTRY, CounterMetricFamily, \
+        HistogramMetricFamily
+except ImportError:
+    REGISTRY = None
+
+#: The upper bounds of the request latency histogram in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+#: GCS request types by the names of the retried operations.
+CALL_TYPES = {
+    "get_bucket": "get",
+    "get_blob": "get",
+    "exists": "get",
+    "list_buckets": "list",
+    "list_blobs": "list",
+    "download_as_bytes": "download",
+    "upload_from_string": "upload",
+    "create_resumable_upload_session": "upload",
+    "resumable_upload": "upload",
+    "rewrite": "copy",
+    "compose": "compose",
+    "delete": "delete",
+    "delete_blob": "delete",
+    "batch_delete": "delete",
+    "create_bucket": "create",
+}
+
+
+class _Histogram(object):
+    __slots__ = ("count", "errors", "sum", "buckets")
+
+    def __init__(self, size):
+        self.count = 0
+        self.errors = 0
+        self.sum = 0.0
+        self.buckets = [0] * size
+
+
+class Metrics(object):
+    """
+    Counts the GCS requests and the transferred bytes and measures the
+    request latencies. Each request is attributed to its type, to the
+    contents operation which sent it, e.g. "get" or "save", and optionally
+    to the bucket of the operation's path.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, bucket_label=False):
+        """
+        :param buckets: the upper bounds of the latency histogram in
+                        seconds.
+        :param bucket_label: attribute the requests to the buckets. Every
+                             bucket adds its own counters, so the number of
+                             buckets should be bounded.
+        """
+        self.buckets = tuple(buckets)
+        self.bucket_label = bucket_label
+        self.requests = {}
+        self.bytes = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def context(self):
+        """
+        :return: tuple(the current contents operation, bucket name).
+        """
+        return getattr(self._local, "context", ("", ""))
+
+    @contextmanager
+    def operation(self, name, bucket=""):
+        """
+        Attributes the requests sent by the current thread inside the block
+        to the contents operation. The nested operations are attributed to
+        the outermost one.
+        :param name: the contents operation, e.g. "get".
+        :param bucket: the bucket name.
+        """
+        previous = getattr(self._local, "context", None)
+        if previous is None:
+            self._local.context = name, bucket if self.bucket_label else ""
+        try:
+            yield
+        finally:
+            if previous is None:
+                del self._local.context
+
+    def bind(self, fn):
+        """
+        :param fn: callable which is going to be run in another thread.
+        :return: callable which runs fn in the current contents operation.
+        """
+        context = self.context
+
+        def bound(*args, **kwargs):
+            with self.operation(*context):
+                return fn(*args, **kwargs)
+
+        return bound
+
+    def observe(self, operation, seconds, error=None):
+        """
+        Records a GCS request.
+        :param operation: the name of the GCS API method, see CALL_TYPES.
+        :param seconds: the request duration.
+        :param error: the raised exception or None.
+        """
+        key = (CALL_TYPES.get(operation, operation),) + self.context
+        with self._lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = _Histogram(
+                    len(self.buckets))
+            histogram.count += 1
+            histogram.sum += seconds
+            if error is not None:
+                histogram.errors += 1
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram.buckets[i] += 1
+                    break
+
+    def transferred(self, direction, nbytes):
+        """
+        Records the transferred bytes.
+        :param direction: "download" or "upload".
+        :param nbytes: the number of bytes.
+        """
+        key = (direction,) + self.context
+        with self._lock:
+            self.bytes[key] = self.bytes.get(key, 0) + nbytes
+
+    def as_dict(self):
+        """
+        :return: dict with "requests" and "bytes" lists of dicts.
+        """
+        with self._lock:
+            requests = [{
+                "call": call, "operation": operation, "bucket": bucket,
+                "count": h.count, "errors": h.errors, "seconds": h.sum,
+                "buckets": list(h.buckets),
+            } for (call, operation, bucket), h in self.requests.items()]
+            nbytes = [{
+                "direction": direction, "operation": operation,
+                "bucket": bucket, "bytes": n,
+            } for (direction, operation, bucket), n in self.bytes.items()]
+        return {"requests": requests, "bytes": nbytes}
+
+
+def path_argument(fn):
+    """
+    :param fn: method which has "path" or "old_path" argument.
+    :return: function which accepts the method's args and kwargs without
+             self and returns the path or "".
+    """
+    # see through the other decorators
+    while hasattr(fn, "__wrapped__"):
+        fn = fn.__wrapped__
+    names = inspect.getfullargspec(fn).args
+    index = next((i for i, n in enumerate(names)
+                  if n in ("path", "old_path")), None)
+
+    def get_path(args, kwargs):
+        if index is None:
+            return ""
+        if index <= len(args):
+            return args[index - 1]
+        return kwargs.get(names[index], "")
+
+    return get_path
+
+
+def measured(fn):
+    """
+    Decorates a method of the contents manager or the checkpoints which
+    have the metrics property: the GCS requests sent by the method are
+    attributed to its name and to the bucket of its path argument.
+    """
+    get_path = path_argument(fn)
+
+    @wraps(fn)
+    def wrapped(self, *args, **kwargs):
+        metrics = self.metrics
+        if metrics is None:
+            return fn(self, *args, **kwargs)
+        bucket = _bucket_name(get_path(args, kwargs))
+        with metrics.operation(fn.__name__, bucket):
+            return fn(self, *args, **kwargs)
+
+    return wrapped
+
+
+def _bucket_name(path):
+    bucket = getattr(path, "bucket", None)
+    if bucket is not None:
+        # a StorageObject or a Blob
+        return getattr(bucket, "name", bucket)
+    return (path or "").lstrip("/").partition("/")[0]
+
+
+class PrometheusCollector(object):
+    """
+    Exposes the sum of the registered :class:`Metrics` through
+    prometheus_client, e.g. on the /metrics page of the Jupyter server.
+    The totals of the garbage collected instances are retained, so that
+    the exported counters never decrease. The bucket label is exported
+    only if some requests were attributed to buckets.
+    """
+
+    def __init__(self):
+        # tuple(weak reference, requests, bytes, lock) of every instance
+        self._sources = []
+        # requests, bytes and lock of the garbage collected instances
+        self._retired = {}, {}, threading.Lock()
+        self._buckets = None
+        self._lock = threading.Lock()
+
+    def add(self, metrics):
+        """
+        Registers the metrics. Its counters are kept after it is garbage
+        collected.
+        :param metrics: :class:`Metrics` instance.
+        """
+        with self._lock:
+            if self._buckets is None:
+                self._buckets = metrics.buckets
+            self._retire()
+            self._sources.append((weakref.ref(metrics), metrics.requests,
+                                  metrics.bytes, metrics._lock))
+
+    def totals(self):
+        """
+        Sums the counters of all the registered instances.
+        :return: tuple(dict (call, operation, bucket) -> _Histogram,
+                 dict (direction, operation, bucket) -> number of bytes).
+        """
+        with self._lock:
+            self._retire()
+            totals = {}, {}
+            self._add(totals, self._retired)
+            for source in self._sources:
+                self._add(totals, source[1:])
+        return totals
+
+    def _retire(self):
+        """
+        Moves the counters of the garbage collected instances to the
+        retained totals. The caller holds the lock.
+        """
+        alive = []
+        for source in self._sources:
+            if source[0]() is None:
+                self._add(self._retired[:2], source[1:])
+            else:
+                alive.append(source)
+        self._sources = alive
+
+    def _add(self, totals, source):
+        """
+        Adds the counters of the source to the totals.
+        :param totals: tuple(requests, bytes) to update.
+        :param source: tuple(requests, bytes, lock which guards them).
+        """
+        requests, nbytes, lock = source
+        with lock:
+            for key, histogram in requests.items():
+                total = totals[0].get(key)
+                if total is None:
+                    total = totals[0][key] = _Histogram(
+                        len(histogram.buckets))
+                total.count += histogram.count
+                total.errors += histogram.errors
+                total.sum += histogram.sum
+                total.buckets = [a + b for a, b in zip(total.buckets,
+                                                       histogram.buckets)]
+            for key, n in nbytes.items():
+                totals[1][key] = totals[1].get(key, 0) + n
+
+    def collect(self):
+        requests, nbytes = self.totals()
+        buckets = self._buckets or LATENCY_BUCKETS
+        with_bucket = any(key[2] for key in requests) or \
+            any(key[2] for key in nbytes)
+        width = 3 if with_bucket else 2
+        labels = ["call", "operation", "bucket"][:width]
+        calls = CounterMetricFamily(
+            "jgscm_gcs_requests", "GCS requests.", labels=labels)
+        errors = CounterMetricFamily(
+            "jgscm_gcs_request_errors", "Failed GCS requests.",
+            labels=labels)
+        latency = HistogramMetricFamily(
+            "jgscm_gcs_request_duration_seconds",
+            "GCS request latency in seconds.", labels=labels)
+        for key, h in sorted(requests.items()):
+            key = key[:width]
+            calls.add_metric(key, h.count)
+            errors.add_metric(key, h.errors)
+            cumulative = []
+            running = 0
+            for bound, n in zip(buckets, h.buckets):
+                running += n
+                cumulative.append((repr(float(bound)), running))
+            cumulative.append(("+Inf", h.count))
+            latency.add_metric(key, cumulative, h.sum)
+        transferred = CounterMetricFamily(
+            "jgscm_gcs_bytes", "Bytes transferred to and from GCS.",
+            labels=["direction", "operation", "bucket"][:width])
+        for key, n in sorted(nbytes.items()):
+            transferred.add_metric(key[:width], n)
+        return [calls, errors, latency, transferred]
+
+
+_collector = None
+_collector_lock = threading.Lock()
+
+
+def register_prometheus(metrics):
+    """
+    Adds the metrics to the default prometheus_client registry. Does
+    nothing if prometheus_client is not installed.
+    :param metrics: :class:`Metrics` instance. Its counters are exported
+                    until the process exits.
+    :return: :class:`PrometheusCollector` or None.
+    """
+    global _collector
+    if REGISTRY is None:
+        return None
+    with _collector_lock:
+        if _collector is None:
+            _collector = PrometheusCollector()
+            REGISTRY.register(_collector)
+        _collector.add(metrics)
+    return _collector
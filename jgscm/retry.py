@@ -0,0 +1,180 @@
+import errno
+from functools import partial
+import random
+import socket
+import threading
+import time
+
+from requests.exceptions import ChunkedEncodingError, ConnectTimeout, \
+    ConnectionError as HTTPConnectionError, Timeout
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+RETRIABLE_STATUSES = frozenset((408, 429, 500, 502, 503, 504))
+#: errno-s of the broken connections.
+CONNECTION_ERRNOS = frozenset((errno.EPIPE, errno.ECONNRESET,
+                               errno.ECONNABORTED, errno.ETIMEDOUT))
+
+
+def is_retriable(error, idempotent=True):
+    """
+    Classifies the error raised by a GCS request.
+    :param error: the raised exception.
+    :param idempotent: value indicating whether the request can be repeated
+                       after it has possibly reached GCS. Otherwise only
+                       the requests which were surely not executed are
+                       retried: the rate limited ones and the ones which
+                       could not connect.
+    :return: True if the request should be retried, otherwise False.
+    """
+    code = getattr(error, "code", None)
+    if isinstance(error, ConnectTimeout) or code == 429:
+        return True
+    if not idempotent:
+        return False
+    if isinstance(error, (HTTPConnectionError, Timeout,
+                          ChunkedEncodingError)):
+        return True
+    if isinstance(error, socket.error):
+        return error.errno in CONNECTION_ERRNOS
+    return code in RETRIABLE_STATUSES
+
+
+def backoff(attempt, initial, maximum):
+    """
+    :param attempt: the number of the failed attempts, starting from 1.
+    :param initial: the delay after the first failure in seconds.
+    :param maximum: the upper bound of the delay in seconds.
+    :return: the exponential delay with random jitter in seconds.
+    """
+    return min(initial * 2 ** (attempt - 1), maximum) * \
+        random.uniform(0.5, 1)
+
+
+class RetryPolicy(object):
+    """
+    Repeats the GCS requests which fail with transient errors. The delays
+    between the attempts grow exponentially with random jitter, and the
+    request is given up when the number of retries or the total time
+    budget is exhausted. The retries are counted per operation.
+    """
+
+    def __init__(self, attempts=5, initial=0.5, maximum=16, deadline=60,
+                 log=None, observer=None, tracer=None, sleep=time.sleep,
+                 clock=_clock):
+        """
+        :param attempts: the maximum number of retries of a request.
+        :param initial: the delay after the first failure in seconds.
+        :param maximum: the upper bound of a delay in seconds.
+        :param deadline: the time budget of a request including all the
+                         retries in seconds. 0 means unlimited.
+        :param log: :class:`logging.Logger` to report the retries to.
+        :param observer: object with observe(operation, seconds, error)
+                         method which is notified about every attempt,
+                         e.g. :class:`jgscm.metrics.Metrics`.
+        :param tracer: :class:`jgscm.tracing.Tracer` which receives a span
+                       of every attempt.
+        :param sleep: the function which waits between the attempts.
+        :param clock: the function which returns the current time.
+        """
+        self.attempts = attempts
+        self.initial = initial
+        self.maximum = maximum
+        self.deadline = deadline
+        self.log = log
+        self.observer = observer
+        self.tracer = tracer
+        self.retries = {}
+        self.exhausted = {}
+        self._sleep = sleep
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Calls the idempotent function with the arguments, e.g.
+        policy.call(bucket.get_blob, name).
+        :return: the result of fn.
+        """
+        return self.run(partial(fn, *args, **kwargs),
+                        getattr(fn, "__name__", "call"))
+
+    def run(self, fn, operation, idempotent=True):
+        """
+        Calls fn until it succeeds or the error is not worth retrying.
+        :param fn: callable without arguments which sends the request.
+        :param operation: the name of the operation to count.
+        :param idempotent: see :func:`is_retriable`.
+        :return: the result of fn.
+        :raises: the last error of fn.
+        """
+        start = self._clock()
+        attempt = 0
+        while True:
+            try:
+                return self.attempt(fn, operation)
+            except Exception as e:
+                if not is_retriable(e, idempotent):
+                    raise
+                attempt += 1
+                delay = backoff(attempt, self.initial, self.maximum)
+                if attempt > self.attempts or self.deadline > 0 and \
+                        self._clock() + delay - start > self.deadline:
+                    self._count(self.exhausted, operation)
+                    raise
+                if self.log is not None:
+                    self.log.debug("retrying %s in %.2fs after %r",
+                                   operation, delay, e)
+            self._count(self.retries, operation)
+            self._sleep(delay)
+
+    def attempt(self, fn, operation):
+        """
+        Calls fn once and reports the attempt to the observer and to the
+        tracer.
+        :param fn: callable without arguments which sends the request.
+        :param operation: the name of the operation.
+        :return: the result of fn.
+        """
+        observer, tracer = self.observer, self.tracer
+        if observer is None and tracer is None:
+            return fn()
+        span = tracer.start(operation, "gcs", {}) \
+            if tracer is not None else None
+        start = self._clock()
+        error = None
+        try:
+            return fn()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if observer is not None:
+                observer.observe(operation, self._clock() - start, error)
+            if tracer is not None:
+                tracer.end(span, error)
+
+    def wait(self, attempt, operation):
+        """
+        Counts the retry and waits before it. This is for the callers which
+        run their own retry loop.
+        :param attempt: the number of the failed attempts, starting from 1.
+        :param operation: the name of the operation to count.
+        :return: None
+        """
+        self._count(self.retries, operation)
+        self._sleep(backoff(attempt, self.initial, self.maximum))
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "retries": dict(self.retries),
+                "exhausted": dict(self.exhausted),
+            }
+
+    def _count(self, counter, operation):
+        with self._lock:
+            counter[operation] = counter.get(operation, 0) + 1
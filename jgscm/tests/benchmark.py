@@ -0,0 +1,96 @@
+"""
+Measures the peak memory and the time of the content conversions which
+GoogleStorageContentManager performs when it reads and saves files.
+
+    python -m jgscm.tests.benchmark --size 64
+
+The peak memory is traced with tracemalloc and reported relative to the
+file size, excluding the input which exists before the conversion.
+"""
+import argparse
+import base64
+import binascii
+import os
+import time
+import tracemalloc
+
+from jgscm.codec import decode_utf8, encode_base64
+
+
+def read_baseline(data):
+    """The conversion of the downloaded bytes before jgscm.codec."""
+    try:
+        return data.decode("utf8")
+    except UnicodeError:
+        pass
+    return base64.encodebytes(data).decode("ascii")
+
+
+def read_codec(data):
+    try:
+        return decode_utf8(data)
+    except UnicodeError:
+        pass
+    return encode_base64(data)
+
+
+def save_baseline(content):
+    """The conversion of the saved base64 content before jgscm.codec."""
+    b64_bytes = content.encode("ascii")
+    bcontent = base64.decodebytes(b64_bytes)
+    return b64_bytes, bcontent
+
+
+def save_codec(content):
+    return binascii.a2b_base64(content)
+
+
+def measure(fn, arg):
+    """
+    :return: tuple(peak allocated bytes, seconds).
+    """
+    tracemalloc.start()
+    try:
+        start = time.time()
+        result = fn(arg)
+        elapsed = time.time() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=64,
+                        help="File size in megabytes.")
+    args = parser.parse_args()
+    size = args.size << 20
+    binary = os.urandom(size)
+    text = b"0123456789abcde\n" * (size // 16)
+    # a text file which turns out to be binary only at the end
+    almost_text = text[:-16] + b"\xff" * 16
+    content = base64.encodebytes(binary).decode("ascii")
+    cases = (
+        ("read binary", binary, read_baseline, read_codec),
+        ("read text", text, read_baseline, read_codec),
+        ("read almost text", almost_text, read_baseline, read_codec),
+        ("save base64", content, save_baseline, save_codec),
+    )
+    print("%-18s %21s %21s" % ("", "peak memory", "time"))
+    print("%-18s %10s %10s %10s %10s" % (
+        "", "baseline", "codec", "baseline", "codec"))
+    for name, arg, baseline, codec in cases:
+        peaks = []
+        times = []
+        for fn in (baseline, codec):
+            peak, elapsed = measure(fn, arg)
+            peaks.append(peak / size)
+            times.append(elapsed)
+        print("%-18s %9.2fx %9.2fx %9.2fs %9.2fs" % (
+            (name,) + tuple(peaks) + tuple(times)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Measures the GCS requests, the time and the peak memory of the contents
+operations of GoogleStorageContentManager against the in-memory fake GCS.
+
+    python -m jgscm.tests.benchmark_contents --scale 10 1000 100000
+
+Every scale populates a directory with that many files. Each operation
+runs in a new contents manager, so the caches are cold. The operations
+run twice on freshly populated buckets: the first time they are timed,
+the second time their peak memory is traced with tracemalloc, which
+would slow down the timed run. The peak excludes the fake GCS objects
+which exist before the operation. --decorate wraps the storage backend
+in the given jgscm.backend.BackendDecorator classes to measure their
+effect.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import nbformat
+
+import jgscm
+from jgscm import GoogleStorageContentManager
+from jgscm.tests.fakegcs import FakeClient, FakeStorage
+
+BUCKET = "bench"
+NOTEBOOK = BUCKET + "/notebook.ipynb"
+
+
+def populate(storage, scale, size):
+    """Creates the bucket with the notebook and scale files in data/."""
+    storage.reset()
+    FakeClient(storage=storage).bucket(BUCKET).create()
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell("print('hello')"))
+    storage.put(BUCKET, "notebook.ipynb", nbformat.writes(nb).encode(),
+                "application/x-ipynb+json")
+    data = b"x" * size
+    for i in range(scale):
+        storage.put(BUCKET, "data/file-%06d.txt" % i, data, "text/plain")
+
+
+def operations(scale):
+    """
+    :return: list of tuple(name, setup, run). setup(manager) is not
+             measured and returns the argument of run(manager, arg). The
+             operations run in this order on the same bucket.
+    """
+    first = BUCKET + "/data/file-%06d.txt" % 0
+    last = BUCKET + "/data/file-%06d.txt" % (scale - 1)
+
+    def text_model(cm):
+        return {"type": "file", "format": "text", "content": "y" * 1024}
+
+    def notebook_model(cm):
+        return cm.get(NOTEBOOK)
+
+    def checkpoint_id(cm):
+        return cm.list_checkpoints(NOTEBOOK)[0]["id"]
+
+    def nothing(cm):
+        return None
+
+    return [
+        ("list directory", nothing,
+         lambda cm, _: cm.get(BUCKET + "/data/")),
+        ("get file", nothing, lambda cm, _: cm.get(last)),
+        ("get notebook", nothing, lambda cm, _: cm.get(NOTEBOOK)),
+        ("save file", text_model,
+         lambda cm, model: cm.save(model, BUCKET + "/new.txt")),
+        ("save notebook", notebook_model,
+         lambda cm, model: cm.save(model, NOTEBOOK)),
+        ("create checkpoint", nothing,
+         lambda cm, _: cm.create_checkpoint(NOTEBOOK)),
+        ("list checkpoints", nothing,
+         lambda cm, _: cm.list_checkpoints(NOTEBOOK)),
+        ("restore checkpoint", checkpoint_id,
+         lambda cm, cid: cm.restore_checkpoint(cid, NOTEBOOK)),
+        ("rename file", nothing,
+         lambda cm, _: cm.rename(first, BUCKET + "/renamed.txt")),
+        ("delete file", nothing,
+         lambda cm, _: cm.delete(BUCKET + "/renamed.txt")),
+        ("rename directory", nothing,
+         lambda cm, _: cm.rename(BUCKET + "/data", BUCKET + "/moved")),
+        ("delete directory", nothing,
+         lambda cm, _: cm.delete(BUCKET + "/moved")),
+    ]
+
+
+def measure(storage, setup, run, decorators=(), trace=False):
+    """
+    :param decorators: the backend_decorators of the contents manager.
+    :param trace: measure the peak allocated bytes instead of the time.
+    :return: tuple(the number of requests, Counter of the calls by kind,
+             seconds or peak allocated bytes if trace is set).
+    """
+    cm = GoogleStorageContentManager(backend_decorators=list(decorators))
+    arg = setup(cm)
+    storage.calls.clear()
+    if not trace:
+        start = time.time()
+        run(cm, arg)
+        return storage.requests, storage.calls.copy(), time.time() - start
+    tracemalloc.start()
+    try:
+        run(cm, arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return storage.requests, storage.calls.copy(), peak
+
+
+def run_all(storage, scale, size, decorators=(), trace=False):
+    """
+    Populates the bucket and measures all the operations in order.
+    :return: list of the results of measure().
+    """
+    populate(storage, scale, size)
+    return [measure(storage, setup, run, decorators, trace)
+            for _, setup, run in operations(scale)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", type=int, nargs="+",
+                        default=[10, 1000, 100000],
+                        help="The numbers of files in the directory.")
+    parser.add_argument("--size", type=int, default=1024,
+                        help="The size of each file in bytes.")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="The delay of each GCS request in seconds.")
+    parser.add_argument("--decorate", nargs="*", default=[],
+                        help="The import strings of the backend "
+                             "decorators, the first is the innermost.")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON lines.")
+    args = parser.parse_args()
+    storage = FakeStorage(latency=args.latency)
+    jgscm.GSClient = FakeClient
+    FakeClient.storage = storage
+    if not args.json:
+        print("%8s %-20s %9s %9s %10s  %s" % (
+            "scale", "operation", "requests", "time", "peak", "by kind"))
+    for scale in args.scale:
+        timed = run_all(storage, scale, args.size, args.decorate)
+        traced = run_all(storage, scale, args.size, args.decorate, True)
+        names = [name for name, _, _ in operations(scale)]
+        for name, (requests, calls, elapsed), (_, _, peak) in zip(
+                names, timed, traced):
+            if args.json:
+                print(json.dumps({
+                    "scale": scale, "operation": name,
+                    "requests": requests, "calls": dict(calls),
+                    "seconds": elapsed, "peak_bytes": peak}))
+                continue
+            print("%8d %-20s %9d %8.3fs %8.2fMB  %s" % (
+                scale, name, requests, elapsed, peak / float(1 << 20),
+                " ".join("%s:%d" % c for c in sorted(calls.items()))))
+
+
+if __name__ == "__main__":
+    main()
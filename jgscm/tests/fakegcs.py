@@ -0,0 +1,493 @@
+"""
+In-memory stand-in for the part of google.cloud.storage which jgscm uses.
+The requests are counted by kind and can be delayed to emulate the network
+latency. Replace the client class to use it:
+
+    import jgscm
+    from jgscm.tests.fakegcs import FakeClient
+    jgscm.GSClient = FakeClient
+
+All the clients share FakeClient.storage unless they are given another one.
+"""
+from bisect import bisect_left
+import base64
+import collections
+from datetime import datetime
+import hashlib
+import itertools
+import threading
+import time
+
+from google.cloud._helpers import UTC, _datetime_to_rfc3339
+from google.cloud.exceptions import Conflict, NotFound, PreconditionFailed
+from google.cloud.storage import Blob, Bucket
+
+
+class _Object(object):
+    __slots__ = ("data", "content_type", "generation", "updated", "metadata")
+
+    def __init__(self, data, content_type, generation, metadata=None):
+        self.data = bytes(data)
+        self.content_type = content_type or "application/octet-stream"
+        self.generation = generation
+        self.updated = _datetime_to_rfc3339(datetime.now(UTC))
+        self.metadata = metadata
+
+    def resource(self, bucket, name):
+        resource = {
+            "name": name,
+            "bucket": bucket,
+            "generation": str(self.generation),
+            "size": str(len(self.data)),
+            "contentType": self.content_type,
+            "updated": self.updated,
+            "timeCreated": self.updated,
+            "md5Hash": base64.b64encode(
+                hashlib.md5(self.data).digest()).decode("ascii"),
+        }
+        if self.metadata:
+            resource["metadata"] = dict(self.metadata)
+        return resource
+
+
+class _Bucket(object):
+    """The objects of a bucket and their names sorted on demand."""
+
+    def __init__(self):
+        self.objects = {}
+        self._names = None
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = sorted(self.objects)
+        return self._names
+
+    def put(self, name, obj):
+        if name not in self.objects:
+            self._names = None
+        self.objects[name] = obj
+
+    def pop(self, name):
+        del self.objects[name]
+        self._names = None
+
+
+class FakeStorage(object):
+    """
+    The state of the fake GCS: buckets, objects, resumable upload sessions
+    and request counters.
+    """
+
+    def __init__(self, latency=0):
+        """
+        :param latency: the delay of every request in seconds or a function
+                        which returns it for the request kind, e.g. "get".
+        """
+        self.latency = latency
+        self.calls = collections.Counter()
+        #: exceptions or HTTP status codes returned by the next upload
+        #: chunk requests.
+        self.failures = []
+        self.buckets = {}
+        self.sessions = {}
+        self.lock = threading.RLock()
+        self._generations = itertools.count(1)
+        self._local = threading.local()
+
+    def reset(self):
+        """Removes all the buckets and zeroes the counters."""
+        with self.lock:
+            self.buckets.clear()
+            self.sessions.clear()
+            self.calls.clear()
+            del self.failures[:]
+
+    @property
+    def requests(self):
+        """
+        :return: the number of HTTP requests sent so far. The operations
+                 inside a batch do not count.
+        """
+        return sum(n for kind, n in self.calls.items()
+                   if not kind.startswith("batched "))
+
+    def request(self, kind):
+        """Counts the request and waits for the latency."""
+        if getattr(self._local, "batch", False):
+            self.calls["batched " + kind] += 1
+            return
+        self.calls[kind] += 1
+        latency = self.latency
+        if callable(latency):
+            latency = latency(kind)
+        if latency > 0:
+            time.sleep(latency)
+
+    def bucket(self, name):
+        """
+        :return: :class:`_Bucket`.
+        :raises NotFound: the bucket does not exist.
+        """
+        try:
+            return self.buckets[name]
+        except KeyError:
+            raise NotFound("bucket %s" % name)
+
+    def get(self, bucket, name):
+        """
+        :return: :class:`_Object`.
+        :raises NotFound: the object does not exist.
+        """
+        try:
+            return self.bucket(bucket).objects[name]
+        except KeyError:
+            raise NotFound("%s/%s" % (bucket, name))
+
+    def check(self, bucket, name, generation):
+        """
+        Checks the generation precondition of a request.
+        :param generation: the required generation, 0 if the object must
+                           not exist, None to skip the check.
+        :raises PreconditionFailed: the generation does not match.
+        """
+        if generation is None:
+            return
+        obj = self.bucket(bucket).objects.get(name)
+        if (obj.generation if obj is not None else 0) != int(generation):
+            raise PreconditionFailed("%s/%s" % (bucket, name))
+
+    def put(self, bucket, name, data, content_type=None, metadata=None,
+            if_generation_match=None):
+        """
+        Stores the object without counting a request, e.g. to populate the
+        bucket before a benchmark.
+        :return: :class:`_Object`.
+        """
+        with self.lock:
+            self.check(bucket, name, if_generation_match)
+            obj = _Object(data, content_type, next(self._generations),
+                          metadata)
+            self.bucket(bucket).put(name, obj)
+        return obj
+
+
+class FakeBlob(Blob):
+    @property
+    def _storage(self):
+        return self.bucket.client.storage
+
+    def _store(self, data, content_type, metadata=None,
+               if_generation_match=None):
+        obj = self._storage.put(self.bucket.name, self.name, data,
+                                content_type, metadata or self.metadata,
+                                if_generation_match)
+        self._set_properties(obj.resource(self.bucket.name, self.name))
+
+    def exists(self, client=None, **kwargs):
+        self._storage.request("get")
+        with self._storage.lock:
+            return self.name in self._storage.bucket(self.bucket.name).objects
+
+    def reload(self, client=None, **kwargs):
+        self._storage.request("get")
+        with self._storage.lock:
+            obj = self._storage.get(self.bucket.name, self.name)
+            self._set_properties(obj.resource(self.bucket.name, self.name))
+
+    def delete(self, client=None, if_generation_match=None, **kwargs):
+        storage = self._storage
+        storage.request("delete")
+        with storage.lock:
+            storage.get(self.bucket.name, self.name)
+            storage.check(self.bucket.name, self.name, if_generation_match)
+            storage.bucket(self.bucket.name).pop(self.name)
+
+    def upload_from_string(self, data, content_type="text/plain",
+                           if_generation_match=None, **kwargs):
+        self._storage.request("upload")
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self._store(data, content_type,
+                    if_generation_match=if_generation_match)
+
+    def download_as_bytes(self, client=None, start=None, end=None,
+                          **kwargs):
+        self._storage.request("download")
+        with self._storage.lock:
+            obj = self._storage.get(self.bucket.name, self.name)
+        if self.generation is not None and \
+                obj.generation != int(self.generation):
+            # only the live generation is kept
+            raise NotFound("%s/%s#%s" % (self.bucket.name, self.name,
+                                         self.generation))
+        data = obj.data
+        if start is not None or end is not None:
+            data = data[start or 0:end + 1 if end is not None else None]
+        return data
+
+    def rewrite(self, source, token=None, client=None, **kwargs):
+        self._storage.request("rewrite")
+        with self._storage.lock:
+            obj = self._storage.get(source.bucket.name, source.name)
+            self._store(obj.data, obj.content_type, obj.metadata)
+        return None, len(obj.data), len(obj.data)
+
+    def compose(self, sources, client=None, if_generation_match=None,
+                if_source_generation_match=None, **kwargs):
+        self._storage.request("compose")
+        with self._storage.lock:
+            objects = [self._storage.get(s.bucket.name, s.name)
+                       for s in sources]
+            for s, generation in zip(sources,
+                                     if_source_generation_match or ()):
+                if generation is not None:
+                    self._storage.check(s.bucket.name, s.name, generation)
+            self._store(b"".join(o.data for o in objects),
+                        self.content_type or objects[0].content_type,
+                        if_generation_match=if_generation_match)
+
+    def create_resumable_upload_session(self, content_type=None, size=None,
+                                        origin=None, client=None, **kwargs):
+        storage = self._storage
+        storage.request("upload_session")
+        with storage.lock:
+            url = "session-%d" % len(storage.sessions)
+            storage.sessions[url] = {
+                "data": b"", "blob": self, "content_type": content_type,
+                "if_generation_match": kwargs.get("if_generation_match")}
+        return url
+
+
+class FakeBucket(Bucket):
+    @property
+    def _storage(self):
+        return self.client.storage
+
+    def blob(self, blob_name, chunk_size=None, encryption_key=None,
+             kms_key_name=None, generation=None):
+        return FakeBlob(blob_name, self, chunk_size=chunk_size,
+                        generation=generation)
+
+    def exists(self, client=None, **kwargs):
+        self._storage.request("get_bucket")
+        return self.name in self._storage.buckets
+
+    def create(self, client=None, **kwargs):
+        storage = self._storage
+        storage.request("create_bucket")
+        with storage.lock:
+            if self.name in storage.buckets:
+                raise Conflict("bucket %s" % self.name)
+            storage.buckets[self.name] = _Bucket()
+
+    def delete(self, force=False, client=None, **kwargs):
+        storage = self._storage
+        storage.request("delete_bucket")
+        with storage.lock:
+            if storage.bucket(self.name).objects and not force:
+                raise Conflict("bucket %s is not empty" % self.name)
+            del storage.buckets[self.name]
+
+    def get_blob(self, blob_name, client=None, generation=None, **kwargs):
+        blob = self.blob(blob_name)
+        try:
+            blob.reload()
+        except NotFound:
+            return None
+        return blob
+
+    def list_blobs(self, max_results=None, page_token=None, prefix=None,
+                   delimiter=None, **kwargs):
+        """
+        Lists a single page. The page token is the last returned name or
+        prefix.
+        """
+        storage = self._storage
+        storage.request("list")
+        prefix = prefix or ""
+        with storage.lock:
+            bucket = storage.bucket(self.name)
+            names = bucket.names
+            objects = bucket.objects
+        index = bisect_left(names, prefix)
+        if page_token is not None:
+            index = max(index, _skip(names, page_token, delimiter))
+        blobs, prefixes = [], set()
+        token = last = None
+        while index < len(names) and names[index].startswith(prefix):
+            name = key = names[index]
+            end = name.find(delimiter, len(prefix)) if delimiter else -1
+            if end >= 0:
+                key = name[:end + len(delimiter)]
+            if max_results is not None and \
+                    len(blobs) + len(prefixes) >= max_results:
+                token = last
+                break
+            if end >= 0:
+                prefixes.add(key)
+                index = _skip(names, key, delimiter)
+            else:
+                blob = self.blob(name)
+                try:
+                    blob._set_properties(
+                        objects[name].resource(self.name, name))
+                except KeyError:
+                    # deleted after the names were sorted
+                    index += 1
+                    continue
+                blobs.append(blob)
+                index += 1
+            last = key
+        return _Page(blobs, prefixes, token)
+
+    def delete_blob(self, blob_name, client=None, if_generation_match=None,
+                    **kwargs):
+        self.blob(blob_name).delete(if_generation_match=if_generation_match)
+
+
+def _skip(names, token, delimiter):
+    """
+    :return: the index of the first name after the token, skipping all
+             the names under the token if it is a prefix.
+    """
+    if delimiter and token.endswith(delimiter):
+        return bisect_left(names, token[:-1] + chr(ord(token[-1]) + 1))
+    return bisect_left(names, token + "\0")
+
+
+class _Page(object):
+    def __init__(self, blobs, prefixes, token):
+        self._blobs = blobs
+        self.prefixes = prefixes
+        self.next_page_token = token
+
+    def __iter__(self):
+        return iter(self._blobs)
+
+    @property
+    def pages(self):
+        yield self
+
+
+class _Batch(object):
+    """Executes the requests immediately but counts them as one."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage.request("batch")
+        self.storage._local.batch = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self.storage._local.batch = False
+        return False
+
+
+_Request = collections.namedtuple("_Request", ("method", "url"))
+
+
+class _Response(object):
+    def __init__(self, status, headers=None, body=None, url=None):
+        self.status_code = status
+        self.headers = headers or {}
+        self.content = b""
+        self.text = ""
+        self.request = _Request("PUT", url)
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeHTTP(object):
+    """The requests session which serves the resumable uploads."""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def put(self, url, data=b"", headers=None, timeout=None):
+        storage = self.storage
+        storage.request("upload_chunk")
+        if storage.failures:
+            failure = storage.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return _Response(failure)
+        session = storage.sessions[url]
+        span, total = headers["Content-Range"][len("bytes "):].split("/")
+        if span != "*":
+            start = int(span.split("-")[0])
+            if start > len(session["data"]):
+                return _Response(400)
+            session["data"] = session["data"][:start] + bytes(data)
+        if total != "*" and len(session["data"]) == int(total):
+            blob = session["blob"]
+            try:
+                blob._store(session["data"], session["content_type"],
+                            if_generation_match=session[
+                                "if_generation_match"])
+            except PreconditionFailed as e:
+                return _Response(412, body={"error": {"message": str(e)}},
+                                 url=url)
+            return _Response(200, body=blob._properties)
+        headers = {}
+        if session["data"]:
+            headers["Range"] = "bytes=0-%d" % (len(session["data"]) - 1)
+        return _Response(308, headers)
+
+
+class FakeClient(object):
+    """
+    Replaces :class:`google.cloud.storage.Client`. The constructor accepts
+    and ignores the real client's arguments.
+    """
+
+    project = "fake"
+    #: the default storage of all the clients.
+    storage = FakeStorage()
+
+    def __init__(self, project=None, credentials=None, storage=None,
+                 **kwargs):
+        if storage is not None:
+            self.storage = storage
+        self._credentials = credentials
+        self._http = FakeHTTP(self.storage)
+
+    @classmethod
+    def from_service_account_json(cls, json_credentials_path, *args,
+                                  **kwargs):
+        return cls(*args, **kwargs)
+
+    def bucket(self, bucket_name, user_project=None):
+        return FakeBucket(self, bucket_name)
+
+    def get_bucket(self, bucket_or_name, **kwargs):
+        self.storage.request("get_bucket")
+        name = getattr(bucket_or_name, "name", bucket_or_name)
+        with self.storage.lock:
+            self.storage.bucket(name)
+        return FakeBucket(self, name)
+
+    def lookup_bucket(self, bucket_name, **kwargs):
+        try:
+            return self.get_bucket(bucket_name)
+        except NotFound:
+            return None
+
+    def list_buckets(self, **kwargs):
+        self.storage.request("list_buckets")
+        with self.storage.lock:
+            return [FakeBucket(self, name)
+                    for name in sorted(self.storage.buckets)]
+
+    def create_bucket(self, bucket_or_name, **kwargs):
+        bucket = FakeBucket(self, getattr(bucket_or_name, "name",
+                                          bucket_or_name))
+        bucket.create()
+        return bucket
+
+    def batch(self, raise_exception=True):
+        return _Batch(self.storage)
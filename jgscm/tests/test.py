@@ -1,14 +1,60 @@
 import base64
 from datetime import datetime
+import errno
+import gc
+import itertools
+import os
 import pickle
-from unittest import main, TestCase
+import shutil
+import tempfile
+import threading
+import time
+from unittest import main, skipIf, TestCase
 import uuid
 import sys
 
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from google.cloud._helpers import UTC
+from google.cloud.exceptions import BadRequest, Conflict, NotFound, \
+    PreconditionFailed, ServiceUnavailable, TooManyRequests
 import nbformat
+import requests
 from tornado import web
 
 from jgscm import GoogleStorageContentManager
+from jgscm.backend import BackendDecorator, CountingBackend, GCSBackend, \
+    StorageBackend, StorageObject
+from jgscm.cache import DiskCache, LRUCache
+from jgscm.coalesce import WriteCoalescer
+from jgscm.codec import crc32c_base64, decode_utf8, encode_base64, \
+    google_crc32c, iter_base64, md5_base64
+from jgscm.metrics import Metrics, PrometheusCollector, REGISTRY
+from jgscm.retry import is_retriable, RetryPolicy
+from jgscm.tests.fakegcs import FakeClient, FakeStorage
+from jgscm.tracing import LoggingTracer, OpenTelemetryTracer, Tracer
+from jgscm.transport import configure_session, PoolAdapter
+from jgscm.upload import ResumableUpload
+try:
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import \
+        InMemorySpanExporter
+except ImportError:
+    TracerProvider = None
+try:
+    import asyncio
+    from jgscm.aio import AsyncGoogleStorageContentManager
+except (ImportError, SyntaxError):
+    AsyncGoogleStorageContentManager = None
+
+if os.getenv("JGSCM_FAKE_GCS"):
+    # run offline against the in-memory stand-in of GCS
+    import jgscm
+    jgscm.GSClient = FakeClient
 
 if sys.version_info[0] == 2:
     import socket
@@ -86,11 +132,13 @@ class TestGoogleStorageContentManager(TestCase):
 
     def setUp(self):
         super(TestGoogleStorageContentManager, self).setUp()
-        self.contents_manager = GoogleStorageContentManager()
+        # The tests modify the bucket behind the manager's back.
+        self.contents_manager = GoogleStorageContentManager(
+            metadata_cache_size=0)
 
     @property
     def bucket(self):
-        return self.contents_manager._get_bucket(self.BUCKET)
+        return self.contents_manager.client.bucket(self.BUCKET)
 
     def path(self, sub):
         return "/" + self.BUCKET + "/" + sub
@@ -354,6 +402,164 @@ class TestGoogleStorageContentManager(TestCase):
         self.assertEqual(dc["last_modified"], "")
         self.assertEqual(dc["created"], "")
 
+    def test_get_dir_listing_calls(self):
+        bucket = self.bucket
+        blobs = [bucket.blob("test/file%d.txt" % i) for i in range(3)]
+        blobs.extend(bucket.blob("test/dir%d/file.txt" % i) for i in range(3))
+        blobs.append(bucket.blob("test/notebook.ipynb"))
+        for blob in blobs:
+            blob.upload_from_string(b"contents")
+        try:
+            cm = self.contents_manager
+            with mock.patch.object(cm, "_fetch", wraps=cm._fetch) as fetch:
+                model = cm.get(self.path("test/"))
+            self.assertEqual(fetch.call_count, 1)
+        finally:
+            for blob in blobs:
+                blob.delete()
+        types = sorted(m["type"] for m in model["content"])
+        self.assertEqual(types, ["directory"] * 3 + ["file"] * 3 +
+                         ["notebook"])
+        for m in model["content"]:
+            self.assertIsNone(m["content"])
+            self.assertTrue(m["writable"])
+
+    def test_metadata_cache(self):
+        cm = GoogleStorageContentManager(metadata_cache_ttl=3600)
+        bucket = self.bucket
+        blob = bucket.blob("test/other.txt")
+        blob.upload_from_string(b"contents")
+        try:
+            self.assertTrue(cm.file_exists(self.path("test/other.txt")))
+            self.assertTrue(cm.dir_exists(self.path("test")))
+            hits = cm.metadata_cache.hits
+            misses = cm.metadata_cache.misses
+        finally:
+            blob.delete()
+        # served from the cache although the blob is gone
+        self.assertTrue(cm.file_exists(self.path("test/other.txt")))
+        self.assertTrue(cm.dir_exists(self.path("test")))
+        self.assertEqual(cm.metadata_cache.hits, hits + 2)
+        self.assertEqual(cm.metadata_cache.misses, misses)
+        cm.metadata_cache.clear()
+        self.assertFalse(cm.file_exists(self.path("test/other.txt")))
+        self.assertFalse(cm.dir_exists(self.path("test")))
+
+        cm.save({"type": "file", "content": "blah", "format": "text"},
+                self.path("test/other.txt"))
+        try:
+            self.assertTrue(cm.file_exists(self.path("test/other.txt")))
+            self.assertTrue(cm.dir_exists(self.path("test")))
+            model = cm.get(self.path("test/"))
+            self.assertEqual([m["name"] for m in model["content"]],
+                             ["other.txt"])
+            cm.rename_file(self.path("test/other.txt"),
+                           self.path("test/another.txt"))
+            self.assertFalse(cm.file_exists(self.path("test/other.txt")))
+            self.assertTrue(cm.file_exists(self.path("test/another.txt")))
+            model = cm.get(self.path("test/"))
+            self.assertEqual([m["name"] for m in model["content"]],
+                             ["another.txt"])
+            cm.delete_file(self.path("test/another.txt"))
+            self.assertFalse(cm.file_exists(self.path("test/another.txt")))
+            self.assertFalse(cm.dir_exists(self.path("test")))
+        finally:
+            for blob in bucket.list_blobs(prefix="test/"):
+                blob.delete()
+
+    def test_metadata_cache_disabled(self):
+        cm = GoogleStorageContentManager(metadata_cache_size=0)
+        self.assertIsNone(cm.metadata_cache)
+
+    def test_get_resolve_type(self):
+        bucket = self.bucket
+        blobs = [bucket.blob(name) for name in (
+            "test/noext", "test/noext.txt", "test/dir/other")]
+        for blob in blobs:
+            blob.upload_from_string(b"contents")
+        cm = self.contents_manager
+        try:
+            with mock.patch.object(cm, "_fetch") as fetch, \
+                    mock.patch.object(cm, "_iter_pages",
+                                      wraps=cm._iter_pages) as iter_pages:
+                model = cm.get(self.path("test/noext"), content=False)
+                self.assertEqual(model["type"], "file")
+                self.assertEqual(model["name"], "noext")
+                self.assertEqual(iter_pages.call_count, 1)
+                model = cm.get(self.path("test/dir"), content=False)
+                self.assertEqual(model["type"], "directory")
+                self.assertEqual(iter_pages.call_count, 2)
+                self.assertEqual(fetch.call_count, 0)
+            model = cm.get(self.path("test/noext"))
+            self.assertEqual(model["content"], "contents")
+            with self.assertRaises(web.HTTPError):
+                cm.get(self.path("test/nothing"))
+        finally:
+            for blob in blobs:
+                blob.delete()
+
+    def test_content_cache(self):
+        cm = self.contents_manager
+        bucket = self.bucket
+        blob = bucket.blob("test/other.txt")
+        blob.upload_from_string(b"contents")
+        try:
+            path = self.path("test/other.txt")
+            self.assertEqual(cm.get(path)["content"], "contents")
+            self.assertEqual(cm.content_cache.misses, 1)
+            self.assertEqual(cm.get(path)["content"], "contents")
+            self.assertEqual(cm.content_cache.hits, 1)
+            blob.upload_from_string(b"changed")
+            self.assertEqual(cm.get(path)["content"], "changed")
+            self.assertEqual(cm.content_cache.misses, 2)
+            cm.save({"type": "file", "content": "saved", "format": "text"},
+                    path)
+            self.assertEqual(cm.get(path)["content"], "saved")
+            self.assertEqual(cm.content_cache.hits, 2)
+        finally:
+            blob.delete()
+        cm = GoogleStorageContentManager(content_cache_size=0)
+        self.assertIsNone(cm.content_cache)
+
+    def test_content_cache_generation(self):
+        cm = self.contents_manager
+        blob = self.bucket.blob("test/other.txt")
+        blob.upload_from_string(b"contents")
+        try:
+            stale = cm.backend.stat(self.BUCKET, "test/other.txt")
+            blob.upload_from_string(b"changed")
+            # the newer contents must not be cached under the old generation
+            with self.assertRaises(NotFound):
+                cm._download(stale)
+            with self.assertRaises(KeyError):
+                cm.content_cache.get(
+                    (stale.bucket, stale.name, stale.generation))
+        finally:
+            blob.delete()
+
+    def test_disk_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        blob = self.bucket.blob("test/other.txt")
+        blob.upload_from_string(b"contents")
+        try:
+            cm = GoogleStorageContentManager(
+                metadata_cache_size=0, content_cache_size=0,
+                disk_cache_dir=tmpdir)
+            path = self.path("test/other.txt")
+            self.assertEqual(cm.get(path)["content"], "contents")
+            self.assertEqual(cm.disk_cache.misses, 1)
+            # a new process reuses the files
+            cm = GoogleStorageContentManager(
+                metadata_cache_size=0, content_cache_size=0,
+                disk_cache_dir=tmpdir)
+            self.assertEqual(cm.get(path)["content"], "contents")
+            self.assertEqual(cm.disk_cache.hits, 1)
+            self.assertEqual(len(os.listdir(tmpdir)), 1)
+        finally:
+            blob.delete()
+            shutil.rmtree(tmpdir)
+        self.assertIsNone(self.contents_manager.disk_cache)
+
     def test_get_base64(self):
         bucket = self.bucket
         blob = bucket.blob("test.pickle")
@@ -422,6 +628,48 @@ class TestGoogleStorageContentManager(TestCase):
                 blob2.delete()
             raise
 
+    def test_delete_file_batches(self):
+        cm = self.contents_manager
+        cm.delete_batch_size = 4
+        cm.bulk_workers = 3
+        bucket = self.bucket
+        names = ["test/file%d.txt" % i for i in range(10)] + \
+            ["test/dir%d/sub/file.txt" % i for i in range(10)]
+        for name in names:
+            bucket.blob(name).upload_from_string(b"contents")
+        try:
+            with mock.patch.object(cm, "_delete_batch",
+                                   wraps=cm._delete_batch) as delete_batch:
+                cm.delete_file(self.path("test"))
+            self.assertEqual(delete_batch.call_count, 5)
+            self.assertEqual(list(bucket.list_blobs(prefix="test/")), [])
+        finally:
+            for blob in bucket.list_blobs(prefix="test/"):
+                blob.delete()
+
+    def test_delete_file_partial_failure(self):
+        cm = self.contents_manager
+        bucket = self.bucket
+        names = ["test/file%d.txt" % i for i in range(3)]
+        for name in names:
+            bucket.blob(name).upload_from_string(b"contents")
+        delete_batch = cm._delete_batch
+
+        def fail_first(bucket, names):
+            delete_batch(bucket, names[1:])
+            return names[:1]
+
+        try:
+            with mock.patch.object(cm, "_delete_batch", fail_first):
+                with self.assertRaises(web.HTTPError) as ctx:
+                    cm.delete_file(self.path("test/"))
+            self.assertEqual(ctx.exception.status_code, 500)
+            self.assertEqual([b.name for b in bucket.list_blobs(
+                prefix="test/")], names[:1])
+        finally:
+            for blob in bucket.list_blobs(prefix="test/"):
+                blob.delete()
+
     def test_rename_file(self):
         bucket = self.bucket
         blob = bucket.blob("test/other.txt")
@@ -487,6 +735,275 @@ class TestGoogleStorageContentManager(TestCase):
         finally:
             new_bucket.delete(force=True)
 
+    def test_paginated_listing(self):
+        self.contents_manager.list_page_size = 2
+        bucket = self.bucket
+        names = ["test/file%d.txt" % i for i in range(5)] + \
+            ["test/dir%d/file%d.txt" % (i, j) for i in range(3)
+             for j in range(3)]
+        for name in names:
+            bucket.blob(name).upload_from_string(b"contents")
+        try:
+            model = self.contents_manager.get(self.path("test/"))
+            self.assertEqual(len(model["content"]), 8)
+            self.contents_manager.rename_file(self.path("test"),
+                                              self.path("test1"))
+            self.assertEqual(
+                sorted(b.name for b in bucket.list_blobs(prefix="test1/")),
+                sorted(n.replace("test/", "test1/", 1) for n in names))
+            self.assertEqual(list(bucket.list_blobs(prefix="test/")), [])
+            self.contents_manager.delete_file(self.path("test1"))
+            self.assertEqual(list(bucket.list_blobs(prefix="test1/")), [])
+        finally:
+            for blob in bucket.list_blobs(prefix="test"):
+                blob.delete()
+
+    def test_delete_file_siblings(self):
+        bucket = self.bucket
+        blobs = [bucket.blob(name) for name in (
+            "test/other", "test/other.txt", "test/other/file.txt")]
+        for blob in blobs:
+            blob.upload_from_string(b"contents")
+        try:
+            self.contents_manager.delete_file(self.path("test/other"))
+            self.assertEqual(
+                sorted(b.name for b in bucket.list_blobs(prefix="test/")),
+                ["test/other.txt", "test/other/file.txt"])
+            self.contents_manager.delete_file(self.path("test/other"))
+            self.assertEqual(
+                [b.name for b in bucket.list_blobs(prefix="test/")],
+                ["test/other.txt"])
+        finally:
+            for blob in bucket.list_blobs(prefix="test/"):
+                blob.delete()
+
+    def test_rename_file_parallel(self):
+        cm = self.contents_manager
+        cm.bulk_workers = 3
+        bucket = self.bucket
+        names = ["test/file%d.txt" % i for i in range(10)] + \
+            ["test/dir%d/sub/file.txt" % i for i in range(10)]
+        for name in names:
+            bucket.blob(name).upload_from_string(b"contents")
+        try:
+            cm.rename_file(self.path("test"), self.path("test1"))
+            self.assertEqual(list(bucket.list_blobs(prefix="test/")), [])
+            self.assertEqual(
+                sorted(b.name for b in bucket.list_blobs(prefix="test1/")),
+                sorted(n.replace("test/", "test1/", 1) for n in names))
+            progress = cm.bulk_progress[-1]
+            self.assertTrue(progress["finished"])
+            self.assertEqual(progress["objects"], len(names))
+            self.assertEqual(progress["bytes"], len(names) * len(b"contents"))
+            self.assertEqual(progress["failures"], 0)
+            with self.assertRaises(web.HTTPError):
+                cm.rename_file(self.path("test1"), self.path("test1/sub"))
+        finally:
+            for blob in bucket.list_blobs(prefix="test"):
+                blob.delete()
+
+    def test_copy_blob_rewrite_tokens(self):
+        parent = mock.Mock(retry_policy=RetryPolicy(), http_timeout=30)
+        source, new_blob = mock.Mock(), mock.Mock()
+        parent.client.bucket.return_value.blob.side_effect = [source,
+                                                              new_blob]
+        new_blob.bucket.name = "destination"
+        new_blob.name = "name"
+        new_blob.rewrite.side_effect = [("t1", 1, 3), ("t2", 2, 3),
+                                        (None, 3, 3)]
+        result = GCSBackend(parent).copy("source", "source", "destination",
+                                         "name")
+        self.assertEqual((result.bucket, result.name), ("destination", "name"))
+        self.assertEqual(parent.client.bucket.call_args_list, [
+            mock.call("source"), mock.call("destination")])
+        options = {"client": parent.client, "retry": None, "timeout": 30}
+        self.assertEqual(new_blob.rewrite.call_args_list, [
+            mock.call(source, **options),
+            mock.call(source, token="t1", **options),
+            mock.call(source, token="t2", **options)])
+
+    def test_download_ranges(self):
+        cm = GoogleStorageContentManager(
+            content_cache_size=0, parallel_download_threshold=100,
+            download_chunk_size=30, download_workers=3)
+        cm._backend = backend = mock.Mock()
+        data = os.urandom(100)
+        blob = StorageObject("bucket", "blob", size=len(data))
+        backend.read_range.side_effect = \
+            lambda bucket, name, start, end, generation: data[start:end + 1]
+        self.assertEqual(cm._download(blob), data)
+        self.assertEqual(
+            sorted(c[0][2] for c in backend.read_range.call_args_list),
+            [0, 30, 60, 90])
+        backend.read_range.side_effect = \
+            lambda bucket, name, start, end, generation: data[start:end]
+        with self.assertRaises(IOError):
+            cm._download(blob)
+        blob = StorageObject("bucket", "blob", size=99)
+        backend.read.return_value = data[:99]
+        self.assertEqual(cm._download(blob), data[:99])
+        backend.read.assert_called_once_with("bucket", "blob",
+                                             generation=None)
+
+    def test_download_ranges_changed(self):
+        cm = GoogleStorageContentManager(
+            content_cache_size=0, parallel_download_threshold=100,
+            download_chunk_size=30, download_workers=1)
+        blob = self.bucket.blob("test/ranges.bin")
+        blob.upload_from_string(b"a" * 100)
+        try:
+            stale = cm.backend.stat(self.BUCKET, "test/ranges.bin")
+            read_range = cm.backend.read_range
+
+            def overwrite(*args, **kwargs):
+                data = read_range(*args, **kwargs)
+                # the same size passes the length check
+                self.bucket.blob("test/ranges.bin").upload_from_string(
+                    b"b" * 100)
+                return data
+
+            with mock.patch.object(cm.backend, "read_range",
+                                   side_effect=overwrite):
+                with self.assertRaises(NotFound):
+                    cm._download(stale)
+        finally:
+            self.bucket.blob("test/ranges.bin").delete()
+
+    def test_checkpoint_server_side(self):
+        cm = self.contents_manager
+        path = self.path("test/cp.ipynb")
+        nb = nbformat.reads(self.NOTEBOOK, 4)
+        cm.save({"type": "notebook", "content": nb}, path)
+        try:
+            with mock.patch.object(cm, "_download") as download, \
+                    mock.patch.object(cm, "_upload") as upload:
+                cp = cm.create_checkpoint(path)
+                nb.cells[0].source = "changed"
+                cm._save_notebook(path[1:], nb)
+                cm.restore_checkpoint(cp["id"], path)
+            self.assertFalse(download.called)
+            self.assertEqual(upload.call_count, 1)
+            self.assertEqual(cm.get(path)["content"].cells[0].source,
+                             nbformat.reads(self.NOTEBOOK, 4).cells[0].source)
+            with self.assertRaises(web.HTTPError) as e:
+                cm.restore_checkpoint("missing", path)
+            self.assertEqual(e.exception.status_code, 404)
+        finally:
+            cm.delete_file(path)
+            cm.delete_file(self.path("test/.ipynb_checkpoints/"))
+
+    def test_checkpoint_manifest(self):
+        cm = GoogleStorageContentManager()
+        bucket = self.bucket
+        path = self.path("test/m.ipynb")
+        nb = nbformat.reads(self.NOTEBOOK, 4)
+        cm.save({"type": "notebook", "content": nb}, path)
+        other = bucket.blob(
+            "test/.ipynb_checkpoints/mm-%s.ipynb" % uuid.uuid4())
+        other.upload_from_string(b"{}")
+        try:
+            cp1 = cm.list_checkpoints(path)[0]
+            manifest = bucket.blob(
+                "test/.ipynb_checkpoints/m.ipynb.manifest.json")
+            self.assertTrue(manifest.exists())
+            cp2 = cm.create_checkpoint(path)
+            with mock.patch.object(cm, "_iter_pages") as iter_pages:
+                self.assertEqual([c["id"] for c in cm.list_checkpoints(path)],
+                                 [cp2["id"], cp1["id"]])
+            self.assertFalse(iter_pages.called)
+            cm.delete_checkpoint(cp1["id"], path)
+            # migration from the checkpoints without a manifest
+            manifest.delete()
+            cm = GoogleStorageContentManager()
+            self.assertEqual([c["id"] for c in cm.list_checkpoints(path)],
+                             [cp2["id"]])
+            self.assertTrue(manifest.exists())
+            new_path = self.path("test/n.ipynb")
+            cm.rename(path, new_path)
+            self.assertFalse(manifest.exists())
+            self.assertEqual(cm.list_checkpoints(path), [])
+            self.assertEqual([c["id"] for c in cm.list_checkpoints(new_path)],
+                             [cp2["id"]])
+            cm.delete(new_path)
+            self.assertEqual(cm.list_checkpoints(new_path), [])
+            self.assertEqual(
+                [b.name for b in bucket.list_blobs(prefix="test/")],
+                [other.name])
+        finally:
+            cm.delete_file(self.path("test/"))
+
+    def test_checkpoint_retention(self):
+        cm = self.contents_manager
+        path = self.path("test/r.txt")
+        cm.save({"type": "file", "content": "data", "format": "text"}, path)
+        try:
+            cm.checkpoints.keep_checkpoints = 2
+            ids = [cm.create_checkpoint(path)["id"] for _ in range(4)]
+            self.assertEqual(
+                sorted(c["id"] for c in cm.list_checkpoints(path)),
+                sorted(ids[-2:]))
+            self.assertEqual(len(list(self.bucket.list_blobs(
+                prefix="test/.ipynb_checkpoints/r-"))), 2)
+            cm.checkpoints.keep_checkpoints = 0
+            cm.checkpoints.keep_checkpoints_days = 1e-9
+            last = cm.create_checkpoint(path)["id"]
+            self.assertEqual([c["id"] for c in cm.list_checkpoints(path)],
+                             [last])
+        finally:
+            cm.checkpoints.keep_checkpoints = 0
+            cm.checkpoints.keep_checkpoints_days = 0
+            cm.delete_file(self.path("test/"))
+
+    def test_checkpoint_concurrent(self):
+        cm = self.contents_manager
+        path = self.path("test/c.txt")
+        cm.save({"type": "file", "content": "data", "format": "text"}, path)
+        # the manifest exists, so the checkpoints are not listed
+        ids = [cm.create_checkpoint(path)["id"]]
+        barrier = threading.Barrier(8)
+
+        def create():
+            barrier.wait()
+            ids.append(cm.create_checkpoint(path)["id"])
+
+        threads = [threading.Thread(target=create) for _ in range(8)]
+        # the fake GCS must be slow enough for the updates to overlap
+        storage = getattr(cm.client, "storage", None)
+        if storage is not None:
+            storage.latency = 0.005
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(ids), 9)
+            listed = cm.checkpoints._read_manifest(path, fresh=True)
+            self.assertEqual(sorted(c["id"] for c in listed), sorted(ids))
+            self.assertEqual(len(list(self.bucket.list_blobs(
+                prefix="test/.ipynb_checkpoints/c-"))), 9)
+        finally:
+            if storage is not None:
+                storage.latency = 0
+            cm.delete_file(self.path("test/"))
+
+    def test_checkpoint_contended(self):
+        cm = self.contents_manager
+        path = self.path("test/c.txt")
+        cm.save({"type": "file", "content": "data", "format": "text"}, path)
+        policy = cm.retry_policy
+        try:
+            with mock.patch.object(
+                    cm.checkpoints, "_write_manifest",
+                    side_effect=PreconditionFailed("manifest")) as write, \
+                    mock.patch.object(policy, "_sleep") as sleep, \
+                    self.assertRaises(web.HTTPError) as ctx:
+                cm.create_checkpoint(path)
+            self.assertEqual(ctx.exception.status_code, 409)
+            self.assertEqual(write.call_count, policy.attempts + 1)
+            self.assertEqual(sleep.call_count, policy.attempts)
+        finally:
+            cm.delete_file(self.path("test/"))
+
     def test_save_dir(self):
         self.contents_manager.save({
             "type": "directory"
@@ -506,7 +1023,7 @@ class TestGoogleStorageContentManager(TestCase):
         blob = bucket.blob("test.txt")
         self.assertTrue(blob.exists())
         try:
-            self.assertEqual(blob.download_as_string(), b"blah-blah-blah")
+            self.assertEqual(blob.download_as_bytes(), b"blah-blah-blah")
         finally:
             blob.delete()
 
@@ -520,10 +1037,355 @@ class TestGoogleStorageContentManager(TestCase):
         blob = bucket.blob("test.pickle")
         self.assertTrue(blob.exists())
         try:
-            self.assertEqual(blob.download_as_string(), pickle.dumps(obj))
+            self.assertEqual(blob.download_as_bytes(), pickle.dumps(obj))
+        finally:
+            blob.delete()
+
+    def test_save_file_resumable(self):
+        cm = GoogleStorageContentManager(
+            metadata_cache_size=0, resumable_upload_threshold=1 << 18,
+            upload_chunk_size=1 << 18)
+        data = os.urandom(700 << 10)
+        path = self.path("test.bin")
+        cm.save({
+            "type": "file",
+            "content": base64.encodebytes(data).decode("ascii"),
+            "format": "base64"
+        }, path)
+        blob = self.bucket.blob("test.bin")
+        try:
+            self.assertEqual(blob.download_as_bytes(), data)
+            model = cm.get(path, format="base64")
+            self.assertEqual(base64.decodebytes(model["content"].encode()),
+                             data)
+            with self.assertRaises(web.HTTPError):
+                cm.save({"type": "file", "content": "a" * (400 << 10) + "!",
+                         "format": "base64"}, path)
+            self.assertEqual(blob.download_as_bytes(), data)
         finally:
             blob.delete()
 
+    def test_save_file_chunked(self):
+        cm = self.contents_manager
+        path = self.path("test/chunked.bin")
+        chunks = [os.urandom(1000) for _ in range(3)]
+        for i, chunk in zip((1, 2, -1), chunks):
+            model = cm.save({
+                "type": "file",
+                "content": base64.encodebytes(chunk).decode("ascii"),
+                "format": "base64",
+                "chunk": i
+            }, path)
+            self.assertEqual(model["path"], path[1:])
+            self.assertEqual(model["name"], "chunked.bin")
+        blob = self.bucket.blob("test/chunked.bin")
+        try:
+            self.assertEqual(blob.download_as_bytes(), b"".join(chunks))
+            self.assertEqual([b.name for b in self.bucket.list_blobs(
+                prefix="test/")], ["test/chunked.bin"])
+        finally:
+            blob.delete()
+        with self.assertRaises(web.HTTPError) as e:
+            cm.save({"type": "file", "content": "data", "format": "text",
+                     "chunk": -1}, path)
+        self.assertEqual(e.exception.status_code, 400)
+        self.assertFalse(blob.exists())
+        with self.assertRaises(web.HTTPError):
+            cm.save({"type": "notebook", "content": {}, "chunk": 1}, path)
+
+    def test_save_file_chunked_concurrently(self):
+        cm = self.contents_manager
+        path = self.path("test/chunked.txt")
+        pending = "test/.chunked.txt.upload"
+
+        def save(content, chunk):
+            return cm.save({"type": "file", "content": content,
+                            "format": "text", "chunk": chunk}, path)
+
+        blob = self.bucket.blob("test/chunked.txt")
+        try:
+            save("a1", 1)
+            # the same file is uploaded again while the first upload runs
+            with self.assertRaises(web.HTTPError) as e:
+                save("b1", 1)
+            self.assertEqual(e.exception.status_code, 409)
+            save("a2", 2)
+            with self.assertRaises(web.HTTPError) as e:
+                save("a4", 4)
+            self.assertEqual(e.exception.status_code, 409)
+            # another chunk was appended after the pending blob was read
+            before = cm.backend.stat(self.BUCKET, pending)
+            save("a3", 3)
+            for chunk in (3, -1):
+                with mock.patch.object(cm.backend, "stat",
+                                       return_value=before):
+                    with self.assertRaises(web.HTTPError) as e:
+                        save("x", chunk)
+                self.assertEqual(e.exception.status_code, 409)
+            self.assertFalse(blob.exists())
+            save("a4", -1)
+            self.assertEqual(blob.download_as_bytes(), b"a1a2a3a4")
+            self.assertEqual([b.name for b in self.bucket.list_blobs(
+                prefix="test/")], ["test/chunked.txt"])
+            # an idle upload is taken over
+            save("b1", 1)
+            cm.chunked_upload_idle = 0
+            save("c1", 1)
+            save("c2", -1)
+            self.assertEqual(blob.download_as_bytes(), b"c1c2")
+        finally:
+            cm.chunked_upload_idle = 300
+            blob.delete()
+
+    def test_save_file_chunked_prunes_abandoned(self):
+        cm = self.contents_manager
+        token = "0" * 32
+        abandoned = ["test/.a.txt.upload", "test/.a.txt.upload-%s" % token,
+                     "test/.b.txt.upload-%s" % token]
+        for name in abandoned + ["test/.b.txt.upload", "test/.keep"]:
+            self.bucket.blob(name).upload_from_string(b"x")
+        path = self.path("test/b.txt")
+        cm.chunked_upload_ttl = 0
+        cm.chunked_upload_idle = 0
+        try:
+            model = cm.save({"type": "file", "content": "1",
+                             "format": "text", "chunk": 1}, path)
+            self.assertEqual(model["name"], "b.txt")
+            names = [b.name for b in self.bucket.list_blobs(prefix="test/")]
+            self.assertEqual(names, ["test/.b.txt.upload", "test/.keep"])
+            pending = self.bucket.get_blob("test/.b.txt.upload")
+            self.assertEqual(pending.metadata, {"chunk": "1"})
+            self.assertEqual(pending.download_as_bytes(), b"1")
+        finally:
+            cm.chunked_upload_ttl = 86400
+            cm.chunked_upload_idle = 300
+            for name in ("test/.b.txt.upload", "test/.keep"):
+                self.bucket.blob(name).delete()
+
+    def test_save_no_reads(self):
+        cm = GoogleStorageContentManager()
+        path = self.path("test/s.ipynb")
+        nb = nbformat.reads(self.NOTEBOOK, 4)
+        cm.save({"type": "notebook", "content": nb}, path)
+        try:
+            with mock.patch.object(cm, "get") as get, \
+                    mock.patch.object(cm, "_fetch") as fetch, \
+                    mock.patch.object(cm.checkpoints,
+                                      "_list_checkpoint_blobs") as listing:
+                nb.cells[0].source = "changed"
+                model = cm.save({"type": "notebook", "content": nb}, path)
+            self.assertFalse(get.called)
+            self.assertFalse(fetch.called)
+            self.assertFalse(listing.called)
+            self.assertEqual(model, cm.get(path, content=False))
+            model = cm.save({"type": "file", "content": "text",
+                             "format": "text"}, self.path("test/s.txt"))
+            self.assertEqual(model,
+                             cm.get(self.path("test/s.txt"), content=False))
+        finally:
+            cm.delete_file(self.path("test/"))
+
+    def test_save_unchanged(self):
+        cm = self.contents_manager
+        path = self.path("test/u.txt")
+        model = {"type": "file", "content": "data", "format": "text"}
+        cm.save(model, path)
+        blob = self.bucket.blob("test/u.txt")
+        try:
+            with mock.patch.object(cm, "_upload", wraps=cm._upload) as upload:
+                saved = cm.save(model, path)
+                self.assertFalse(upload.called)
+                self.assertEqual(saved, cm.get(path, content=False))
+                blob.upload_from_string(b"other", "text/plain")
+                cm.save(model, path)
+                self.assertEqual(upload.call_count, 1)
+                self.assertEqual(
+                    self.bucket.blob("test/u.txt").download_as_bytes(),
+                    b"data")
+                cm.save(dict(model, content="new"), path)
+                self.assertEqual(upload.call_count, 2)
+                cm.skip_unchanged_uploads = False
+                cm.save(dict(model, content="new"), path)
+                self.assertEqual(upload.call_count, 3)
+        finally:
+            cm.skip_unchanged_uploads = True
+            blob.delete()
+
+    def test_save_coalesce(self):
+        cm = self.contents_manager
+        cm.coalesce_saves = True
+        path = self.path("test/c.txt")
+        try:
+            with mock.patch.object(cm._coalescer, "run",
+                                   wraps=cm._coalescer.run) as run:
+                model = cm.save({"type": "file", "content": "data",
+                                 "format": "text"}, path)
+            run.assert_called_once_with(path[1:], mock.ANY)
+            self.assertEqual(model["name"], "c.txt")
+            self.assertEqual(self.bucket.blob("test/c.txt")
+                             .download_as_bytes(), b"data")
+        finally:
+            cm.coalesce_saves = False
+            cm.delete_file(path)
+
+    def test_per_thread_clients(self):
+        cm = self.contents_manager
+        clients = []
+        thread = threading.Thread(target=lambda: clients.append(cm.client))
+        thread.start()
+        thread.join()
+        self.assertIsNot(clients[0], cm.client)
+        self.assertIs(cm.client, cm.client)
+        cm.per_thread_clients = False
+        try:
+            thread = threading.Thread(
+                target=lambda: clients.append(cm.client))
+            thread.start()
+            thread.join()
+            self.assertIs(clients[1], cm.client)
+        finally:
+            cm.per_thread_clients = True
+
+    def test_worker_clients(self):
+        cm = self.contents_manager
+        calls = []
+
+        def get_blob(bucket, name, client=None, **kwargs):
+            calls.append((threading.current_thread(), client, cm.client))
+
+        with mock.patch.object(type(self.bucket), "get_blob", autospec=True,
+                               side_effect=get_blob):
+            for _ in range(3):
+                cm._run_parallel(
+                    lambda name: cm.backend.stat(self.BUCKET, name),
+                    ["a", "b", "c", "d"])
+        self.assertEqual(len(calls), 12)
+        # the pool lives as long as the manager
+        threads = set(thread for thread, _, _ in calls)
+        self.assertLessEqual(len(threads), cm.bulk_workers)
+        for _, client, own in calls:
+            self.assertIs(client, own)
+        self.assertEqual(len(set(id(c) for _, c, _ in calls)), len(threads))
+        self.assertIs(cm._executor("bulk"), cm._executor("bulk"))
+
+    def test_worker_pool_resize(self):
+        cm = GoogleStorageContentManager(bulk_workers=2)
+        started, release = threading.Event(), threading.Event()
+        done, errors = [], []
+
+        def work(item):
+            started.set()
+            release.wait(10)
+            done.append(item)
+
+        def run():
+            try:
+                # submits the rest of the items after the resize
+                cm._run_parallel(work, range(8))
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            started.wait(10)
+            cm.bulk_workers = 4
+            executor, workers = cm._executor("bulk")
+            self.assertEqual(workers, 2)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(done), list(range(8)))
+        cm._run_parallel(done.append, ["x"])
+        self.assertEqual(done[-1], "x")
+        self.assertIs(cm._executor("bulk")[0], executor)
+
+    def test_retry(self):
+        cm = self.contents_manager
+        failures = [BrokenPipeError(errno.EPIPE, "Broken pipe"), None]
+        with mock.patch.object(cm.retry_policy, "_sleep") as sleep, \
+                mock.patch.object(type(self.bucket), "get_blob",
+                                  side_effect=failures) as get_blob:
+            self.assertFalse(cm.file_exists(self.path("test/missing.txt")))
+        self.assertEqual(get_blob.call_count, 2)
+        self.assertEqual(sleep.call_count, 1)
+        # the library does not retry on its own
+        self.assertIsNone(get_blob.call_args[1]["retry"])
+        self.assertEqual(get_blob.call_args[1]["timeout"], cm.http_timeout)
+
+    def test_metrics(self):
+        cm = self.contents_manager
+        metrics = Metrics(bucket_label=True)
+        path = self.path("test/m.txt")
+        with mock.patch.object(cm.retry_policy, "observer", metrics), \
+                mock.patch.object(cm, "_metrics", metrics):
+            try:
+                cm.save({"type": "file", "content": "data",
+                         "format": "text"}, path)
+                cm.get(path)
+            finally:
+                cm.delete_file(path)
+        requests = {(r["call"], r["operation"], r["bucket"]): r["count"]
+                    for r in metrics.as_dict()["requests"]}
+        self.assertEqual(requests[("upload", "save", self.BUCKET)], 1)
+        # the contents are served from the cache
+        self.assertIn("get", {op for _, op, _ in requests})
+        self.assertNotIn(("download", "get", self.BUCKET), requests)
+        self.assertEqual(requests[("delete", "delete_file", self.BUCKET)],
+                         1)
+        nbytes = {(b["direction"], b["operation"]): b["bytes"]
+                  for b in metrics.as_dict()["bytes"]}
+        self.assertEqual(nbytes, {("upload", "save"): 4})
+
+    def test_tracer(self):
+        cm = self.contents_manager
+        tracer = RecordingTracer()
+        cm.tracer = tracer
+        path = self.path("test/t.txt")
+        try:
+            cm.save({"type": "file", "content": "data", "format": "text"},
+                    path)
+        finally:
+            cm.tracer = None
+            cm.delete_file(path)
+        self.assertEqual(tracer.events[0],
+                         ("start", "save", "contents", {"path": path}))
+        self.assertEqual(tracer.events[-1], ("end", "save", None))
+        self.assertIn(("start", "upload_from_string", "gcs", {}),
+                      tracer.events)
+        self.assertIn(("end", "upload_from_string", None), tracer.events)
+        self.assertIsNone(cm.retry_policy.tracer)
+        cm.tracer = "jgscm.tracing.LoggingTracer"
+        try:
+            self.assertIsInstance(cm.tracer, LoggingTracer)
+            self.assertIs(cm.tracer.log, cm.log)
+            self.assertIs(cm.retry_policy.tracer, cm.tracer)
+        finally:
+            cm.tracer = None
+
+    def test_backend_decorators(self):
+        cm = GoogleStorageContentManager(
+            metadata_cache_size=0,
+            backend_decorators=[BackendDecorator,
+                                "jgscm.backend.CountingBackend"])
+        self.assertIsInstance(cm.backend, CountingBackend)
+        self.assertIsInstance(cm.backend.backend, BackendDecorator)
+        self.assertIsInstance(cm.backend.backend.backend, GCSBackend)
+        path = self.path("test/b.txt")
+        try:
+            cm.save({"type": "file", "content": "data", "format": "text"},
+                    path)
+            self.assertEqual(cm.get(path, content=False)["type"], "file")
+            cm.rename_file(path, self.path("test/c.txt"))
+        finally:
+            cm.delete_file(self.path("test/c.txt"))
+        self.assertEqual(cm.backend.calls["write"], 1)
+        self.assertEqual(cm.backend.calls["copy"], 1)
+        self.assertEqual(cm.backend.calls["delete"], 2)
+        self.assertEqual(cm.backend.calls["bucket_exists"], 1)
+        self.assertGreater(cm.backend.calls["list"], 0)
+
     def test_save_notebook(self):
         nb = nbformat.reads(self.NOTEBOOK, 4)
         self.contents_manager.save({
@@ -534,10 +1396,699 @@ class TestGoogleStorageContentManager(TestCase):
         blob = bucket.blob("test.ipynb")
         self.assertTrue(blob.exists())
         try:
-            self.assertEqual(blob.download_as_string(), self.NOTEBOOK.encode())
+            self.assertEqual(blob.download_as_bytes(), self.NOTEBOOK.encode())
         finally:
             blob.delete()
 
 
+@skipIf(AsyncGoogleStorageContentManager is None,
+        "jupyter_server is not installed")
+class TestAsyncGoogleStorageContentManager(TestCase):
+    BUCKET = "%s-%s" % ("jgcsm-async", uuid.uuid4())
+
+    @classmethod
+    def setUpClass(cls):
+        GoogleStorageContentManager().client.bucket(cls.BUCKET).create()
+
+    @classmethod
+    def tearDownClass(cls):
+        GoogleStorageContentManager().client.bucket(cls.BUCKET).delete(
+            force=True)
+
+    def setUp(self):
+        super(TestAsyncGoogleStorageContentManager, self).setUp()
+        self.contents_manager = AsyncGoogleStorageContentManager()
+
+    def tearDown(self):
+        self.contents_manager.executor.shutdown()
+        super(TestAsyncGoogleStorageContentManager, self).tearDown()
+
+    def path(self, sub):
+        return "/" + self.BUCKET + "/" + sub
+
+    def test_notebook(self):
+        cm = self.contents_manager
+        path = self.path("test.ipynb")
+        nb = nbformat.reads(TestGoogleStorageContentManager.NOTEBOOK, 4)
+        model = asyncio.run(cm.save({"type": "notebook", "content": nb},
+                                    path))
+        self.assertEqual(model["type"], "notebook")
+        self.assertTrue(asyncio.run(cm.file_exists(path)))
+        model = asyncio.run(cm.get(path))
+        self.assertIsInstance(model["content"],
+                              nbformat.notebooknode.NotebookNode)
+        model = asyncio.run(cm.get(self.path("")))
+        self.assertEqual([m["name"] for m in model["content"]],
+                         ["test.ipynb", ".ipynb_checkpoints"])
+        checkpoints = asyncio.run(cm.list_checkpoints(path))
+        self.assertEqual(len(checkpoints), 1)
+        asyncio.run(cm.restore_checkpoint(checkpoints[0]["id"], path))
+        asyncio.run(cm.rename(path, self.path("test2.ipynb")))
+        self.assertFalse(asyncio.run(cm.file_exists(path)))
+        path = self.path("test2.ipynb")
+        self.assertEqual(len(asyncio.run(cm.list_checkpoints(path))), 1)
+        asyncio.run(cm.delete(path))
+        self.assertFalse(asyncio.run(cm.file_exists(path)))
+        self.assertEqual(asyncio.run(cm.list_checkpoints(path)), [])
+
+    def test_executor(self):
+        cm = self.contents_manager
+        threads = []
+        dir_exists = cm.sync_manager.dir_exists
+
+        def traced_dir_exists(path):
+            threads.append(threading.current_thread().name)
+            return dir_exists(path)
+
+        with mock.patch.object(cm.sync_manager, "dir_exists",
+                               traced_dir_exists):
+            self.assertTrue(asyncio.run(cm.dir_exists(self.BUCKET)))
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith("jgscm"))
+        self.assertNotEqual(threads[0], threading.current_thread().name)
+
+
+class TestLRUCache(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        with self.assertRaises(KeyError):
+            cache.get("b")
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+
+    def test_ttl(self):
+        now = [0]
+        cache = LRUCache(10, ttl=5, clock=lambda: now[0])
+        cache.put("a", 1)
+        now[0] = 4
+        self.assertEqual(cache.get("a"), 1)
+        now[0] = 5
+        with self.assertRaises(KeyError):
+            cache.get("a")
+        self.assertEqual(len(cache), 0)
+
+    def test_weigh(self):
+        cache = LRUCache(10, weigh=len)
+        cache.put("a", b"12345")
+        cache.put("b", b"1234")
+        self.assertEqual(cache.weight, 9)
+        cache.put("c", b"12")
+        with self.assertRaises(KeyError):
+            cache.get("a")
+        self.assertEqual(cache.weight, 6)
+        cache.put("d", b"12345678901")
+        with self.assertRaises(KeyError):
+            cache.get("d")
+        self.assertEqual(cache.get("b"), b"1234")
+        cache.pop("b")
+        self.assertEqual(cache.weight, 2)
+
+    def test_invalidate(self):
+        cache = LRUCache(10)
+        for key in ("a/", "a/b", "ab", "b"):
+            cache.put(key, key)
+        self.assertEqual(cache.invalidate(lambda k: k.startswith("a")), 3)
+        self.assertEqual(cache.get("b"), "b")
+
+
+class FakeUploadSession(object):
+    """Emulates a GCS resumable upload session which fails on demand."""
+
+    def __init__(self, failures):
+        self.data = b""
+        self.failures = failures
+        self.requests = []
+
+    def put(self, url, data, headers, timeout=None):
+        crange = headers["Content-Range"]
+        self.requests.append(crange)
+        span, total = crange[len("bytes "):].split("/")
+        failure = self.failures.pop(0) if self.failures else None
+        if span != "*":
+            start, end = map(int, span.split("-"))
+            if failure == "half":
+                # GCS persists 256 KiB blocks
+                data = data[:(len(data) // 2) & ~((256 << 10) - 1)]
+            self.data = self.data[:start] + data
+        if isinstance(failure, Exception):
+            raise failure
+        response = mock.Mock(headers={})
+        if total != "*" and len(self.data) == int(total):
+            response.status_code = 200
+            response.json.return_value = {"size": total}
+            return response
+        response.status_code = 308
+        if self.data:
+            response.headers["Range"] = "bytes=0-%d" % (len(self.data) - 1)
+        return response
+
+
+class TestResumableUpload(TestCase):
+    def upload(self, data, failures, chunk_size=256 << 10):
+        session = FakeUploadSession(failures)
+        client = mock.Mock(_http=session)
+        blob = mock.Mock()
+        upload = ResumableUpload(blob, client, chunk_size,
+                                 sleep=lambda _: None)
+        upload.upload(data)
+        blob._set_properties.assert_called_once_with(
+            {"size": str(len(session.data))})
+        return session
+
+    def test_upload(self):
+        data = os.urandom(600 << 10)
+        session = self.upload(data, [])
+        self.assertEqual(session.data, data)
+        self.assertEqual(session.requests, [
+            "bytes 0-262143/*", "bytes 262144-524287/*",
+            "bytes 524288-614399/614400"])
+        session = self.upload(iter([data[:1000], data[1000:]]), [])
+        self.assertEqual(session.data, data)
+        session = self.upload(b"", [])
+        self.assertEqual(session.requests, ["bytes */0"])
+
+    def test_retry_chunk(self):
+        from requests.exceptions import ConnectionError
+        data = os.urandom(1 << 20)
+        session = self.upload(data, [None, "half", ConnectionError()],
+                              chunk_size=512 << 10)
+        self.assertEqual(session.data, data)
+        self.assertEqual(session.requests, [
+            "bytes 0-524287/*", "bytes 524288-1048575/1048576",
+            "bytes 786432-1048575/1048576", "bytes */1048576"])
+        session = self.upload(data, [ConnectionError(), None],
+                              chunk_size=512 << 10)
+        self.assertEqual(session.requests, [
+            "bytes 0-524287/*", "bytes */*", "bytes 524288-1048575/1048576"])
+        with self.assertRaises(ConnectionError):
+            self.upload(data, [ConnectionError()] * 12)
+
+
+class TestCodec(TestCase):
+    def test_decode_utf8(self):
+        text = u"\u0442\u0435\u043a\u0441\u0442" * 100
+        data = text.encode("utf-8")
+        self.assertEqual(decode_utf8(data), text)
+        # the sniffed prefix ends in the middle of a character
+        self.assertEqual(decode_utf8(data, sniff=101), text)
+        self.assertEqual(decode_utf8(data, sniff=len(data)), text)
+        with self.assertRaises(UnicodeDecodeError):
+            decode_utf8(b"\xff" + data, sniff=10)
+        with self.assertRaises(UnicodeDecodeError):
+            decode_utf8(data + b"\xff", sniff=10)
+
+    def test_encode_base64(self):
+        for size in (0, 1, 56, 57, 58, 1000, 1026):
+            data = os.urandom(size)
+            self.assertEqual(encode_base64(data, 100),
+                             base64.encodebytes(data).decode("ascii"))
+
+    def test_md5_base64(self):
+        self.assertEqual(md5_base64(b"hello world"),
+                         "XrY7u+Ae7tCTyyK7j1rNww==")
+
+    @skipIf(google_crc32c is None, "google-crc32c is not installed")
+    def test_crc32c_base64(self):
+        self.assertEqual(crc32c_base64(b"hello world"), "yZRlqg==")
+
+    def test_iter_base64(self):
+        data = os.urandom(1000)
+        text = base64.encodebytes(data).decode("ascii")
+        self.assertEqual(b"".join(iter_base64(text, 100)), data)
+        with self.assertRaises(Exception):
+            list(iter_base64(text[:-2], 100))
+
+
+class TestWriteCoalescer(TestCase):
+    def test_merge(self):
+        coalescer = WriteCoalescer()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def write(value):
+            calls.append(value)
+            if value == 0:
+                started.set()
+                release.wait()
+            return value
+
+        results = {}
+
+        def save(value):
+            results[value] = coalescer.run("path", lambda: write(value))
+
+        threads = [threading.Thread(target=save, args=(0,))]
+        threads[0].start()
+        started.wait()
+        for value in (1, 2, 3):
+            threads.append(threading.Thread(target=save, args=(value,)))
+            threads[-1].start()
+            # keep the order of the arrivals
+            while coalescer._states["path"].tickets <= value:
+                time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [0, 3])
+        self.assertEqual(results, {0: 0, 1: 3, 2: 3, 3: 3})
+        self.assertEqual(coalescer.executed, 2)
+        self.assertEqual(coalescer.merged, 2)
+        self.assertEqual(coalescer._states, {})
+
+    def test_error(self):
+        coalescer = WriteCoalescer()
+
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            coalescer.run("path", fail)
+        self.assertEqual(coalescer.run("path", lambda: 1), 1)
+
+
+class TestDiskCache(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get_put(self):
+        cache = DiskCache(self.path, 100)
+        with self.assertRaises(KeyError):
+            cache.get(("bucket", "name", 1))
+        cache.put(("bucket", "name", 1), b"12345")
+        cache.put(("bucket", "empty", 1), b"")
+        self.assertEqual(cache.get(("bucket", "name", 1))[:], b"12345")
+        self.assertEqual(cache.get(("bucket", "empty", 1)), b"")
+        with self.assertRaises(KeyError):
+            cache.get(("bucket", "name", 2))
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 2)
+        cache = DiskCache(self.path, 100)
+        self.assertEqual(cache._total, 5)
+        self.assertEqual(cache.get(("bucket", "name", 1))[:], b"12345")
+
+    def test_eviction(self):
+        cache = DiskCache(self.path, 10)
+        cache.put(("a",), b"1234")
+        cache.put(("b",), b"1234")
+        # make the order independent of the timestamp resolution
+        for key, mtime in ((("a",), 1000), (("b",), 2000)):
+            path = os.path.join(self.path, cache.file_name(key))
+            os.utime(path, (mtime, mtime))
+        cache.put(("c",), b"1234")
+        with self.assertRaises(KeyError):
+            cache.get(("a",))
+        cache.get(("b",))
+        cache.get(("c",))
+        cache.put(("d",), b"12345678901")
+        with self.assertRaises(KeyError):
+            cache.get(("d",))
+
+
+class TestRetryPolicy(TestCase):
+    def setUp(self):
+        self.delays = []
+        self.policy = RetryPolicy(attempts=3, initial=1, maximum=3,
+                                  deadline=0, sleep=self.delays.append)
+
+    def failing(self, *errors):
+        errors = list(errors)
+
+        def fn():
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        return fn
+
+    def test_is_retriable(self):
+        self.assertTrue(is_retriable(ServiceUnavailable("")))
+        self.assertTrue(is_retriable(requests.ConnectionError()))
+        self.assertTrue(is_retriable(BrokenPipeError(errno.EPIPE, "")))
+        self.assertFalse(is_retriable(OSError(errno.ENOENT, "")))
+        self.assertFalse(is_retriable(BadRequest("")))
+        self.assertFalse(is_retriable(ServiceUnavailable(""), False))
+        self.assertTrue(is_retriable(TooManyRequests(""), False))
+        self.assertTrue(is_retriable(requests.ConnectTimeout(), False))
+
+    def test_run(self):
+        fn = self.failing(ServiceUnavailable(""), requests.Timeout())
+        self.assertEqual(self.policy.run(fn, "get"), "ok")
+        self.assertEqual(len(self.delays), 2)
+        self.assertTrue(0.5 <= self.delays[0] <= 1)
+        self.assertTrue(1 <= self.delays[1] <= 2)
+        with self.assertRaises(BadRequest):
+            self.policy.run(self.failing(BadRequest("")), "get")
+        with self.assertRaises(ServiceUnavailable):
+            self.policy.run(self.failing(ServiceUnavailable("")), "compose",
+                            idempotent=False)
+        with self.assertRaises(ServiceUnavailable):
+            self.policy.run(self.failing(*[ServiceUnavailable("")] * 4),
+                            "get")
+        self.assertEqual(len(self.delays), 5)
+        self.assertTrue(all(d <= 3 for d in self.delays))
+        self.assertEqual(self.policy.as_dict(), {
+            "retries": {"get": 5}, "exhausted": {"get": 1}})
+
+    def test_deadline(self):
+        now = [0]
+        policy = RetryPolicy(attempts=10, initial=4, maximum=4, deadline=10,
+                             sleep=lambda d: now.__setitem__(0, now[0] + d),
+                             clock=lambda: now[0])
+        with self.assertRaises(ServiceUnavailable):
+            policy.run(self.failing(*[ServiceUnavailable("")] * 10), "get")
+        self.assertLessEqual(now[0], 10)
+        self.assertEqual(policy.exhausted, {"get": 1})
+
+    def test_call(self):
+        fn = mock.Mock(side_effect=[ServiceUnavailable(""), "ok"],
+                       __name__="get_blob")
+        self.assertEqual(self.policy.call(fn, "name", generation=1), "ok")
+        fn.assert_called_with("name", generation=1)
+        self.assertEqual(self.policy.retries, {"get_blob": 1})
+
+
+class TestMetrics(TestCase):
+    def test_observe(self):
+        metrics = Metrics(buckets=(0.1, 1), bucket_label=True)
+        with metrics.operation("get", "bucket"):
+            metrics.observe("get_blob", 0.05)
+            with metrics.operation("save", "other"):
+                metrics.observe("get_bucket", 0.5, ValueError())
+            metrics.observe("delete", 2)
+            metrics.transferred("download", 10)
+        metrics.bind(metrics.transferred)("upload", 5)
+        requests = sorted(metrics.as_dict()["requests"],
+                          key=lambda r: r["call"])
+        self.assertEqual(requests, [{
+            "call": "delete", "operation": "get", "bucket": "bucket",
+            "count": 1, "errors": 0, "seconds": 2, "buckets": [0, 0],
+        }, {
+            "call": "get", "operation": "get", "bucket": "bucket",
+            "count": 2, "errors": 1, "seconds": 0.55, "buckets": [1, 1],
+        }])
+        self.assertEqual(sorted(metrics.bytes.items()), [
+            (("download", "get", "bucket"), 10), (("upload", "", ""), 5)])
+        metrics = Metrics()
+        with metrics.operation("get", "bucket"):
+            metrics.transferred("download", 10)
+        self.assertEqual(list(metrics.bytes), [("download", "get", "")])
+
+    @skipIf(REGISTRY is None, "prometheus_client is not installed")
+    def test_prometheus(self):
+        from prometheus_client import CollectorRegistry, generate_latest
+        metrics = Metrics(buckets=(0.1, 1), bucket_label=True)
+        with metrics.operation("get", "bucket"):
+            metrics.observe("get_blob", 0.05)
+            metrics.observe("get_blob", 0.5)
+            metrics.transferred("download", 10)
+        collector = PrometheusCollector()
+        collector.add(metrics)
+        registry = CollectorRegistry()
+        registry.register(collector)
+        labels = 'bucket="bucket",call="get"%s,operation="get"'
+        lines = (
+            'jgscm_gcs_requests_total{%s} 2.0' % (labels % ""),
+            'jgscm_gcs_request_errors_total{%s} 0.0' % (labels % ""),
+            'jgscm_gcs_request_duration_seconds_bucket{%s} 1.0'
+            % (labels % ',le="0.1"'),
+            'jgscm_gcs_request_duration_seconds_bucket{%s} 2.0'
+            % (labels % ',le="+Inf"'),
+            'jgscm_gcs_bytes_total{bucket="bucket",direction="download",'
+            'operation="get"} 10.0')
+        text = generate_latest(registry).decode()
+        for line in lines:
+            self.assertIn(line, text)
+        # the counters survive the garbage collected instances
+        del metrics
+        gc.collect()
+        text = generate_latest(registry).decode()
+        for line in lines:
+            self.assertIn(line, text)
+        metrics = Metrics(buckets=(0.1, 1), bucket_label=True)
+        with metrics.operation("get", "bucket"):
+            metrics.observe("get_blob", 0.05)
+        collector.add(metrics)
+        self.assertIn('jgscm_gcs_requests_total{%s} 3.0' % (labels % ""),
+                      generate_latest(registry).decode())
+
+    @skipIf(REGISTRY is None, "prometheus_client is not installed")
+    def test_prometheus_no_bucket(self):
+        from prometheus_client import CollectorRegistry, generate_latest
+        metrics = Metrics()
+        with metrics.operation("get", "bucket"):
+            metrics.observe("get_blob", 0.05)
+        collector = PrometheusCollector()
+        collector.add(metrics)
+        registry = CollectorRegistry()
+        registry.register(collector)
+        self.assertIn('jgscm_gcs_requests_total{call="get",operation="get"} '
+                      '1.0', generate_latest(registry).decode())
+
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.events = []
+
+    def start(self, name, kind, attributes):
+        self.events.append(("start", name, kind, attributes))
+        return name
+
+    def end(self, span, error=None):
+        self.events.append(("end", span, error))
+
+
+class TestLoggingTracer(TestCase):
+    def test_log(self):
+        tracer = LoggingTracer()
+        with self.assertLogs("jgscm", "DEBUG") as logs:
+            tracer.end(tracer.start("get", "contents", {"path": "a/b"}))
+            tracer.end(tracer.start("get_blob", "gcs", {}), ValueError())
+        self.assertEqual(len(logs.output), 4)
+        self.assertIn("start contents get {'path': 'a/b'}", logs.output[0])
+        self.assertIn("ValueError", logs.output[3])
+        tracer.log = mock.Mock(**{"isEnabledFor.return_value": False})
+        self.assertIsNone(tracer.start("get", "contents", {}))
+        self.assertFalse(tracer.log.debug.called)
+
+
+@skipIf(TracerProvider is None, "opentelemetry-sdk is not installed")
+class TestOpenTelemetryTracer(TestCase):
+    def test_spans(self):
+        exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(exporter))
+        tracer = OpenTelemetryTracer(provider)
+        outer = tracer.start("get", "contents", {"path": "a/b"})
+        tracer.end(tracer.start("get_blob", "gcs", {}), ValueError())
+        tracer.end(outer)
+        inner, outer = exporter.get_finished_spans()
+        self.assertEqual(outer.name, "jgscm get")
+        self.assertEqual(dict(outer.attributes), {"jgscm.path": "a/b"})
+        self.assertEqual(inner.name, "gcs get_blob")
+        self.assertEqual(inner.parent.span_id, outer.context.span_id)
+        self.assertFalse(inner.status.is_ok)
+
+
+class TestFakeGCS(TestCase):
+    def setUp(self):
+        self.storage = FakeStorage()
+        self.bucket = FakeClient(storage=self.storage).create_bucket("b")
+        for name in ("a/1", "a/2", "b", "c/d/1", "c/e", "d"):
+            self.storage.put("b", name, b"data")
+        self.storage.calls.clear()
+
+    def list_all(self, **kwargs):
+        names, token = [], None
+        while True:
+            page = self.bucket.list_blobs(page_token=token, **kwargs)
+            names.extend(b.name for b in page)
+            names.extend(sorted(page.prefixes))
+            token = page.next_page_token
+            if token is None:
+                return names
+
+    def test_list_blobs(self):
+        self.assertEqual(self.list_all(max_results=2),
+                         ["a/1", "a/2", "b", "c/d/1", "c/e", "d"])
+        self.assertEqual(self.list_all(max_results=1, delimiter="/"),
+                         ["a/", "b", "c/", "d"])
+        self.assertEqual(self.list_all(prefix="c/", delimiter="/"),
+                         ["c/e", "c/d/"])
+        self.assertEqual(self.storage.calls["list"], 3 + 4 + 1)
+
+    def test_requests(self):
+        latencies = []
+        self.storage.latency = lambda kind: latencies.append(kind) or 0
+        self.assertEqual(self.bucket.get_blob("b").download_as_bytes(),
+                         b"data")
+        with self.bucket.client.batch():
+            self.bucket.blob("b").delete()
+            self.bucket.blob("d").delete()
+        self.assertIsNone(self.bucket.get_blob("b"))
+        self.assertEqual(latencies, ["get", "download", "batch", "get"])
+        self.assertEqual(self.storage.requests, 4)
+        self.assertEqual(self.storage.calls["batched delete"], 2)
+
+
+class TestTransport(TestCase):
+    def test_configure_session(self):
+        session = configure_session(requests.Session(), 4, timeout=5,
+                                    keepalive=False)
+        adapter = session.get_adapter("https://storage.googleapis.com")
+        self.assertIsInstance(adapter, PoolAdapter)
+        self.assertEqual(adapter.poolmanager.connection_pool_kw["maxsize"],
+                         4)
+        self.assertEqual(session.headers["Connection"], "close")
+        configure_session(session, 4)
+        self.assertNotIn("Connection", session.headers)
+
+    def test_default_timeout(self):
+        adapter = PoolAdapter(4, timeout=5)
+        with mock.patch("requests.adapters.HTTPAdapter.send") as send:
+            adapter.send(None)
+            self.assertEqual(send.call_args[1]["timeout"], 5)
+            adapter.send(None, timeout=1)
+            self.assertEqual(send.call_args[1]["timeout"], 1)
+
+
+class DictBackend(StorageBackend):
+    """Keeps the objects in memory as a single page listings."""
+
+    def __init__(self, *buckets):
+        self.buckets = {b: {} for b in buckets}
+        self.generations = itertools.count(1)
+
+    def get(self, bucket, name):
+        try:
+            return self.buckets[bucket][name]
+        except KeyError:
+            raise NotFound("%s/%s" % (bucket, name))
+
+    def list_buckets(self):
+        return sorted(self.buckets)
+
+    def bucket_exists(self, bucket):
+        return bucket in self.buckets
+
+    def create_bucket(self, bucket):
+        if bucket in self.buckets:
+            raise Conflict(bucket)
+        self.buckets[bucket] = {}
+
+    def delete_bucket(self, bucket):
+        if self.buckets[bucket]:
+            raise Conflict(bucket)
+        del self.buckets[bucket]
+
+    def list(self, bucket, prefix, delimiter=None, page_size=None,
+             token=None):
+        objects, prefixes = [], set()
+        for name, (obj, _) in sorted(self.buckets[bucket].items()):
+            if not name.startswith(prefix):
+                continue
+            end = name.find(delimiter, len(prefix)) if delimiter else -1
+            if end >= 0:
+                prefixes.add(name[:end + 1])
+            else:
+                objects.append(obj)
+        return objects, prefixes, None
+
+    def stat(self, bucket, name):
+        try:
+            return self.get(bucket, name)[0]
+        except NotFound:
+            return None
+
+    def read(self, bucket, name, generation=None):
+        obj, data = self.get(bucket, name)
+        if generation is not None and obj.generation != generation:
+            raise NotFound(name)
+        return data
+
+    def read_range(self, bucket, name, start, end, generation=None):
+        return self.read(bucket, name, generation)[start:end + 1]
+
+    def check(self, bucket, name, generation):
+        if generation is None:
+            return
+        obj = self.stat(bucket, name)
+        if (obj.generation if obj else 0) != generation:
+            raise PreconditionFailed(name)
+
+    def write(self, bucket, name, data, content_type, metadata=None,
+              if_generation_match=None):
+        self.check(bucket, name, if_generation_match)
+        if not isinstance(data, bytes):
+            data = b"".join(data)
+        obj = StorageObject(
+            bucket, name, size=len(data), updated=datetime.now(UTC),
+            content_type=content_type, generation=next(self.generations),
+            md5_hash=md5_base64(data), metadata=metadata)
+        self.buckets[bucket][name] = obj, data
+        return obj
+
+    def copy(self, bucket, name, new_bucket, new_name):
+        obj, data = self.get(bucket, name)
+        return self.write(new_bucket, new_name, data, obj.content_type,
+                          obj.metadata)
+
+    def compose(self, bucket, sources, name, content_type, metadata=None,
+                if_generation_match=None, source_generations=None):
+        data = b"".join(self.read(bucket, s) for s in sources)
+        for source, generation in zip(sources, source_generations or ()):
+            self.check(bucket, source, generation)
+        return self.write(bucket, name, data, content_type, metadata,
+                          if_generation_match)
+
+    def delete(self, bucket, name, if_generation_match=None):
+        self.get(bucket, name)
+        self.check(bucket, name, if_generation_match)
+        del self.buckets[bucket][name]
+
+    def batch_delete(self, bucket, names):
+        for name in names:
+            self.buckets[bucket].pop(name, None)
+
+
+class TestStorageBackend(TestCase):
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            StorageBackend()
+
+        class Partial(BackendDecorator):
+            pass
+
+        self.assertIsInstance(Partial(DictBackend()), StorageBackend)
+
+    def test_contents_manager(self):
+        cm = GoogleStorageContentManager()
+        cm._backend = CountingBackend(DictBackend("b"))
+        nb = nbformat.v4.new_notebook()
+        cm.save({"type": "notebook", "content": nb}, "b/dir/nb.ipynb")
+        cm.save({"type": "file", "content": "text", "format": "text"},
+                "b/dir/file.txt")
+        self.assertEqual(len(cm.list_checkpoints("b/dir/nb.ipynb")), 1)
+        model = cm.get("b/dir")
+        self.assertEqual(sorted(m["name"] for m in model["content"]),
+                         [".ipynb_checkpoints", "file.txt", "nb.ipynb"])
+        cm.rename_file("b/dir", "b/new")
+        self.assertEqual(cm.get("b/new/file.txt")["content"], "text")
+        self.assertEqual(cm.get("b/new/nb.ipynb")["content"], nb)
+        cm.delete_file("b/new")
+        self.assertEqual(cm.get("b")["content"], [])
+        self.assertEqual(cm.backend.calls["batch_delete"], 1)
+        self.assertEqual([m["name"] for m in cm.get("")["content"]], ["b"])
+
+
 if __name__ == "__main__":
     main()
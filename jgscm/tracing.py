@@ -0,0 +1,142 @@
+from functools import wraps
+import logging
+import time
+
+from jgscm.metrics import path_argument
+
+try:
+    from opentelemetry import context as otel_context, trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+try:
+    _clock = time.monotonic
+except AttributeError:
+    _clock = time.time
+
+#: The kind of the spans of the contents manager and checkpoints methods.
+CONTENTS = "contents"
+#: The kind of the spans of the GCS request attempts.
+GCS = "gcs"
+
+
+class Tracer(object):
+    """
+    Receives the span start and end callbacks of the contents operations
+    and of the GCS requests which they send. The base class does nothing;
+    override both methods.
+    """
+
+    def start(self, name, kind, attributes):
+        """
+        Called before the operation starts.
+        :param name: the method name, e.g. "get" or "get_blob".
+        :param kind: CONTENTS or GCS.
+        :param attributes: dict with the operation's details, e.g. "path".
+        :return: the span object which is passed to end().
+        """
+        return None
+
+    def end(self, span, error=None):
+        """
+        Called after the operation finishes.
+        :param span: the object returned by start().
+        :param error: the raised exception or None.
+        """
+
+
+class LoggingTracer(Tracer):
+    """
+    Logs the operations and their durations on the debug level.
+    """
+
+    def __init__(self, log=None):
+        """
+        :param log: :class:`logging.Logger` instance. The contents
+                    manager sets its own logger if it is None.
+        """
+        self.log = log
+
+    def start(self, name, kind, attributes):
+        log = self.log or logging.getLogger("jgscm")
+        if not log.isEnabledFor(logging.DEBUG):
+            return None
+        log.debug("start %s %s %s", kind, name, attributes)
+        return log, name, kind, _clock()
+
+    def end(self, span, error=None):
+        if span is None:
+            return
+        log, name, kind, start = span
+        if error is None:
+            log.debug("end %s %s in %.3fs", kind, name, _clock() - start)
+        else:
+            log.debug("end %s %s in %.3fs: %r", kind, name,
+                      _clock() - start, error)
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Reports the operations as OpenTelemetry spans "jgscm <name>" and
+    "gcs <name>". The GCS requests become the children of the contents
+    operation which sends them from the same thread. The exporters are
+    configured through the global tracer provider as usual.
+    """
+
+    def __init__(self, tracer_provider=None):
+        """
+        :param tracer_provider: :class:`opentelemetry.trace.TracerProvider`.
+                                The global one is used by default.
+        """
+        if otel_trace is None:
+            raise ImportError("OpenTelemetryTracer requires opentelemetry-api")
+        self.tracer = otel_trace.get_tracer(
+            "jgscm", tracer_provider=tracer_provider)
+
+    def start(self, name, kind, attributes):
+        span = self.tracer.start_span(
+            "%s %s" % ("jgscm" if kind == CONTENTS else kind, name),
+            attributes={"jgscm." + k: v for k, v in attributes.items()})
+        token = otel_context.attach(otel_trace.set_span_in_context(span))
+        return span, token
+
+    def end(self, span, error=None):
+        span, token = span
+        otel_context.detach(token)
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR,
+                                              repr(error)))
+        span.end()
+
+
+def traced(fn):
+    """
+    Decorates a method of the contents manager or the checkpoints which
+    have the tracer property: the method is reported to the tracer as a
+    CONTENTS span with its path argument. Costs a single attribute lookup
+    if tracing is disabled.
+    """
+    get_path = path_argument(fn)
+    name = fn.__name__
+
+    @wraps(fn)
+    def wrapped(self, *args, **kwargs):
+        tracer = self.tracer
+        if tracer is None:
+            return fn(self, *args, **kwargs)
+        path = get_path(args, kwargs)
+        bucket = getattr(path, "bucket", None)
+        if bucket is not None:
+            # a StorageObject or a Blob
+            path = getattr(bucket, "name", bucket) + "/" + path.name
+        span = tracer.start(name, CONTENTS, {"path": path})
+        try:
+            result = fn(self, *args, **kwargs)
+        except Exception as e:
+            tracer.end(span, e)
+            raise
+        tracer.end(span)
+        return result
+
+    return wrapped
@@ -0,0 +1,43 @@
+from requests.adapters import HTTPAdapter
+
+
+class PoolAdapter(HTTPAdapter):
+    """
+    HTTP adapter with the configurable connection pool size which applies
+    the default timeout to the requests sent without one.
+    """
+
+    def __init__(self, pool_size, timeout=None, **kwargs):
+        """
+        :param pool_size: the maximum number of the kept-alive connections
+                          per host.
+        :param timeout: the default timeout in seconds. None waits forever.
+        """
+        self.timeout = timeout
+        super(PoolAdapter, self).__init__(
+            pool_connections=pool_size, pool_maxsize=pool_size, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super(PoolAdapter, self).send(request, **kwargs)
+
+
+def configure_session(session, pool_size, timeout=None, keepalive=True):
+    """
+    Replaces the connection pools of the requests session.
+    :param session: :class:`requests.Session`, e.g. the authorized session
+                    of :class:`google.cloud.storage.Client`.
+    :param pool_size: the maximum number of the kept-alive connections.
+    :param timeout: the default request timeout in seconds.
+    :param keepalive: value indicating whether to reuse the connections.
+    :return: the session.
+    """
+    adapter = PoolAdapter(pool_size, timeout=timeout)
+    for prefix in ("https://", "http://"):
+        session.mount(prefix, adapter)
+    if keepalive:
+        session.headers.pop("Connection", None)
+    else:
+        session.headers["Connection"] = "close"
+    return session
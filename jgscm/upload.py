@@ -0,0 +1,158 @@
+from functools import partial
+import time
+
+from google.cloud.exceptions import from_http_response
+from requests.exceptions import ConnectionError as HTTPConnectionError, \
+    Timeout
+
+from jgscm.retry import RETRIABLE_STATUSES, RetryPolicy
+
+#: GCS requires all the chunks except the last to be multiples of this size.
+CHUNK_GRANULARITY = 256 << 10
+
+
+class ResumableUpload(object):
+    """
+    Uploads the blob contents in chunks through a GCS resumable upload
+    session. A chunk which fails to upload is retried starting from the
+    last byte which GCS has persisted, so a dropped connection does not
+    restart the whole upload.
+    """
+
+    def __init__(self, blob, client, chunk_size, retries=5,
+                 content_type=None, sleep=time.sleep, policy=None,
+                 timeout=None, if_generation_match=None):
+        """
+        :param blob: :class:`google.cloud.storage.Blob` to upload.
+        :param client: :class:`google.cloud.storage.Client` instance.
+        :param chunk_size: the number of bytes sent in one request. It is
+                           rounded down to a multiple of 256 KiB.
+        :param retries: the maximum number of consecutive failed requests.
+        :param content_type: the blob's content type.
+        :param sleep: the function which waits between the retries.
+        :param policy: :class:`jgscm.retry.RetryPolicy` which counts the
+                       retries and sets the delays between them. sleep is
+                       ignored if it is specified.
+        :param timeout: the timeout of every request in seconds. None waits
+                        forever.
+        :param if_generation_match: the required generation of the blob
+                                    before the upload, 0 if it must not
+                                    exist, or None.
+        """
+        self.blob = blob
+        self.client = client
+        self.chunk_size = max(chunk_size // CHUNK_GRANULARITY, 1) * \
+            CHUNK_GRANULARITY
+        self.retries = retries
+        self.content_type = content_type
+        if policy is None:
+            policy = RetryPolicy(initial=2, maximum=32, sleep=sleep)
+        self.policy = policy
+        self.timeout = timeout
+        self.if_generation_match = if_generation_match
+        self.url = None
+        self.offset = 0
+
+    def upload(self, data):
+        """
+        Uploads the data and updates the blob's properties.
+        :param data: bytes or an iterable of bytes-like pieces of any size.
+        :return: None
+        """
+        self.url = self.policy.call(
+            self.blob.create_resumable_upload_session,
+            content_type=self.content_type, client=self.client, retry=None,
+            timeout=self.timeout,
+            if_generation_match=self.if_generation_match)
+        self.offset = 0
+        resource = None
+        for chunk, last in self._chunks(data):
+            resource = self._send(chunk, last)
+        self.blob._set_properties(resource)
+
+    def _chunks(self, data):
+        """
+        Splits the data into chunks of chunk_size.
+        :return: generator of tuple(chunk, whether it is the last).
+        """
+        size = self.chunk_size
+        if isinstance(data, (bytes, bytearray)):
+            view = memoryview(data)
+            start = 0
+            while len(view) - start > size:
+                yield view[start:start + size], False
+                start += size
+            yield view[start:], True
+            return
+        buffer = bytearray()
+        for piece in data:
+            buffer += piece
+            while len(buffer) > size:
+                yield bytes(buffer[:size]), False
+                del buffer[:size]
+        yield bytes(buffer), True
+
+    def _send(self, chunk, last):
+        """
+        Sends the chunk and the parts of it which GCS did not persist.
+        :param chunk: bytes-like object which starts at self.offset.
+        :param last: whether the chunk finishes the upload.
+        :return: the blob's resource dict if the upload is finished,
+                 otherwise None.
+        """
+        end = self.offset + len(chunk)
+        total = str(end) if last else "*"
+        failures = 0
+        query = False
+        while True:
+            if query or len(chunk) == 0:
+                # ask how many bytes GCS has got or finish the upload
+                body, crange = b"", "bytes */%s" % total
+            else:
+                body = bytes(chunk)
+                crange = "bytes %d-%d/%s" % (self.offset, end - 1, total)
+            try:
+                response = self.policy.attempt(partial(
+                    self.client._http.put, self.url, data=body,
+                    headers={"Content-Range": crange}, timeout=self.timeout),
+                    "resumable_upload")
+                error = None
+            except (HTTPConnectionError, Timeout) as e:
+                response, error = None, e
+            if response is not None:
+                status = response.status_code
+                if status in (200, 201):
+                    self.offset = end
+                    return response.json()
+                if status == 308:
+                    persisted = self._persisted(response)
+                    if persisted >= end and not last:
+                        self.offset = end
+                        return None
+                    progress = persisted > self.offset
+                    chunk = chunk[persisted - self.offset:]
+                    self.offset = persisted
+                    if progress:
+                        failures = 0
+                    if progress or query:
+                        query = False
+                        continue
+                elif status not in RETRIABLE_STATUSES:
+                    raise from_http_response(response)
+                error = from_http_response(response)
+            failures += 1
+            if failures > self.retries:
+                raise error
+            self.policy.wait(failures, "resumable_upload")
+            query = True
+
+    @staticmethod
+    def _persisted(response):
+        """
+        :param response: 308 response of the upload session.
+        :return: the number of bytes persisted by GCS.
+        """
+        crange = response.headers.get("Range")
+        if not crange:
+            return 0
+        return int(crange.rsplit("-", 1)[1]) + 1
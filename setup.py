@@ -11,18 +11,24 @@ setup(
     url="https://github.com/src-d/jgscm",
     download_url="https://github.com/src-d/jgscm",
     packages=["jgscm"],
+    python_requires=">=3.6",
     keywords=["jupyter", "ipython", "gcloud", "gcs"],
-    install_requires=["google-cloud>=0.32.0", "notebook>=4.2", "nbformat>=4.1",
-                      "tornado>=4", "traitlets>=4.2"],
+    install_requires=["google-cloud-storage>=2.0.0", "notebook>=4.2",
+                      "nbformat>=4.1", "tornado>=4", "traitlets>=4.2"],
+    extras_require={"async": ["jupyter_server>=1.0"],
+                    "crc32c": ["google-crc32c>=1.0"],
+                    "prometheus": ["prometheus_client>=0.4"],
+                    "opentelemetry": ["opentelemetry-api>=1.0"]},
     package_data={"": ["requirements.txt", "LICENSE", "README.md"]},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: End Users/Desktop",
         "License :: OSI Approved :: MIT License",
-        "Programming Language :: Python :: 2.7",
-        "Programming Language :: Python :: 3.2",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
         "Topic :: Software Development :: Libraries"
     ]
 )